@@ -0,0 +1,127 @@
+"""
+ベクトル圧縮レポート
+
+合成ログのチャンクを埋め込み、flat / sq8 / sqfp16 / pq の各方式について
+1チャンクあたりのメモリ量・recall@k（flatの厳密検索を正解とする）・検索レイテンシを計測します。
+--rerank-factor を指定すると、生ベクトルでの再ランキングを行った場合の recall@k も出力します。
+
+使用例:
+    PYTHONPATH=/path/to/intelligent_log_analyzer python benchmarks/compression_report.py --chunks 50000
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.dirname(__file__))
+
+import faiss
+import numpy as np
+from log_generator import SyntheticLogGenerator
+from src.core.embedder import HashEmbedder, create_embedder
+from src.core.vector_index import INDEX_TYPES, RawVectorStore, create_index, rerank_exact
+
+
+def recall_at_k(ground_truth, found, k):
+    """正解の上位k件のうち、検索結果の上位k件に含まれる割合"""
+    hits = 0
+    for truth, result in zip(ground_truth, found):
+        hits += len(set(truth[:k]) & set(result[:k]))
+    return hits / (len(ground_truth) * k)
+
+
+def generate_vectors(args):
+    generator = SyntheticLogGenerator(template_count=args.templates, seed=args.seed)
+    lines = generator.iter_lines()
+    texts = [next(lines) for _ in range(args.chunks + args.queries)]
+    embedder = create_embedder() if args.use_settings_embedder else HashEmbedder(args.dim)
+    vectors = np.vstack(
+        [embedder.embed(texts[start : start + 4096]) for start in range(0, len(texts), 4096)]
+    ).astype(np.float32)
+    return vectors[: args.chunks], vectors[args.chunks :]
+
+
+def run(args):
+    data, queries = generate_vectors(args)
+    dim = data.shape[1]
+    flat = faiss.IndexFlatL2(dim)
+    flat.add(data)
+    _, truth = flat.search(queries, args.k)
+
+    train = data[np.random.default_rng(args.seed).choice(len(data), min(args.train_size, len(data)), replace=False)]
+    results = {"chunks": len(data), "dim": dim, "k": args.k, "queries": len(queries), "index_types": {}}
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        raw_vectors = RawVectorStore(os.path.join(work_dir, "vectors.f32"), dim)
+        raw_vectors.append(data)
+
+        for index_type in INDEX_TYPES:
+            index = create_index(index_type, dim, args.pq_m, args.pq_nbits)
+            start = time.perf_counter()
+            if not index.is_trained:
+                index.train(train)
+            train_seconds = time.perf_counter() - start
+            index.add(data)
+
+            start = time.perf_counter()
+            D, I = index.search(queries, args.k)
+            search_seconds = time.perf_counter() - start
+
+            entry = {
+                "bytes_per_chunk": index.code_size,
+                "index_bytes": len(faiss.serialize_index(index)),
+                "compression_ratio": 4 * dim / index.code_size,
+                "gb_per_100m_chunks": index.code_size * 100_000_000 / 1024**3,
+                "train_seconds": train_seconds,
+                f"recall@{args.k}": recall_at_k(truth, I, args.k),
+                "search_ms_per_query": search_seconds / len(queries) * 1000.0,
+            }
+
+            if args.rerank_factor > 0 and index_type != "flat":
+                start = time.perf_counter()
+                D, I = index.search(queries, args.k * args.rerank_factor)
+                D, I = rerank_exact(raw_vectors, queries, D, I, args.k)
+                rerank_seconds = time.perf_counter() - start
+                entry[f"reranked_recall@{args.k}"] = recall_at_k(truth, I, args.k)
+                entry["reranked_search_ms_per_query"] = rerank_seconds / len(queries) * 1000.0
+
+            results["index_types"][index_type] = entry
+            print(f"{index_type}: {entry['bytes_per_chunk']}バイト/チャンク, recall@{args.k}={entry[f'recall@{args.k}']:.3f}")
+        raw_vectors.close()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ベクトル圧縮方式ごとのメモリ量とrecall@kを計測")
+    parser.add_argument("--chunks", type=int, default=20000, help="インデックスに登録するチャンク数")
+    parser.add_argument("--queries", type=int, default=200, help="recall計測に使うクエリ数")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dim", type=int, default=512, help="ハッシュ埋め込みの次元数")
+    parser.add_argument("--use-settings-embedder", action="store_true", help="settings.pyの埋め込み設定を使用")
+    parser.add_argument("--pq-m", type=int, default=64)
+    parser.add_argument("--pq-nbits", type=int, default=8)
+    parser.add_argument("--train-size", type=int, default=10000)
+    parser.add_argument("--rerank-factor", type=int, default=4, help="再ランキングの候補倍率（0で無効）")
+    parser.add_argument("--templates", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="結果JSONの出力先（省略時は標準出力）")
+    args = parser.parse_args()
+
+    results = run(args)
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text)
+        print(f"レポートを保存しました: {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
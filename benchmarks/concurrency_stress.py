@@ -0,0 +1,210 @@
+"""
+同時取り込み・検索のストレステスト
+
+1つのRAGインスタンスに対して、書き込みスレッド（埋め込み → add_embedded）、検索スレッド（query / query_many）、
+任意で削除スレッド（remove_ids → コンパクション）を同時に走らせ、次の整合性を確認します。
+  - 検索結果のテキストとメタデータが同じチャンクのものである（インデックスにだけ存在するチャンクを返さない）
+  - 削除が完了したチャンクが、その後に始めた検索で返らない
+  - 検索で例外が発生しない
+あわせて、書き込みのない状態と書き込み中の検索レイテンシを比較します。
+
+使用例:
+    PYTHONPATH=/path/to/intelligent_log_analyzer python benchmarks/concurrency_stress.py --writers 2 --readers 4 --duration 10
+"""
+
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.dirname(__file__))
+
+from log_generator import SyntheticLogGenerator
+from run_benchmarks import QUERIES, latency_summary
+from src.core.rag import RAG
+
+
+class StressState:
+    """スレッド間で共有する計測結果と削除済みIDの記録"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.phase = "idle"
+        self.latencies = {"idle": [], "load": []}
+        self.write_seconds = []
+        self.written = 0
+        self.removed_at = {}  # 削除が完了したID -> 完了時刻
+        self.violations = []
+        self.errors = []
+
+    def violation(self, message):
+        with self.lock:
+            if len(self.violations) < 20:
+                self.violations.append(message)
+
+
+def check_results(state, results, started):
+    """検索結果の整合性を確認"""
+    for result in results:
+        tag = result["metadata"].get("tag")
+        if tag is None or not result["text"].startswith(f"[{tag}]"):
+            state.violation(f"テキストとメタデータが一致しません: id={result['id']} tag={tag}")
+        removed_at = state.removed_at.get(result["id"])
+        if removed_at is not None and removed_at < started:
+            state.violation(f"削除済みのチャンクが返りました: id={result['id']}")
+
+
+def reader(rag, state, seed, batch_queries):
+    r = random.Random(seed)
+    while not state.stop.is_set():
+        # クエリキャッシュに当たらないよう毎回異なるクエリにする
+        texts = [f"{r.choice(QUERIES)} {r.randint(0, 10**9)}" for _ in range(batch_queries)]
+        phase = state.phase
+        started = time.time()
+        start = time.perf_counter()
+        try:
+            if batch_queries > 1:
+                searched = rag.query_many(texts, k=5)
+            else:
+                searched = [rag.query(texts[0], k=5)]
+        except Exception as e:
+            with state.lock:
+                state.errors.append(repr(e))
+            continue
+        elapsed = time.perf_counter() - start
+        for results in searched:
+            check_results(state, results, started)
+        with state.lock:
+            state.latencies[phase].append(elapsed)
+
+
+def writer(rag, state, writer_id, lines, batch_size, embed_ms):
+    sequence = 0
+    position = writer_id * 7919  # 書き込みスレッドごとに異なる行から始める
+    while not state.stop.is_set():
+        texts, metadata = [], []
+        for _ in range(batch_size):
+            tag = f"w{writer_id}-{sequence}"
+            texts.append(f"[{tag}] {lines[position % len(lines)]}")
+            metadata.append({"tag": tag})
+            sequence += 1
+            position += 1
+        vectors = rag.embed(texts)
+        if embed_ms:
+            time.sleep(embed_ms / 1000.0)  # モデル埋め込みの所要時間を模擬（ロックの外）
+        start = time.perf_counter()
+        rag.add_embedded(texts, vectors, metadata)
+        elapsed = time.perf_counter() - start
+        with state.lock:
+            state.write_seconds.append(elapsed)
+            state.written += len(texts)
+
+
+def remover(rag, state, seed, remove_batch, interval):
+    r = random.Random(seed)
+    while not state.stop.wait(interval):
+        if rag.next_id == 0:
+            continue
+        ids = [r.randrange(rag.next_id) for _ in range(remove_batch)]
+        rag.remove_ids(ids)
+        finished = time.time()
+        with state.lock:
+            for chunk_id in ids:
+                state.removed_at.setdefault(chunk_id, finished)
+        if rag.needs_compaction():
+            rag.compact()
+
+
+def run(args):
+    lines = list(itertools.islice(SyntheticLogGenerator(seed=args.seed, stacktrace_ratio=0.0).iter_lines(), args.lines))
+    rag = RAG(args.vector_dim, index_type=args.index_type, query_cache_size=0, embedding_cache_size=0)
+    initial = lines[: args.initial]
+    rag.add_texts(
+        [f"[init-{i}] {line}" for i, line in enumerate(initial)], [{"tag": f"init-{i}"} for i in range(len(initial))]
+    )
+    state = StressState()
+
+    readers = [
+        threading.Thread(target=reader, args=(rag, state, args.seed + i, args.batch_queries), daemon=True)
+        for i in range(args.readers)
+    ]
+    for thread in readers:
+        thread.start()
+    time.sleep(args.idle_seconds)  # 書き込みのない状態のレイテンシ
+
+    state.phase = "load"
+    workers = [
+        threading.Thread(target=writer, args=(rag, state, i, lines, args.batch_size, args.embed_ms), daemon=True)
+        for i in range(args.writers)
+    ]
+    if args.remove_batch:
+        workers.append(
+            threading.Thread(
+                target=remover, args=(rag, state, args.seed, args.remove_batch, args.remove_interval), daemon=True
+            )
+        )
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    time.sleep(args.duration)
+    state.stop.set()
+    for thread in workers + readers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    return {
+        "params": vars(args).copy(),
+        "chunks": len(rag),
+        "written": state.written,
+        "writes_per_sec": state.written / elapsed if elapsed else None,
+        "write_publish": latency_summary(state.write_seconds),
+        "query_idle": latency_summary(state.latencies["idle"]),
+        "query_under_load": latency_summary(state.latencies["load"]),
+        "removed": len(state.removed_at),
+        "violations": state.violations,
+        "errors": state.errors[:20],
+        "consistent": not state.violations and not state.errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="1つのRAGに対する同時取り込み・検索のストレステスト")
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--duration", type=float, default=10.0, help="書き込み中の計測時間（秒）")
+    parser.add_argument("--idle-seconds", type=float, default=2.0, help="書き込みなしの計測時間（秒）")
+    parser.add_argument("--batch-size", type=int, default=256, help="書き込み1回あたりのチャンク数")
+    parser.add_argument("--embed-ms", type=float, default=50.0, help="埋め込み1バッチあたりの模擬所要時間（ミリ秒）")
+    parser.add_argument("--batch-queries", type=int, default=1, help="1回の検索でまとめるクエリ数（2以上でquery_many）")
+    parser.add_argument("--remove-batch", type=int, default=0, help="削除スレッドが1回に削除するID数（0で削除なし）")
+    parser.add_argument("--remove-interval", type=float, default=0.2, help="削除の間隔（秒）")
+    parser.add_argument("--index-type", default="flat", choices=["flat", "sq8", "sqfp16", "pq"])
+    parser.add_argument("--vector-dim", type=int, default=512)
+    parser.add_argument("--initial", type=int, default=5000, help="開始前に追加しておくチャンク数")
+    parser.add_argument("--lines", type=int, default=20000, help="書き込みに使う合成ログの行数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="結果JSONの出力先（省略時は標準出力）")
+    args = parser.parse_args()
+
+    results = run(args)
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text)
+        print(f"ストレステストの結果を保存しました: {args.output}")
+    else:
+        print(text)
+    if not results["consistent"]:
+        print("整合性の違反が見つかりました", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
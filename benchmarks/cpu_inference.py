@@ -0,0 +1,117 @@
+"""
+CPU推論ベンチマーク
+
+CPU_QUANTIZATION の各モード（float32 / int8_dynamic / bfloat16）について、モデルを別プロセスで読み込み、
+プリフィル時間・デコード速度（トークン/秒）・RSSを計測します。モードごとにプロセスを分けるのは、
+スレッド設定やRSSが前のモードの影響を受けないようにするためです。
+
+使用例:
+    PYTHONPATH=/path/to/intelligent_log_analyzer python benchmarks/cpu_inference.py --threads 8 --affinity 0-7
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+
+MODES = ["float32", "int8_dynamic", "bfloat16"]
+
+
+def run_single(args):
+    """1つのモードを計測してJSONを標準出力に書く（子プロセスで実行）"""
+    from config import settings
+
+    settings.USE_GPU = False
+    settings.FORCE_GPU = False
+    settings.QUANTIZATION = None
+    settings.TORCH_DTYPE = "float32"
+    settings.CPU_QUANTIZATION = None if args.mode == "float32" else args.mode
+    settings.TORCH_NUM_THREADS = args.threads
+    settings.TORCH_NUM_INTEROP_THREADS = args.interop_threads
+    settings.CPU_AFFINITY = args.affinity
+
+    from src.core.llm import LLM
+
+    llm = LLM(args.model or settings.MODEL)
+    llm.measure_generation(max_new_tokens=4)  # ウォームアップ
+    runs = [llm.measure_generation(args.prompt, args.max_new_tokens) for _ in range(args.repeat)]
+    speeds = [run["decode_tokens_per_sec"] for run in runs if run["decode_tokens_per_sec"]]
+    result = {
+        "mode": args.mode,
+        "threads": llm.cpu_report["num_threads"],
+        "interop_threads": llm.cpu_report["interop_threads"],
+        "affinity": llm.cpu_report["affinity"],
+        "rss_after_load_bytes": llm.cpu_report.get("rss_after_bytes"),
+        "rss_bytes": max(run["rss_bytes"] or 0 for run in runs),
+        "prefill_seconds": min(run["prefill_seconds"] for run in runs),
+        "decode_tokens_per_sec": max(speeds) if speeds else None,
+    }
+    print("RESULT " + json.dumps(result))
+
+
+def run_all(args):
+    results = []
+    for mode in args.modes:
+        command = [sys.executable, os.path.abspath(__file__), "--single", mode]
+        command += ["--max-new-tokens", str(args.max_new_tokens), "--repeat", str(args.repeat), "--prompt", args.prompt]
+        if args.threads:
+            command += ["--threads", str(args.threads)]
+        if args.interop_threads:
+            command += ["--interop-threads", str(args.interop_threads)]
+        if args.affinity:
+            command += ["--affinity", args.affinity]
+        if args.model:
+            command += ["--model", args.model]
+        print(f"計測中: {mode}")
+        completed = subprocess.run(command, capture_output=True, text=True)
+        lines = [line for line in completed.stdout.splitlines() if line.startswith("RESULT ")]
+        if completed.returncode != 0 or not lines:
+            print(f"  失敗しました: {completed.stderr.strip().splitlines()[-1:] or completed.returncode}")
+            continue
+        results.append(json.loads(lines[-1][len("RESULT ") :]))
+
+    baseline = next((result for result in results if result["mode"] == "float32"), None)
+    print(f"\n{'モード':<14}{'デコード(tok/s)':>16}{'プリフィル(s)':>14}{'RSS(GB)':>10}{'速度比':>8}{'RSS比':>8}")
+    for result in results:
+        speed = result["decode_tokens_per_sec"] or 0.0
+        rss = result["rss_bytes"] or 0
+        speed_ratio = speed / baseline["decode_tokens_per_sec"] if baseline and baseline["decode_tokens_per_sec"] else None
+        rss_ratio = rss / baseline["rss_bytes"] if baseline and baseline["rss_bytes"] else None
+        print(
+            f"{result['mode']:<14}{speed:>16.2f}{result['prefill_seconds']:>14.3f}{rss / 1024**3:>10.2f}"
+            f"{speed_ratio or 0:>8.2f}{rss_ratio or 0:>8.2f}"
+        )
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
+        print(f"\n結果を保存しました: {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU推論モードごとのトークン/秒とRSSを計測")
+    parser.add_argument("--modes", nargs="+", default=MODES, choices=MODES)
+    parser.add_argument("--threads", type=int, default=None, help="TORCH_NUM_THREADS")
+    parser.add_argument("--interop-threads", type=int, default=None, help="TORCH_NUM_INTEROP_THREADS")
+    parser.add_argument("--affinity", default=None, help='CPU_AFFINITY（例: "0-7"）')
+    parser.add_argument("--model", default=None, help="settings.MODEL を上書き")
+    parser.add_argument("--prompt", default="以下のエラーログの原因と対処法を簡潔に説明してください: Connection timeout")
+    parser.add_argument("--max-new-tokens", type=int, default=64)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=None, help="結果のJSONを保存するパス")
+    parser.add_argument("--single", default=None, choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single:
+        args.mode = args.single
+        run_single(args)
+    else:
+        run_all(args)
+
+
+if __name__ == "__main__":
+    main()
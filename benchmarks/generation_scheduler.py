@@ -0,0 +1,148 @@
+"""
+生成スケジューラーの混在負荷ベンチマーク
+
+スタブLLMの前段に GenerationScheduler を置き、短い対話的な質問（interactive）を投げ続けるクライアントと、
+長いプロンプトのバッチ生成（batch）を投げ続けるクライアントを同時に走らせて、
+クラスごとのエンドツーエンドのレイテンシ（p50/p95/p99）・待ち時間・処理時間・共有された生成の件数を計測します。
+--fifo を指定すると優先度クラスを使わない（すべて同じクラスで到着順に処理する）場合と比較できます。
+
+使用例:
+    PYTHONPATH=/path/to/intelligent_log_analyzer python benchmarks/generation_scheduler.py --duration 20
+    PYTHONPATH=/path/to/intelligent_log_analyzer python benchmarks/generation_scheduler.py --duration 20 --fifo
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.dirname(__file__))
+
+from run_benchmarks import QUERIES, latency_summary
+from src.core.llm_scheduler import GenerationScheduler
+from src.core.llm_stub import StubLLM
+
+
+class LoadState:
+    """クライアントスレッド間で共有する計測結果"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stop = threading.Event()
+        self.latencies = {"interactive": [], "batch": []}
+        self.errors = []
+
+
+def client(scheduler, state, priority, submit_as, prompts, seed, think_seconds):
+    r = random.Random(seed)
+    while not state.stop.is_set():
+        prompt = r.choice(prompts)
+        start = time.perf_counter()
+        try:
+            scheduler.generate(prompt, submit_as)
+        except Exception as e:
+            with state.lock:
+                state.errors.append(repr(e))
+            continue
+        elapsed = time.perf_counter() - start
+        with state.lock:
+            state.latencies[priority].append(elapsed)
+        if think_seconds:
+            state.stop.wait(r.uniform(0, 2 * think_seconds))
+
+
+def run(args):
+    llm = StubLLM(
+        prefill_ms_per_token=args.prefill_ms, decode_ms_per_token=args.decode_ms, output_tokens=args.output_tokens
+    )
+    if args.fifo:
+        class_limits = {"interactive": args.workers, "batch": args.workers}
+    else:
+        class_limits = {"interactive": args.workers, "batch": args.batch_limit}
+    scheduler = GenerationScheduler(
+        llm, workers=args.workers, class_limits=class_limits, max_queue=0, coalesce=not args.no_coalesce
+    )
+
+    # 対話的な質問は少数の定型文から選ぶため、同じ質問が同時に届くことがある
+    interactive_prompts = [f"{query}について要約してください" for query in QUERIES[: args.distinct_questions]]
+    filler = " ".join(["ログ"] * args.batch_prompt_tokens)
+    batch_prompts = [f"日次レポート {i}: {filler}" for i in range(1000)]
+
+    state = LoadState()
+    threads = []
+    for i in range(args.interactive_clients):
+        # --fifo の場合はすべて同じクラスで投入し、結果の集計だけを分ける
+        threads.append(
+            threading.Thread(
+                target=client,
+                args=(scheduler, state, "interactive", "interactive", interactive_prompts, args.seed + i, args.think),
+                daemon=True,
+            )
+        )
+    for i in range(args.batch_clients):
+        submit_as = "interactive" if args.fifo else "batch"
+        threads.append(
+            threading.Thread(
+                target=client,
+                args=(scheduler, state, "batch", submit_as, batch_prompts, args.seed + 1000 + i, 0.0),
+                daemon=True,
+            )
+        )
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    state.stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    requests = sum(len(samples) for samples in state.latencies.values())
+    return {
+        "params": vars(args).copy(),
+        "seconds": elapsed,
+        "requests": requests,
+        "llm_calls": llm.calls,
+        "interactive": latency_summary(state.latencies["interactive"]),
+        "batch": latency_summary(state.latencies["batch"]),
+        "scheduler": scheduler.stats(),
+        "errors": state.errors[:20],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成スケジューラーの混在負荷ベンチマーク（スタブLLM）")
+    parser.add_argument("--duration", type=float, default=20.0, help="計測時間（秒）")
+    parser.add_argument("--interactive-clients", type=int, default=8)
+    parser.add_argument("--batch-clients", type=int, default=4)
+    parser.add_argument("--think", type=float, default=0.5, help="対話クライアントの質問間隔の平均（秒）")
+    parser.add_argument("--distinct-questions", type=int, default=4, help="対話的な質問の種類数（少ないほど重複が多い）")
+    parser.add_argument("--workers", type=int, default=2, help="同時に生成する最大数")
+    parser.add_argument("--batch-limit", type=int, default=1, help="batchクラスの同時実行数の上限")
+    parser.add_argument("--fifo", action="store_true", help="優先度クラスを使わずに到着順で処理する")
+    parser.add_argument("--no-coalesce", action="store_true", help="同じプロンプトの生成を共有しない")
+    parser.add_argument("--batch-prompt-tokens", type=int, default=4000, help="バッチ生成のプロンプトの長さ")
+    parser.add_argument("--prefill-ms", type=float, default=0.2, help="プロンプト1トークンあたりのプリフィル遅延")
+    parser.add_argument("--decode-ms", type=float, default=5.0, help="出力1トークンあたりのデコード遅延")
+    parser.add_argument("--output-tokens", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="結果JSONの出力先（省略時は標準出力）")
+    args = parser.parse_args()
+
+    results = run(args)
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text)
+        print(f"ベンチマーク結果を保存しました: {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
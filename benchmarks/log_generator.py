@@ -0,0 +1,229 @@
+"""
+合成ログジェネレーター
+
+ベンチマーク用に、レベル比率・テンプレート数・スタックトレース・日英混在を指定して
+任意サイズ（数MB〜数十GB）のログをストリーミングで書き出します。
+"""
+
+import argparse
+import bz2
+import gzip
+import json
+import lzma
+import random
+import time
+from datetime import datetime, timedelta
+
+
+COMPONENTS = ["WebServer", "Database", "Auth", "Cache", "Batch", "Scheduler", "Storage", "Network", "API", "Worker"]
+
+EN_TEMPLATES = [
+    "Request {method} /api/{resource}/{id} completed in {ms}ms",
+    "Connection pool size={n} active={m} idle={k}",
+    "Retrying operation {op} attempt={n} after {ms}ms",
+    "Connection timeout to {host}:{port} after {ms}ms",
+    "Cache miss for key user:{id} (hit ratio {ratio}%)",
+    "Processed batch {id} records={n} failed={k}",
+    "Disk usage on /var/log is {ratio}%",
+    "SSL handshake failed with {host}: certificate expired",
+    "Memory usage {ratio}% ({n}MB/{m}MB)",
+    "Session {id} expired for user {user}",
+]
+
+JA_TEMPLATES = [
+    "データベース接続エラー: {host}:{port} への接続がタイムアウトしました ({ms}ms)",
+    "バッチ処理開始 - 対象件数: {n}件",
+    "メモリ使用量が{ratio}%を超えました",
+    "ログイン失敗: 無効なパスワード (user: {user})",
+    "バックアップ完了 - サイズ: {n}MB",
+    "ネットワーク遅延を検出しました ({ms}ms)",
+    "ディスク容量が不足しています (残り{k}GB)",
+    "レコード処理エラー: ID={id}, 理由=不正なデータ形式",
+    "接続プールを拡張しています ({n} -> {m} connections)",
+    "処理完了: {n}件のレコードを処理",
+]
+
+JAVA_TRACE = [
+    "java.sql.SQLTransientConnectionException: HikariPool-1 - Connection is not available",
+    "\tat com.zaxxer.hikari.pool.HikariPool.createTimeoutException(HikariPool.java:{n})",
+    "\tat com.example.repository.UserRepository.findById(UserRepository.java:{k})",
+    "\tat com.example.service.UserService.load(UserService.java:{m})",
+    "Caused by: java.net.SocketTimeoutException: Read timed out",
+    "\t... {k} more",
+]
+
+PYTHON_TRACE = [
+    "Traceback (most recent call last):",
+    '  File "/app/worker.py", line {n}, in run',
+    "    result = self.process(item)",
+    '  File "/app/worker.py", line {m}, in process',
+    "    raise ValueError(f'invalid record {id}')",
+    "ValueError: invalid record {id}",
+]
+
+DEFAULT_LEVEL_MIX = {"INFO": 0.80, "WARNING": 0.12, "ERROR": 0.06, "DEBUG": 0.02}
+
+LOG_FORMATS = ["timestamp", "json", "syslog", "access"]
+SYSLOG_SEVERITY = {"ERROR": 3, "WARNING": 4, "INFO": 6, "DEBUG": 7}
+ACCESS_STATUS = {"ERROR": [500, 502, 503], "WARNING": [404, 429], "INFO": [200, 201, 304], "DEBUG": [200]}
+
+
+class SyntheticLogGenerator:
+    """決定的な（シード固定の）合成ログ生成クラス"""
+
+    def __init__(
+        self,
+        lines_per_sec=50.0,
+        level_mix=None,
+        template_count=20,
+        stacktrace_ratio=0.02,
+        japanese_ratio=0.5,
+        start_time="2024-08-30 00:00:00",
+        seed=0,
+        log_format="timestamp",
+    ):
+        """生成パラメータを設定（log_format: "timestamp", "json", "syslog", "access"）"""
+        if log_format not in LOG_FORMATS:
+            raise ValueError(f"未対応のログ形式です: {log_format}")
+        self.log_format = log_format
+        self.lines_per_sec = lines_per_sec
+        self.level_mix = level_mix or DEFAULT_LEVEL_MIX
+        self.stacktrace_ratio = stacktrace_ratio
+        self.japanese_ratio = japanese_ratio
+        self.start_time = datetime.strptime(start_time, "%Y-%m-%d %H:%M:%S")
+        self.random = random.Random(seed)
+
+        # テンプレート数を指定数に揃える（足りない分は接尾辞で派生させる）
+        templates = []
+        for i in range(template_count):
+            ja = JA_TEMPLATES[i % len(JA_TEMPLATES)]
+            en = EN_TEMPLATES[i % len(EN_TEMPLATES)]
+            suffix = f" [t{i}]" if i >= max(len(JA_TEMPLATES), len(EN_TEMPLATES)) else ""
+            templates.append((ja + suffix, en + suffix))
+        self.templates = templates
+        self.levels = list(self.level_mix.keys())
+        self.level_weights = list(self.level_mix.values())
+
+    def _fill(self, template):
+        r = self.random
+        return template.format(
+            method=r.choice(["GET", "POST", "PUT", "DELETE"]),
+            resource=r.choice(["users", "orders", "items", "sessions"]),
+            id=r.randint(1, 99999),
+            ms=r.randint(1, 5000),
+            n=r.randint(1, 1000),
+            m=r.randint(1, 1000),
+            k=r.randint(1, 100),
+            ratio=r.randint(1, 100),
+            host=r.choice(["db01", "db02", "cache01", "api.example.com"]),
+            port=r.choice([5432, 3306, 6379, 443]),
+            op=r.choice(["commit", "fetch", "publish"]),
+            user=r.choice(["admin", "alice", "bob", "batch"]),
+        )
+
+    def iter_lines(self):
+        """ログ行を無限に生成"""
+        r = self.random
+        elapsed = 0.0
+        interval = 1.0 / self.lines_per_sec
+        while True:
+            elapsed += r.expovariate(1.0 / interval)
+            moment = self.start_time + timedelta(seconds=elapsed)
+            level = r.choices(self.levels, weights=self.level_weights)[0]
+            component = r.choice(COMPONENTS)
+            ja, en = r.choice(self.templates)
+            message = self._fill(ja if r.random() < self.japanese_ratio else en)
+            frames = []
+            if level == "ERROR" and r.random() < self.stacktrace_ratio / max(self.level_mix.get("ERROR", 1.0), 1e-9):
+                trace = JAVA_TRACE if r.random() < 0.5 else PYTHON_TRACE
+                frames = [self._fill(frame) for frame in trace]
+            yield from self._format(moment, level, component, message, frames)
+
+    def _format(self, moment, level, component, message, frames):
+        """1イベントを指定形式の行に変換"""
+        if self.log_format == "json":
+            record = {"time": moment.strftime("%Y-%m-%dT%H:%M:%SZ"), "level": level, "component": component}
+            record["message"] = message
+            if frames:
+                record["stack"] = "\n".join(frames)
+            yield json.dumps(record, ensure_ascii=False)
+        elif self.log_format == "syslog":
+            # 複数行のメッセージはsyslogでは行ごとに別レコードになる
+            pri = 8 + SYSLOG_SEVERITY.get(level, 6)  # facility=user
+            header = f"<{pri}>{moment:%b} {moment.day:2d} {moment:%H:%M:%S} app01 {component}[{1000 + len(component)}]:"
+            yield f"{header} {level} {message}"
+            for frame in frames:
+                yield f"{header} {frame}"
+        elif self.log_format == "access":
+            r = self.random
+            status = r.choice(ACCESS_STATUS.get(level, [200]))
+            path = f"/api/{r.choice(['users', 'orders', 'items', 'sessions'])}/{r.randint(1, 99999)}"
+            yield (
+                f"10.0.{r.randint(0, 255)}.{r.randint(1, 254)} - - [{moment:%d/%b/%Y:%H:%M:%S} +0000] "
+                f'"{r.choice(["GET", "POST", "PUT", "DELETE"])} {path} HTTP/1.1" {status} {r.randint(0, 50000)} '
+                f'"-" "Mozilla/5.0 ({component})"'
+            )
+        else:
+            yield f"{moment:%Y-%m-%d %H:%M:%S} {level} [{component}] {message}"
+            yield from frames
+
+    def write(self, file_path, size_bytes=None, line_count=None, compression=None):
+        """指定サイズまたは行数までログを書き出し、(行数, バイト数) を返す"""
+        if size_bytes is None and line_count is None:
+            raise ValueError("size_bytes または line_count を指定してください")
+
+        openers = {None: open, "gzip": gzip.open, "bz2": bz2.open, "xz": lzma.open}
+        written_lines = 0
+        written_bytes = 0
+        with openers[compression](file_path, "wb") as file:
+            buffer = []
+            for line in self.iter_lines():
+                encoded = (line + "\n").encode("utf-8")
+                buffer.append(encoded)
+                written_lines += 1
+                written_bytes += len(encoded)
+                if len(buffer) >= 4096:
+                    file.write(b"".join(buffer))
+                    buffer = []
+                if line_count is not None and written_lines >= line_count:
+                    break
+                if size_bytes is not None and written_bytes >= size_bytes:
+                    break
+            if buffer:
+                file.write(b"".join(buffer))
+        return written_lines, written_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合成ログを生成します")
+    parser.add_argument("output", help="出力ファイルパス")
+    parser.add_argument("--size-mb", type=float, default=None, help="生成サイズ（MB、非圧縮換算）")
+    parser.add_argument("--lines", type=int, default=None, help="生成行数")
+    parser.add_argument("--lines-per-sec", type=float, default=50.0, help="ログの発生頻度（行/秒）")
+    parser.add_argument("--templates", type=int, default=20, help="メッセージテンプレート数")
+    parser.add_argument("--stacktrace-ratio", type=float, default=0.02, help="スタックトレースを伴うイベントの比率")
+    parser.add_argument("--japanese-ratio", type=float, default=0.5, help="日本語メッセージの比率")
+    parser.add_argument("--compression", choices=["gzip", "bz2", "xz"], default=None)
+    parser.add_argument("--format", choices=LOG_FORMATS, default="timestamp", help="ログ形式")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    generator = SyntheticLogGenerator(
+        lines_per_sec=args.lines_per_sec,
+        template_count=args.templates,
+        stacktrace_ratio=args.stacktrace_ratio,
+        japanese_ratio=args.japanese_ratio,
+        seed=args.seed,
+        log_format=args.format,
+    )
+    size_bytes = int(args.size_mb * 1024 * 1024) if args.size_mb else None
+    line_count = args.lines if args.lines or size_bytes else 10000
+
+    start = time.perf_counter()
+    lines, size = generator.write(args.output, size_bytes=size_bytes, line_count=line_count, compression=args.compression)
+    elapsed = time.perf_counter() - start
+    print(f"{args.output}: {lines}行, {size / 1024 / 1024:.1f}MB を {elapsed:.1f}秒で生成しました")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+エンドツーエンドベンチマーク
+
+合成ログを生成し、取り込みスループット・ピークRSS・RAG.queryレイテンシ・
+ナレッジベース検索レイテンシ・プロンプト構築時間を計測してJSONに出力します。
+LLMはスタブバックエンド（src/core/llm_stub.py）を使うため、GPUやモデルがなくても実行できます。
+
+使用例:
+    PYTHONPATH=/path/to/intelligent_log_analyzer python benchmarks/run_benchmarks.py --size-mb 10
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(os.path.dirname(__file__))
+
+import numpy as np
+from log_generator import LOG_FORMATS, SyntheticLogGenerator
+from src.core.llm_stub import StubLLM
+from src.utils.log_summarizer import LogSummarizer
+from src.utils.metrics import enabled_metrics, peak_rss_bytes
+
+
+QUERIES = [
+    "データベース接続エラー",
+    "メモリ使用量",
+    "Connection timeout",
+    "ログイン失敗",
+    "SSL handshake failed",
+    "バックアップ",
+    "ディスク容量",
+    "Retrying operation",
+]
+
+
+def latency_summary(samples):
+    """レイテンシ（秒）のリストから統計値（ミリ秒）を算出"""
+    values = np.array(samples) * 1000.0
+    if len(values) == 0:
+        return {}
+    return {
+        "count": int(len(values)),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max()),
+    }
+
+
+def run(args):
+    results = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": {"python": platform.python_version(), "machine": platform.machine(), "system": platform.system()},
+        "params": vars(args).copy(),
+    }
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        # 1. 合成ログ生成
+        log_path = os.path.join(work_dir, "synthetic.log")
+        generator = SyntheticLogGenerator(
+            lines_per_sec=args.lines_per_sec,
+            template_count=args.templates,
+            stacktrace_ratio=args.stacktrace_ratio,
+            japanese_ratio=args.japanese_ratio,
+            seed=args.seed,
+            log_format=args.log_format,
+        )
+        line_count, size_bytes = generator.write(log_path, size_bytes=int(args.size_mb * 1024 * 1024))
+        results["workload"] = {"lines": line_count, "bytes": size_bytes}
+
+        # 2. 取り込み
+        llm = StubLLM(
+            prefill_ms_per_token=args.prefill_ms_per_token,
+            decode_ms_per_token=args.decode_ms_per_token,
+            output_tokens=args.output_tokens,
+        )
+        summarizer = LogSummarizer(knowledge_base_path=args.knowledge_base, llm=llm)
+        start = time.perf_counter()
+        if not summarizer.load_log_file(log_path):
+            raise RuntimeError("ログの取り込みに失敗しました")
+        elapsed = time.perf_counter() - start
+        results["ingest"] = {
+            "seconds": elapsed,
+            "lines_per_sec": line_count / elapsed if elapsed else None,
+            "mb_per_sec": size_bytes / 1024 / 1024 / elapsed if elapsed else None,
+            "chunks": len(summarizer.rag),
+            "log_format": summarizer.log_formats.get(log_path),
+            "peak_rss_bytes": peak_rss_bytes(),
+            "pipeline": summarizer.last_ingest_report,
+        }
+        texts = getattr(summarizer.rag, "texts", None)
+        if hasattr(texts, "nbytes"):
+            results["ingest"]["text_store_bytes"] = texts.nbytes
+
+        # 3. RAG.query レイテンシ（クエリ・埋め込みキャッシュに当たらないよう毎回異なるクエリにする）
+        samples = []
+        for i in range(args.queries):
+            query = f"{QUERIES[i % len(QUERIES)]} {i}"
+            start = time.perf_counter()
+            summarizer.rag.query(query, k=10)
+            samples.append(time.perf_counter() - start)
+        results["rag_query"] = latency_summary(samples)
+
+        # 3a. キャッシュに当たる場合（同じクエリの繰り返し、初回はキャッシュ投入のため除く）
+        for query in QUERIES:
+            summarizer.rag.query(query, k=10)
+        samples = []
+        for i in range(args.queries):
+            start = time.perf_counter()
+            summarizer.rag.query(QUERIES[i % len(QUERIES)], k=10)
+            samples.append(time.perf_counter() - start)
+        results["rag_query_cached"] = latency_summary(samples)
+
+        # 3b. RAG.query_many（キャッシュに当たらない同数のクエリを1回のバッチ検索で処理した場合のクエリあたり時間）
+        batch = [f"{QUERIES[i % len(QUERIES)]} {args.queries + i}" for i in range(args.queries)]
+        start = time.perf_counter()
+        summarizer.rag.query_many(batch, k=10)
+        elapsed = time.perf_counter() - start
+        per_query_ms = elapsed / len(batch) * 1000.0 if batch else 0.0
+        results["rag_query_many"] = {
+            "queries": len(batch),
+            "seconds": elapsed,
+            "per_query_ms": per_query_ms,
+            "speedup_vs_query": results["rag_query"]["mean_ms"] / per_query_ms if per_query_ms else None,
+        }
+
+        # 4. ナレッジベース検索レイテンシ
+        samples = []
+        for i in range(args.queries):
+            keywords = QUERIES[i % len(QUERIES)].lower().split()
+            start = time.perf_counter()
+            summarizer.knowledge_base.search_solutions(keywords)
+            samples.append(time.perf_counter() - start)
+        results["kb_search"] = latency_summary(samples)
+
+        # 5. プロンプト構築時間（検索結果が与えられた後の処理のみ）
+        samples = []
+        prompt_chars = []
+        relevant_logs = summarizer.rag.query(QUERIES[0], k=10)
+        for _ in range(args.queries):
+            start = time.perf_counter()
+            context = summarizer._build_context(relevant_logs)
+            solutions = summarizer._search_knowledge_for_logs(relevant_logs, QUERIES[0])
+            prompt = summarizer._build_enhanced_summary_prompt(QUERIES[0], context, solutions)
+            samples.append(time.perf_counter() - start)
+            prompt_chars.append(len(prompt))
+        results["prompt_build"] = latency_summary(samples)
+        results["prompt_build"]["prompt_chars"] = int(np.mean(prompt_chars)) if prompt_chars else 0
+
+        # 6. エンドツーエンド（スタブLLM）
+        samples = []
+        for i in range(args.summaries):
+            start = time.perf_counter()
+            summarizer.summarize_logs(QUERIES[i % len(QUERIES)] + "について要約してください")
+            samples.append(time.perf_counter() - start)
+        results["summarize_end_to_end"] = latency_summary(samples)
+        results["llm_calls"] = llm.calls
+        results["peak_rss_bytes"] = peak_rss_bytes()
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ログ分析パイプラインのベンチマーク")
+    parser.add_argument("--size-mb", type=float, default=5.0, help="合成ログのサイズ（MB）")
+    parser.add_argument("--lines-per-sec", type=float, default=50.0)
+    parser.add_argument("--templates", type=int, default=20)
+    parser.add_argument("--stacktrace-ratio", type=float, default=0.02)
+    parser.add_argument("--japanese-ratio", type=float, default=0.5)
+    parser.add_argument("--log-format", choices=LOG_FORMATS, default="timestamp", help="合成ログの形式")
+    parser.add_argument("--queries", type=int, default=200, help="レイテンシ計測のクエリ数")
+    parser.add_argument("--summaries", type=int, default=5, help="エンドツーエンド要約の回数")
+    parser.add_argument("--output-tokens", type=int, default=32, help="スタブLLMの出力トークン数")
+    parser.add_argument("--prefill-ms-per-token", type=float, default=0.0, help="スタブLLMのプリフィル遅延")
+    parser.add_argument("--decode-ms-per-token", type=float, default=0.0, help="スタブLLMのデコード遅延")
+    parser.add_argument("--knowledge-base", default="data/knowledge_base.csv")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="結果JSONの出力先（省略時は標準出力）")
+    parser.add_argument("--prometheus", default=None, help="ステージ計測のPrometheusテキスト出力先")
+    args = parser.parse_args()
+
+    with enabled_metrics() as metrics:
+        results = run(args)
+        results["stages"] = metrics.report()
+        if args.prometheus:
+            metrics.export(prometheus_path=args.prometheus)
+    text = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text)
+        print(f"ベンチマーク結果を保存しました: {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,12 @@
+import json
+import os
+
+# プロジェクトのルートディレクトリ（データの既定の保存先は実行時のカレントディレクトリではなくここを基準にする）
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RAG_DATA_DIR = os.path.join(PROJECT_DIR, "rag_data")  # インデックス・キャッシュの既定の保存先
+
 MODEL = "elyza/Llama-3-ELYZA-JP-8B"
-LLM_BACKEND = "transformers"  # "transformers" or "ollama"
+LLM_BACKEND = "transformers"  # "transformers", "ollama" or "stub"
 DEFAULT_MAX_TOKENS = 1200
 DEFAULT_SYSTEM_PROMPT = (
     "あなたは誠実で優秀な日本人のアシスタントです。特に指示が無い場合は、常に日本語で回答してください。"
@@ -13,3 +20,133 @@ GPU_DEVICE = "auto"  # "auto", "cuda:0", "cuda:1", "balanced", "balanced_low_0"
 TORCH_DTYPE = "auto"  # "auto", "float16", "float32", "bfloat16" など
 QUANTIZATION = None  # None, "8bit", "4bit"
 LOW_MEMORY = False  # Low memory mode
+
+# CPU推論設定（USE_GPU = False またはGPUがない場合）
+CPU_QUANTIZATION = None  # None（float32）, "int8_dynamic"（線形層の動的int8量子化）または "bfloat16"（対応CPUのみ）
+TORCH_NUM_THREADS = None  # 演算内（intra-op）スレッド数（Noneで既定値、通常は物理コア数）
+TORCH_NUM_INTEROP_THREADS = None  # 演算間（inter-op）スレッド数
+CPU_AFFINITY = None  # 使用するコア（例: "0-15" や [0, 1, 2, 3]、Noneで固定しない）
+
+# ログシグネチャ設定（Aho-Corasickでまとめて照合）
+LOG_SIGNATURES = [
+    "データベース",
+    "database",
+    "メモリ",
+    "memory",
+    "ネットワーク",
+    "network",
+    "エラー",
+    "error",
+    "接続",
+    "connection",
+    "タイムアウト",
+    "timeout",
+    "ログイン",
+    "login",
+    "ssl",
+    "api",
+    "バックアップ",
+    "backup",
+    "ディスク",
+    "disk",
+    "プロセス",
+    "process",
+]
+LOG_SIGNATURE_FILE = None  # 追加シグネチャのテキストファイル（1行1シグネチャ、エラーコードや例外クラス名など）
+
+# ログ統計設定（LLMを使わない集計）
+STATS_BUCKET_SECONDS = 300  # 時間バケットの幅（秒）
+STATS_IN_PROMPT = True  # 集計表をプロンプトに埋め込むかどうか
+STATS_ANSWER_WITHOUT_LLM = True  # 件数・頻度の質問は集計結果だけで回答する
+
+# 異常検知設定（LLMに渡す時間帯の選択）
+ANOMALY_METHOD = "ewma"  # "ewma" or "zscore"
+ANOMALY_EWMA_ALPHA = 0.3  # EWMAの平滑化係数
+ANOMALY_ZSCORE_WINDOW = 12  # zscore方式で参照する直前バケット数
+ANOMALY_MAX_TEMPLATES = 200  # 異常検知に使うテンプレート数の上限
+ANOMALY_MAX_GAP_BUCKETS = 288  # イベントのないバケットがこれを超えて続く区間は、この個数に縮めて扱う
+ANOMALY_TOP_WINDOWS = 0  # 0より大きい場合、要約・エラー分析を上位N個の異常時間帯に限定
+
+# ログ読み込み設定
+LOG_INCLUDE_PATTERNS = ["*.log", "*.log.[0-9]*", "*.log.gz", "*.log.bz2", "*.log.xz", "*.log.zst"]
+LOG_EXCLUDE_PATTERNS = []  # 例: ["*debug*", "archive/*"]
+LOG_ENCODING = "auto"  # "auto", "utf-8", "cp932" など
+LOG_FALLBACK_ENCODINGS = ["utf-8", "cp932", "euc_jp"]  # 自動判定・イベント単位のフォールバック順
+LOG_USE_MMAP = True  # 非圧縮ファイルをmmapで走査する
+LOG_FORMAT = "auto"  # "auto"（先頭のサンプルから判定）, "timestamp", "json", "syslog", "access", "multiline"
+LOG_FORMAT_SAMPLE_BYTES = 16 * 1024  # 形式の自動判定に使う先頭のバイト数
+LOG_MAX_CHUNK_CHARS = 1000  # これを超えるイベントは行境界で分割
+LOG_CHUNK_TARGET_CHARS = 800  # 分割後の1チャンクの目安文字数
+
+# 取り込みパイプライン設定（読み込み → チャンク化 → 埋め込み → 書き込み）
+INGEST_PIPELINE = True  # Falseの場合は1ファイルずつ逐次処理
+INGEST_READER_THREADS = 2  # ファイル読み込みの並列数（NFSなどI/O待ちが大きい場合は増やす）
+INGEST_CHUNKER_THREADS = 1  # デコード・チャンク化・シグネチャ付与の並列数（Python処理でGILを保持するため通常は1）
+INGEST_EMBEDDER_THREADS = 1  # 埋め込み計算の並列数（GILを解放するtorchの埋め込みでのみ増やす効果がある）
+INGEST_QUEUE_SIZE = 8  # ステージ間キューのバッチ数上限（バックプレッシャー）
+INGEST_BATCH_EVENTS = 256  # 1バッチあたりのイベント数
+
+# 分析サービス設定（python -m src.utils.log_service）
+SERVICE_HOST = "127.0.0.1"  # 待ち受けアドレス
+SERVICE_PORT = 8080  # 待ち受けポート
+SERVICE_ACCESS_LOG = False  # アクセスログを表示するかどうか
+
+# 生成スケジューラー設定（LLMへの生成リクエストを優先度クラスごとに順番待ちさせる）
+# 同時に生成する最大数（transformersは1つのモデルを共有し、同時生成でKVキャッシュのメモリも増えるため通常は1）
+GENERATION_WORKERS = 1
+# クラスごとの同時実行数の上限。同時リクエストを処理できるバックエンド（ollamaなど）では
+# GENERATION_WORKERS = 2 と {"interactive": 2, "batch": 1} にすると、長いバッチ生成中もinteractiveの枠が残る
+GENERATION_CLASS_LIMITS = {"interactive": 1, "batch": 1}
+GENERATION_MAX_QUEUE = 32  # 生成待ちの上限（サービスでは超えた場合に429を返す）
+GENERATION_COALESCE = True  # 待機中・生成中と同じプロンプトは1回の生成を共有する
+GENERATION_STATS_WINDOW = 1000  # 待ち時間・処理時間のパーセンタイルを求める直近の件数
+
+# 計測設定
+METRICS_ENABLED = False  # ステージごとの時間計測を有効にするかどうか
+METRICS_JSON_PATH = os.path.join(PROJECT_DIR, "metrics", "report.json")  # JSONレポートの出力先
+METRICS_PROMETHEUS_PATH = os.path.join(PROJECT_DIR, "metrics", "metrics.prom")  # Prometheusテキスト形式の出力先
+
+# スタブLLM設定（LLM_BACKEND = "stub" の場合、負荷試験・CI用）
+STUB_PREFILL_MS_PER_TOKEN = 0.2  # プロンプト1トークンあたりのプリフィル遅延（ミリ秒）
+STUB_DECODE_MS_PER_TOKEN = 25.0  # 出力1トークンあたりのデコード遅延（ミリ秒）
+STUB_OUTPUT_TOKENS = 128  # 出力トークン数
+
+# 埋め込み設定
+EMBEDDING_BACKEND = "hash"  # "hash"（従来の文字コードベース）または "transformers"（文埋め込みモデル）
+EMBEDDING_VECTOR_DIM = 512  # hashの場合の次元数（transformersの場合はモデルの次元を使用）
+EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"  # 多言語の小型エンコーダー
+EMBEDDING_BATCH_SIZE = 32  # CPU推論のバッチサイズ
+EMBEDDING_MAX_LENGTH = 256  # 1チャンクあたりの最大トークン数
+EMBEDDING_QUANTIZATION = None  # None, "int8"（動的量子化）または "onnx"（optimum[onnxruntime]が必要）
+EMBEDDING_NUM_THREADS = None  # 埋め込み推論のスレッド数（Noneで既定値）
+EMBEDDING_CACHE_PATH = os.path.join(RAG_DATA_DIR, "embedding_cache.sqlite")  # チャンク内容のハッシュをキーにした埋め込みキャッシュ（Noneで無効）
+
+# ベクトルストア設定
+RAG_SHARDING = None  # None（単一インデックス）, "daily" または "hourly"（時間分割シャード）
+RAG_SHARD_PATH = os.path.join(RAG_DATA_DIR, "shards")  # シャードの保存先
+RAG_QUERY_THREADS = 4  # シャード横断検索の並列数
+RAG_RETENTION_DAYS = None  # シャードの保持日数（Noneは無期限）
+RAG_INDEX_TYPE = "flat"  # "flat"（float32）, "sq8", "sqfp16"（スカラー量子化）または "pq"（直積量子化）
+RAG_PQ_M = 64  # PQの分割数（ベクトル次元を割り切る値、1件あたりのバイト数 = RAG_PQ_M * RAG_PQ_NBITS / 8）
+RAG_PQ_NBITS = 8  # PQの1分割あたりのビット数
+RAG_INDEX_TRAIN_SIZE = 10000  # 学習が必要な方式で、この件数がたまるまでflatで保持してから学習する
+RAG_RERANK_FACTOR = 0  # 0より大きい場合、k×この数の候補をディスク上の生ベクトルで正確に再ランキング
+RAG_RAW_VECTOR_PATH = None  # 再ランキング用の生ベクトルファイル（例: RAG_DATA_DIRの"vectors.f32"、Noneで保存しない）
+RAG_MMR_LAMBDA = None  # MMRによる多様化（0〜1、1に近いほど関連度重視、例: 0.7）。Noneで無効
+RAG_DEDUP_HAMMING = None  # SimHash(64bit)のハミング距離がこの値以下の検索候補を重複として除外（例: 3）。Noneで無効
+RAG_MMR_CANDIDATES = 4  # 多様化・重複除去を行う場合、k×この数の候補から選ぶ
+FAISS_OMP_THREADS = None  # Faiss検索のOpenMPスレッド数（Noneで既定値＝全コア）
+RAG_TEXT_STORE = "arena"  # チャンク本文の保持方式: "list"（list[str]）, "arena"（UTF-8連続バッファ）, "zstd"（ブロック圧縮、zstandardが必要）, "file"（元ログへの参照のみ）
+RAG_QUERY_CACHE_SIZE = 256  # 検索結果キャッシュの件数（0で無効）
+RAG_EMBEDDING_CACHE_SIZE = 1024  # クエリ埋め込みキャッシュの件数（0で無効）
+RAG_COMPACT_THRESHOLD = 0.2  # 削除済みチャンクの割合がこの値を超えたらインデックスとテキストを詰め直す
+RAG_BACKGROUND_COMPACTION = True  # コンパクションをバックグラウンドで行う（検索を止めるのは置き換えの瞬間のみ）
+RAG_SNAPSHOT_PATH = os.path.join(RAG_DATA_DIR, "snapshots")  # 差分スナップショットの保存先（単一インデックス時）
+RAG_SNAPSHOT_COMPACT_EVERY = 10  # 差分がこの数たまったらベースを書き直す
+
+# ハードウェア計測による調整値（python src/utils/gpu_test.py --probe --write で生成、ファイルがあれば上記の値を上書き）
+TUNED_SETTINGS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tuned_settings.json")
+if os.path.exists(TUNED_SETTINGS_PATH):
+    with open(TUNED_SETTINGS_PATH, "r", encoding="utf-8") as _file:
+        _tuned = json.load(_file).get("settings", {})
+    globals().update({name: value for name, value in _tuned.items() if name.isupper() and name in globals()})
@@ -0,0 +1,139 @@
+import numpy as np
+from .log_stats import LEVELS, format_bucket
+
+
+# レベルごとの重み（エラーの急増を最優先）
+LEVEL_WEIGHTS = np.array([3.0, 2.0, 1.0, 0.5])
+
+
+def ewma_zscores(series, alpha=0.3, min_std=1.0):
+    """EWMAで推定した直前までの平均・分散に対するzスコアを列ごとに計算
+
+    series: (時間, 系列) の行列。時間方向の漸化式以外は系列方向にベクトル化している。
+    """
+    series = np.asarray(series, dtype=np.float64)
+    scores = np.zeros_like(series)
+    if series.size == 0:
+        return scores
+
+    mean = series[0].copy()
+    var = np.zeros(series.shape[1])
+    for t in range(1, len(series)):
+        x = series[t]
+        std = np.maximum(np.sqrt(var), min_std)
+        scores[t] = (x - mean) / std
+        diff = x - mean
+        mean = mean + alpha * diff
+        var = (1 - alpha) * (var + alpha * diff * diff)
+    return scores
+
+
+def rolling_zscores(series, window=12, min_std=1.0):
+    """直前window個のバケットの平均・標準偏差に対するzスコア（累積和で完全ベクトル化）"""
+    series = np.asarray(series, dtype=np.float64)
+    scores = np.zeros_like(series)
+    if len(series) < 2:
+        return scores
+
+    zeros = np.zeros((1, series.shape[1]))
+    csum = np.vstack([zeros, np.cumsum(series, axis=0)])
+    csum_sq = np.vstack([zeros, np.cumsum(series * series, axis=0)])
+
+    t = np.arange(1, len(series))
+    lo = np.maximum(t - window, 0)
+    count = (t - lo)[:, None]
+    mean = (csum[t] - csum[lo]) / count
+    var = np.maximum((csum_sq[t] - csum_sq[lo]) / count - mean * mean, 0.0)
+    scores[1:] = (series[1:] - mean) / np.maximum(np.sqrt(var), min_std)
+    return scores
+
+
+class AnomalyDetector:
+    """時間バケットごとのイベント件数からバースト（異常な時間帯）を検出するクラス"""
+
+    def __init__(
+        self, log_stats, method="ewma", alpha=0.3, window=12, min_std=1.0, max_templates=200, max_gap_buckets=288
+    ):
+        """LogStatisticsの集計結果を入力として検出器を初期化"""
+        self.log_stats = log_stats
+        self.method = method
+        self.alpha = alpha
+        self.window = window
+        self.min_std = min_std
+        self.max_templates = max_templates
+        self.max_gap_buckets = max_gap_buckets
+        self._cache_version = None
+        self._cache = None
+
+    def _zscores(self, series):
+        if self.method == "zscore":
+            return rolling_zscores(series, window=self.window, min_std=self.min_std)
+        return ewma_zscores(series, alpha=self.alpha, min_std=self.min_std)
+
+    def score_windows(self):
+        """全バケットの異常スコアを計算（集計が更新されるまでキャッシュ）"""
+        if self._cache_version == self.log_stats.version and self._cache is not None:
+            return self._cache
+
+        starts, level_counts, template_counts, template_names = self.log_stats.dense_series(
+            self.max_templates, self.max_gap_buckets
+        )
+        if len(starts) == 0:
+            result = (starts, np.zeros(0), np.zeros((0, len(LEVELS))), np.zeros((0, 0)), template_names)
+        else:
+            level_scores = np.clip(self._zscores(level_counts), 0, None) * LEVEL_WEIGHTS
+            if template_counts.shape[1]:
+                template_scores = np.clip(self._zscores(template_counts), 0, None)
+            else:
+                template_scores = np.zeros((len(starts), 0))
+            scores = level_scores.max(axis=1)
+            if template_scores.shape[1]:
+                scores = np.maximum(scores, template_scores.max(axis=1))
+            result = (starts, scores, level_counts, template_scores, template_names)
+
+        self._cache_version = self.log_stats.version
+        self._cache = result
+        return result
+
+    def rank_windows(self, top_n=3, min_score=0.0):
+        """異常スコアの高い時間帯を上位から返す"""
+        starts, scores, level_counts, template_scores, template_names = self.score_windows()
+        if len(starts) == 0:
+            return []
+
+        order = np.argsort(-scores, kind="stable")
+        bucket_seconds = self.log_stats.bucket_seconds
+        windows = []
+        for row in order[:top_n]:
+            if scores[row] <= min_score:
+                break
+            top_templates = []
+            if template_scores.shape[1]:
+                for col in np.argsort(-template_scores[row])[:3]:
+                    if template_scores[row, col] > 0:
+                        top_templates.append(template_names[col])
+            windows.append(
+                {
+                    "start": int(starts[row]),
+                    "end": int(starts[row]) + bucket_seconds,
+                    "label": format_bucket(int(starts[row])),
+                    "score": float(scores[row]),
+                    "counts": {level: int(c) for level, c in zip(LEVELS, level_counts[row])},
+                    "top_templates": top_templates,
+                }
+            )
+        return windows
+
+    def format_windows(self, windows):
+        """プロンプト埋め込み用に異常時間帯を整形"""
+        lines = []
+        for i, window in enumerate(windows, 1):
+            counts = window["counts"]
+            line = (
+                f"{i}. {window['label']} (スコア: {window['score']:.1f}, "
+                f"error={counts['error']}, warning={counts['warning']}, info={counts['info']})"
+            )
+            if window["top_templates"]:
+                line += " 急増: " + " / ".join(window["top_templates"])
+            lines.append(line)
+        return "\n".join(lines)
@@ -0,0 +1,78 @@
+import os
+
+
+def parse_cpu_list(value):
+    """"0-3,8,10-11" 形式またはリストのコア指定をコア番号のリストに変換"""
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple, set)):
+        return sorted(int(cpu) for cpu in value)
+    cpus = set()
+    for part in str(value).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def apply_cpu_affinity(cpus):
+    """プロセスを指定したコアに固定（Linux以外では何もしない）"""
+    cpus = parse_cpu_list(cpus)
+    if not cpus or not hasattr(os, "sched_setaffinity"):
+        return None
+    try:
+        os.sched_setaffinity(0, cpus)
+        return sorted(os.sched_getaffinity(0))
+    except OSError as e:
+        print(f"CPUアフィニティの設定に失敗しました: {e}")
+        return None
+
+
+def configure_torch_threads(torch, num_threads=None, interop_threads=None):
+    """演算内（intra-op）と演算間（inter-op）のスレッド数を設定し、実際の値を返す"""
+    if num_threads:
+        torch.set_num_threads(int(num_threads))
+    if interop_threads:
+        try:
+            # inter-opスレッド数は並列処理の開始前にしか変更できない
+            torch.set_num_interop_threads(int(interop_threads))
+        except RuntimeError as e:
+            print(f"inter-opスレッド数を変更できませんでした: {e}")
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+def cpu_supports_bf16(torch):
+    """CPUがbfloat16演算に対応しているか（AVX512-BF16 / AMX）"""
+    try:
+        capability = torch.backends.cpu.get_cpu_capability()
+        if "AVX512" in capability and "BF16" in capability.upper():
+            return True
+    except Exception:
+        pass
+    try:
+        with open("/proc/cpuinfo", "r") as file:
+            flags = file.read()
+        return "avx512_bf16" in flags or "amx_bf16" in flags
+    except OSError:
+        return False
+
+
+def quantize_dynamic_int8(torch, model):
+    """線形層の重みをint8に動的量子化（活性化は実行時に量子化、CPU専用）"""
+    quantization = getattr(torch, "ao", torch).quantization
+    return quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def configure_cpu_runtime(torch, num_threads=None, interop_threads=None, affinity=None):
+    """コア固定とスレッド数の設定をまとめて行い、設定結果を返す（モデル読み込み前に呼び出す）"""
+    # コア固定を先に行うと、torchの既定スレッド数も固定後のコア数に合わせやすい
+    pinned = apply_cpu_affinity(affinity)
+    if pinned and not num_threads:
+        num_threads = len(pinned)
+    threads, interop = configure_torch_threads(torch, num_threads, interop_threads)
+    return {"affinity": pinned, "num_threads": threads, "interop_threads": interop}
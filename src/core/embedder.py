@@ -0,0 +1,198 @@
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import numpy as np
+from .cpu_inference import quantize_dynamic_int8
+from .rag import text_to_vector
+from ..utils.metrics import metrics
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+from config import settings
+
+
+def content_hash(text):
+    """埋め込みキャッシュのキーに使うテキストのハッシュ"""
+    return hashlib.sha1(text.encode("utf-8", errors="surrogatepass")).hexdigest()
+
+
+class HashEmbedder:
+    """従来の文字コードベースのベクトル化（モデル不要・高速）"""
+
+    def __init__(self, vector_dim=512):
+        self.dim = vector_dim
+        self.name = f"hash-{vector_dim}"
+
+    def embed(self, texts):
+        """テキストのリストを (件数, 次元) のfloat32行列に変換"""
+        return np.array([text_to_vector(text, self.dim) for text in texts], dtype=np.float32).reshape(-1, self.dim)
+
+
+class TransformerEmbedder:
+    """transformersの文埋め込みモデルをCPUでバッチ推論する埋め込みクラス
+
+    長さ順に並べてバッチ化することでパディングを減らし、平均プーリング＋L2正規化でベクトル化する。
+    quantization: None, "int8"（torchの動的量子化）または "onnx"（optimum + onnxruntime）
+    """
+
+    def __init__(self, model_name, batch_size=32, max_length=256, quantization=None, num_threads=None):
+        import torch
+        from transformers import AutoModel, AutoTokenizer
+
+        self.torch = torch
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.quantization = quantization
+        if num_threads:
+            torch.set_num_threads(int(num_threads))
+
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        if quantization == "onnx":
+            try:
+                from optimum.onnxruntime import ORTModelForFeatureExtraction
+            except ImportError:
+                raise ImportError("ONNX推論には optimum[onnxruntime] のインストールが必要です")
+            self.model = ORTModelForFeatureExtraction.from_pretrained(model_name, export=True)
+            self.dim = self.model.config.hidden_size
+        else:
+            self.model = AutoModel.from_pretrained(model_name)
+            self.model.eval()
+            if quantization == "int8":
+                self.model = quantize_dynamic_int8(torch, self.model)
+            elif quantization:
+                raise ValueError(f"未対応の埋め込み量子化方式です: {quantization}")
+            self.dim = self.model.config.hidden_size
+        self.name = f"{model_name}:{quantization or 'fp32'}:{max_length}"
+        print(f"埋め込みモデルを読み込みました: {model_name} (次元: {self.dim}, 量子化: {quantization or 'なし'})")
+
+    def _embed_batch(self, texts):
+        torch = self.torch
+        encoded = self.tokenizer(
+            texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="pt"
+        )
+        with torch.inference_mode():
+            output = self.model(**encoded)
+        hidden = output.last_hidden_state
+        # 平均プーリング（パディング部分を除外）
+        mask = encoded["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+        pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+        pooled = torch.nn.functional.normalize(pooled, p=2, dim=1)
+        return pooled.float().cpu().numpy()
+
+    def embed(self, texts):
+        """テキストのリストを (件数, 次元) のfloat32行列に変換（長さ順にバッチ化し、元の順序で返す）"""
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        for start in range(0, len(order), self.batch_size):
+            positions = order[start : start + self.batch_size]
+            vectors[positions] = self._embed_batch([texts[i] for i in positions])
+        return vectors
+
+
+class EmbeddingCache:
+    """モデル名とテキストハッシュをキーに埋め込みをSQLiteへ保存するディスクキャッシュ"""
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (model TEXT, hash TEXT, vector BLOB, PRIMARY KEY (model, hash))"
+        )
+        self._conn.commit()
+
+    def get_many(self, model, hashes, dim):
+        """ハッシュのリストに対応する埋め込みを {ハッシュ: ベクトル} で返す（未登録は含まない）"""
+        found = {}
+        hashes = list(hashes)
+        with self._lock:
+            # SQLiteのパラメータ数上限を超えないよう分割して問い合わせる
+            for start in range(0, len(hashes), 500):
+                chunk = hashes[start : start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({placeholders})",
+                    [model, *chunk],
+                )
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    if len(vector) == dim:
+                        found[key] = vector
+        return found
+
+    def put_many(self, model, items):
+        """(ハッシュ, ベクトル) の組をまとめて保存"""
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(model, key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items],
+            )
+            self._conn.commit()
+
+    def count(self, model=None):
+        with self._lock:
+            if model is None:
+                return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return self._conn.execute("SELECT COUNT(*) FROM embeddings WHERE model = ?", (model,)).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbedder:
+    """埋め込みクラスをディスクキャッシュで包み、同じ内容のチャンクは再計算しない"""
+
+    def __init__(self, embedder, cache):
+        self.embedder = embedder
+        self.cache = cache
+        self.dim = embedder.dim
+        self.name = embedder.name
+
+    def embed(self, texts):
+        hashes = [content_hash(text) for text in texts]
+        found = self.cache.get_many(self.name, set(hashes), self.dim)
+        metrics.increment("embedding.disk_cache.hit", sum(1 for key in hashes if key in found))
+
+        # 未登録のテキスト（バッチ内の重複は1回だけ）を計算して保存
+        missing = {}
+        for text, key in zip(texts, hashes):
+            if key not in found and key not in missing:
+                missing[key] = text
+        metrics.increment("embedding.disk_cache.miss", len(missing))
+        if missing:
+            with metrics.span("embed_model"):
+                computed = self.embedder.embed(list(missing.values()))
+            items = list(zip(missing.keys(), computed))
+            self.cache.put_many(self.name, items)
+            found.update(items)
+
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, key in enumerate(hashes):
+            vectors[i] = found[key]
+        return vectors
+
+
+def create_embedder():
+    """settings.pyの設定から埋め込みクラスを生成（hashの場合はディスクキャッシュを使わない）"""
+    if settings.EMBEDDING_BACKEND == "hash":
+        return HashEmbedder(settings.EMBEDDING_VECTOR_DIM)
+    if settings.EMBEDDING_BACKEND != "transformers":
+        raise ValueError(f"未対応の埋め込みバックエンドです: {settings.EMBEDDING_BACKEND}")
+
+    embedder = TransformerEmbedder(
+        settings.EMBEDDING_MODEL,
+        batch_size=settings.EMBEDDING_BATCH_SIZE,
+        max_length=settings.EMBEDDING_MAX_LENGTH,
+        quantization=settings.EMBEDDING_QUANTIZATION,
+        num_threads=settings.EMBEDDING_NUM_THREADS,
+    )
+    if settings.EMBEDDING_CACHE_PATH:
+        return CachedEmbedder(embedder, EmbeddingCache(settings.EMBEDDING_CACHE_PATH))
+    return embedder
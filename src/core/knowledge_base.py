@@ -71,6 +71,10 @@ class KnowledgeBase:
                 return entry
         return None
 
+    def get_problem_names(self):
+        """すべての問題名を取得"""
+        return [entry["問題名"] for entry in self.knowledge_data if entry.get("問題名")]
+
     def get_all_categories(self):
         """すべてのカテゴリを取得"""
         categories = set()
@@ -1,8 +1,15 @@
+import gc
 import os
+import time
 import torch
 from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import TextIteratorStreamer
+from transformers.generation.streamers import BaseStreamer
 import sys
+import threading
 from ..core.rag import RAG
+from ..utils.metrics import current_rss_bytes, metrics
+from .cpu_inference import configure_cpu_runtime, cpu_supports_bf16, quantize_dynamic_int8
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
 from config import settings
@@ -15,6 +22,40 @@ logging.getLogger("transformers").setLevel(logging.ERROR)
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
 
+class _GenerationTimer(BaseStreamer):
+    """generate()のストリーマーとして渡し、プリフィルとデコードの時間を分けて計測"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first_token_time = None
+        self.end_time = None
+        self.generated_tokens = 0
+        self._prompt_seen = False
+
+    def put(self, value):
+        # 最初の呼び出しはプロンプトのトークン列
+        if not self._prompt_seen:
+            self._prompt_seen = True
+            return
+        if self.first_token_time is None:
+            self.first_token_time = time.perf_counter()
+        self.generated_tokens += value.numel()
+
+    def end(self):
+        self.end_time = time.perf_counter()
+
+    def record(self, prompt_tokens):
+        end_time = self.end_time or time.perf_counter()
+        first_token_time = self.first_token_time or end_time
+        metrics.observe("llm.prefill", first_token_time - self.start)
+        metrics.observe("llm.decode", end_time - first_token_time)
+        metrics.increment("llm.prompt_tokens", prompt_tokens)
+        metrics.increment("llm.generated_tokens", self.generated_tokens)
+        decode_seconds = end_time - first_token_time
+        if decode_seconds > 0:
+            metrics.set_gauge("llm.last_decode_tokens_per_sec", self.generated_tokens / decode_seconds)
+
+
 class LLM:
     def __init__(self, model_name):
         # settings.pyからGPU設定を取得
@@ -36,8 +77,22 @@ class LLM:
             device = "cpu"
             device_map = None
 
+        # CPU実行時はモデル読み込み前にコア固定とスレッド数を設定
+        self.cpu_report = None
+        if not use_gpu:
+            self.cpu_report = configure_cpu_runtime(
+                torch, settings.TORCH_NUM_THREADS, settings.TORCH_NUM_INTEROP_THREADS, settings.CPU_AFFINITY
+            )
+            self.cpu_report["mode"] = settings.CPU_QUANTIZATION
+
         # データ型設定
-        if settings.TORCH_DTYPE == "auto":
+        if not use_gpu and settings.CPU_QUANTIZATION == "bfloat16":
+            if cpu_supports_bf16(torch):
+                torch_dtype = torch.bfloat16
+            else:
+                print("このCPUはbfloat16演算に対応していないため、float32で読み込みます")
+                torch_dtype = torch.float32
+        elif settings.TORCH_DTYPE == "auto":
             torch_dtype = torch.float16 if use_gpu else torch.float32
         elif settings.TORCH_DTYPE == "float16":
             torch_dtype = torch.float16
@@ -48,9 +103,11 @@ class LLM:
         else:
             torch_dtype = torch.float32  # デフォルト
 
-        # 量子化設定
-        load_in_8bit = settings.QUANTIZATION == "8bit"
-        load_in_4bit = settings.QUANTIZATION == "4bit"
+        # 量子化設定（bitsandbytesの8bit/4bitはGPU専用）
+        load_in_8bit = settings.QUANTIZATION == "8bit" and use_gpu
+        load_in_4bit = settings.QUANTIZATION == "4bit" and use_gpu
+        if settings.QUANTIZATION and not use_gpu:
+            print(f"QUANTIZATION={settings.QUANTIZATION} はGPU専用のため無視します（CPUでは CPU_QUANTIZATION を使用）")
 
         # モデルロード設定を構築
         model_kwargs = {
@@ -77,6 +134,18 @@ class LLM:
         self.model.eval()
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
 
+        # CPU向け動的int8量子化（線形層の重みをint8化し、メモリとデコード時間を削減）
+        if not use_gpu and settings.CPU_QUANTIZATION == "int8_dynamic":
+            rss_before = current_rss_bytes()
+            self.model = quantize_dynamic_int8(torch, self.model)
+            gc.collect()
+            rss_after = current_rss_bytes()
+            self.cpu_report.update({"rss_before_bytes": rss_before, "rss_after_bytes": rss_after})
+            if rss_before and rss_after:
+                print(f"int8動的量子化: RSS {rss_before / 1024**3:.2f}GB → {rss_after / 1024**3:.2f}GB")
+        elif self.cpu_report is not None:
+            self.cpu_report["rss_after_bytes"] = current_rss_bytes()
+
         # GPU使用状況をログ出力
         print(f"🔧 GPU設定:")
         print(f"   CUDA利用可能: {torch.cuda.is_available()}")
@@ -88,6 +157,11 @@ class LLM:
         print(f"   実際にGPU使用: {use_gpu}")
         print(f"   デバイスマップ: {device_map}")
         print(f"   データ型: {torch_dtype}")
+        if self.cpu_report is not None:
+            print(f"   CPUモード: {settings.CPU_QUANTIZATION or 'float32'}")
+            print(f"   スレッド数: {self.cpu_report['num_threads']} (inter-op: {self.cpu_report['interop_threads']})")
+            if self.cpu_report["affinity"]:
+                print(f"   使用コア: {self.cpu_report['affinity']}")
         print(f"   モデルのデバイス: {next(self.model.parameters()).device}")
 
         # pad_tokenを設定して警告を抑制
@@ -102,9 +176,12 @@ class LLM:
         print(f"settings max_tokens: {self.max_tokens}")
 
     def process(self, messages):
-        prompt = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
-        token_ids = self.tokenizer.encode(prompt, add_special_tokens=False, return_tensors="pt")
+        with metrics.span("llm.tokenize"):
+            prompt = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+            token_ids = self.tokenizer.encode(prompt, add_special_tokens=False, return_tensors="pt")
 
+        # 計測有効時のみストリーマーでプリフィル/デコード時間を分離
+        timer = _GenerationTimer() if metrics.enabled else None
         with torch.no_grad():
             output_ids = self.model.generate(
                 token_ids.to(self.model.device),
@@ -114,10 +191,69 @@ class LLM:
                 top_p=0.9,
                 pad_token_id=self.tokenizer.eos_token_id,
                 attention_mask=torch.ones_like(token_ids),
+                streamer=timer,
             )
-        output = self.tokenizer.decode(output_ids.tolist()[0][token_ids.size(1) :], skip_special_tokens=True)
+        if timer is not None:
+            timer.record(token_ids.size(1))
+
+        with metrics.span("llm.detokenize"):
+            output = self.tokenizer.decode(output_ids.tolist()[0][token_ids.size(1) :], skip_special_tokens=True)
         return output
 
+    def process_stream(self, messages):
+        """生成結果をテキスト片ごとに返す（生成は別スレッドで実行）"""
+        prompt = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        token_ids = self.tokenizer.encode(prompt, add_special_tokens=False, return_tensors="pt")
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+
+        def generate():
+            with torch.no_grad():
+                self.model.generate(
+                    token_ids.to(self.model.device),
+                    max_new_tokens=self.max_tokens,
+                    do_sample=True,
+                    temperature=0.6,
+                    top_p=0.9,
+                    pad_token_id=self.tokenizer.eos_token_id,
+                    attention_mask=torch.ones_like(token_ids),
+                    streamer=streamer,
+                )
+
+        thread = threading.Thread(target=generate, daemon=True)
+        thread.start()
+        for text in streamer:
+            if text:
+                yield text
+        thread.join()
+
+    def measure_generation(self, text="ログの要約を作成してください。", max_new_tokens=64):
+        """1回生成してプリフィル・デコード速度（トークン/秒）とRSSを返す"""
+        messages = [{"role": "user", "content": text}]
+        prompt = self.tokenizer.apply_chat_template(messages, tokenize=False, add_generation_prompt=True)
+        token_ids = self.tokenizer.encode(prompt, add_special_tokens=False, return_tensors="pt")
+        timer = _GenerationTimer()
+        with torch.no_grad():
+            self.model.generate(
+                token_ids.to(self.model.device),
+                max_new_tokens=max_new_tokens,
+                min_new_tokens=max_new_tokens,
+                do_sample=False,
+                pad_token_id=self.tokenizer.eos_token_id,
+                attention_mask=torch.ones_like(token_ids),
+                streamer=timer,
+            )
+        end_time = timer.end_time or time.perf_counter()
+        first_token_time = timer.first_token_time or end_time
+        prefill_seconds = first_token_time - timer.start
+        decode_seconds = end_time - first_token_time
+        return {
+            "prompt_tokens": token_ids.size(1),
+            "generated_tokens": timer.generated_tokens,
+            "prefill_seconds": prefill_seconds,
+            "decode_tokens_per_sec": timer.generated_tokens / decode_seconds if decode_seconds > 0 else None,
+            "rss_bytes": current_rss_bytes(),
+        }
+
     def print_info(self):
         print(f"Model: {self.model}")
         # print(f"Tokenizer: {self.tokenizer}")
@@ -129,6 +265,14 @@ class LLM:
         messages.append({"role": "user", "content": text})
         return self.process(messages)
 
+    def input_text_stream(self, text):
+        """生成結果を逐次返す"""
+        messages = [{"role": "system", "content": self.default_system_prompt}]
+        if self.custom_system_prompt:
+            messages.append({"role": "user", "content": self.custom_system_prompt})
+        messages.append({"role": "user", "content": text})
+        return self.process_stream(messages)
+
     def input_text_list(self, texts) -> list:
         return [self.input_text(text) for text in texts]
 
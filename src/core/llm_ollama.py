@@ -1,5 +1,6 @@
 import requests
 from config import settings
+from ..utils.metrics import metrics
 import json
 
 
@@ -9,7 +10,8 @@ class OllamaLLM:
         self.default_system_prompt = settings.DEFAULT_SYSTEM_PROMPT
         self.custom_system_prompt = settings.CUSTOM_SYSTEM_PROMPT
 
-    def process(self, messages):
+    def process_stream(self, messages):
+        """生成結果をテキスト片ごとに返す"""
         prompt = "\n".join([f"{m['role']}: {m['content']}" for m in messages])
         response = requests.post(
             "http://localhost:11434/api/generate",
@@ -19,13 +21,25 @@ class OllamaLLM:
         )
         response.raise_for_status()
 
-        full_response = ""
         for line in response.iter_lines():
             if line:
                 data = json.loads(line.decode("utf-8"))
-                full_response += data.get("response", "")
+                if data.get("response"):
+                    yield data["response"]
+                if data.get("done"):
+                    self._record_metrics(data)
+
+    def process(self, messages):
+        return "".join(self.process_stream(messages))
 
-        return full_response
+    def _record_metrics(self, data):
+        """Ollamaの最終応答に含まれる計測値（ナノ秒）を記録"""
+        metrics.observe("llm.prefill", data.get("prompt_eval_duration", 0) / 1e9)
+        metrics.observe("llm.decode", data.get("eval_duration", 0) / 1e9)
+        metrics.increment("llm.prompt_tokens", data.get("prompt_eval_count", 0))
+        metrics.increment("llm.generated_tokens", data.get("eval_count", 0))
+        if data.get("eval_duration"):
+            metrics.set_gauge("llm.last_decode_tokens_per_sec", data.get("eval_count", 0) / (data["eval_duration"] / 1e9))
 
     def input_text(self, text):
         messages = [{"role": "system", "content": self.default_system_prompt}]
@@ -34,6 +48,14 @@ class OllamaLLM:
         messages.append({"role": "user", "content": text})
         return self.process(messages)
 
+    def input_text_stream(self, text):
+        """生成結果を逐次返す"""
+        messages = [{"role": "system", "content": self.default_system_prompt}]
+        if self.custom_system_prompt:
+            messages.append({"role": "user", "content": self.custom_system_prompt})
+        messages.append({"role": "user", "content": text})
+        return self.process_stream(messages)
+
     def input_text_list(self, texts):
         return [self.input_text(text) for text in texts]
 
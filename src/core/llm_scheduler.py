@@ -0,0 +1,230 @@
+import math
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+from config import settings
+from ..utils.metrics import metrics
+
+
+# 優先度クラス（先頭ほど優先して実行する）
+PRIORITY_CLASSES = ("interactive", "batch")
+
+
+class QueueFullError(Exception):
+    """生成キューが上限に達した"""
+
+
+def _percentile(values, q):
+    """値のリストのパーセンタイル（最近傍順位法）"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(q / 100.0 * len(ordered)) - 1)]
+
+
+class GenerationJob:
+    """1つのプロンプトの生成。同じプロンプトを待つ複数のリクエストで共有する
+
+    生成結果のテキスト片はすべて保持するため、生成の途中から加わったリクエストも先頭から受け取れる。
+    """
+
+    def __init__(self, prompt, priority):
+        self.prompt = prompt
+        self.priority = priority
+        self.waiters = 1
+        self.submitted = time.perf_counter()
+        self.started = None
+        self.finished = None
+        self.error = None
+        self._pieces = []
+        self._done = False
+        self._cond = threading.Condition()
+
+    def _put(self, piece):
+        with self._cond:
+            self._pieces.append(piece)
+            self._cond.notify_all()
+
+    def _finish(self, error=None):
+        with self._cond:
+            self.error = error
+            self.finished = time.perf_counter()
+            self._done = True
+            self._cond.notify_all()
+
+    @property
+    def done(self):
+        return self._done
+
+    def stream(self):
+        """生成結果をテキスト片ごとに返す（生成が失敗した場合は受け取り済みの片の後に例外を送出）"""
+        i = 0
+        while True:
+            with self._cond:
+                while i >= len(self._pieces) and not self._done:
+                    self._cond.wait()
+                pieces = self._pieces[i:]
+                done = self._done
+            for piece in pieces:
+                yield piece
+            i += len(pieces)
+            if done and i >= len(self._pieces):
+                if self.error is not None:
+                    raise self.error
+                return
+
+    def result(self):
+        """生成の完了を待って全文を返す"""
+        return "".join(self.stream())
+
+
+class GenerationScheduler:
+    """LLMバックエンドの前段で生成リクエストを優先度クラスごとに順番待ちさせるスケジューラー
+
+    - ワーカー数（workers）が同時に生成する上限で、各クラスの同時実行数は class_limits で制限する。
+      空いたワーカーは優先度の高いクラスから取り出すため、batchの上限をワーカー数より小さくしておけば
+      長いバッチ生成の最中でもinteractiveの枠が残る（実行中の生成は中断しない）。
+    - coalesce=True の場合、待機中・生成中と同じプロンプトは新たに生成せず、既存の生成を共有する。
+      優先度の高いリクエストが待機中の生成に加わった場合は、その生成を高いクラスに引き上げる。
+    - 待ち時間（投入から開始まで）と処理時間（開始から完了まで）はクラスごとに分けて記録する。
+    """
+
+    def __init__(self, llm, workers=None, class_limits=None, max_queue=None, coalesce=None, stats_window=None):
+        self.llm = llm
+        self.workers = max(1, settings.GENERATION_WORKERS if workers is None else workers)
+        limits = settings.GENERATION_CLASS_LIMITS if class_limits is None else class_limits
+        self.class_limits = {
+            name: max(1, min(self.workers, limits.get(name, self.workers))) for name in PRIORITY_CLASSES
+        }
+        self.max_queue = settings.GENERATION_MAX_QUEUE if max_queue is None else max_queue
+        self.coalesce = settings.GENERATION_COALESCE if coalesce is None else coalesce
+        window = settings.GENERATION_STATS_WINDOW if stats_window is None else stats_window
+        self._cond = threading.Condition()
+        self._queues = {name: deque() for name in PRIORITY_CLASSES}
+        self._running = {name: 0 for name in PRIORITY_CLASSES}
+        self._inflight = {}  # プロンプト -> 待機中・生成中のジョブ
+        self._queue_seconds = {name: deque(maxlen=window) for name in PRIORITY_CLASSES}
+        self._service_seconds = {name: deque(maxlen=window) for name in PRIORITY_CLASSES}
+        self._counts = {
+            name: {"submitted": 0, "coalesced": 0, "completed": 0, "failed": 0} for name in PRIORITY_CLASSES
+        }
+        self._threads = []
+
+    def __len__(self):
+        """待機中のジョブ数"""
+        with self._cond:
+            return self._queued()
+
+    def _queued(self):
+        return sum(len(jobs) for jobs in self._queues.values())
+
+    def _start_workers(self):
+        # 生成しない用途（取り込みのみ等）でスレッドを作らないよう、初回の投入時に起動する
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, prompt, priority="interactive", block=False):
+        """プロンプトを投入してジョブを返す
+
+        block=False で待機中のジョブが max_queue に達している場合は QueueFullError を送出し、
+        block=True の場合は空きができるまで待つ。
+        """
+        if priority not in self._queues:
+            raise ValueError(f"未対応の優先度です: {priority}（対応: {', '.join(PRIORITY_CLASSES)}）")
+        with self._cond:
+            self._counts[priority]["submitted"] += 1
+            job = self._inflight.get(prompt) if self.coalesce else None
+            if job is not None:
+                job.waiters += 1
+                self._counts[priority]["coalesced"] += 1
+                metrics.increment(f"scheduler.{priority}.coalesced")
+                if job.started is None and PRIORITY_CLASSES.index(priority) < PRIORITY_CLASSES.index(job.priority):
+                    self._queues[job.priority].remove(job)
+                    job.priority = priority
+                    self._queues[priority].append(job)
+                    self._cond.notify_all()
+                return job
+            while self.max_queue and self._queued() >= self.max_queue:
+                if not block:
+                    raise QueueFullError("生成キューが混雑しています")
+                self._cond.wait()
+            job = GenerationJob(prompt, priority)
+            self._queues[priority].append(job)
+            if self.coalesce:
+                self._inflight[prompt] = job
+            self._start_workers()
+            metrics.set_gauge(f"scheduler.{priority}.queued", len(self._queues[priority]))
+            self._cond.notify_all()
+        return job
+
+    def generate(self, prompt, priority="interactive"):
+        """生成の完了を待って全文を返す（キューに空きがなければ待つ）"""
+        return self.submit(prompt, priority, block=True).result()
+
+    def stream(self, prompt, priority="interactive"):
+        """生成結果をテキスト片ごとに返す（キューに空きがなければ待つ）"""
+        yield from self.submit(prompt, priority, block=True).stream()
+
+    def _next_job(self):
+        """同時実行数の上限に達していないクラスのうち、最も優先度の高いジョブを取り出す"""
+        for name in PRIORITY_CLASSES:
+            if self._queues[name] and self._running[name] < self.class_limits[name]:
+                return self._queues[name].popleft()
+        return None
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._next_job()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_job()
+                name = job.priority
+                self._running[name] += 1
+                job.started = time.perf_counter()
+                metrics.set_gauge(f"scheduler.{name}.queued", len(self._queues[name]))
+                metrics.set_gauge(f"scheduler.{name}.running", self._running[name])
+                self._cond.notify_all()  # 投入待ち（block=True）に空きを知らせる
+            error = None
+            try:
+                with metrics.span("generate"):
+                    for piece in self.llm.input_text_stream(job.prompt):
+                        job._put(piece)
+            except Exception as e:
+                error = e
+            with self._cond:
+                job._finish(error)
+                if self._inflight.get(job.prompt) is job:
+                    del self._inflight[job.prompt]
+                self._running[name] -= 1
+                queue_seconds = job.started - job.submitted
+                service_seconds = job.finished - job.started
+                self._queue_seconds[name].append(queue_seconds)
+                self._service_seconds[name].append(service_seconds)
+                self._counts[name]["failed" if error else "completed"] += 1
+                metrics.set_gauge(f"scheduler.{name}.running", self._running[name])
+                self._cond.notify_all()
+            metrics.observe(f"scheduler.{name}.queue_wait", queue_seconds)
+            metrics.observe(f"scheduler.{name}.service", service_seconds)
+
+    def stats(self):
+        """クラスごとの待ち時間・処理時間（直近 stats_window 件のp50/p95、ミリ秒）と件数"""
+        with self._cond:
+            report = {}
+            for name in PRIORITY_CLASSES:
+                entry = dict(self._counts[name])
+                entry["queued"] = len(self._queues[name])
+                entry["running"] = self._running[name]
+                entry["limit"] = self.class_limits[name]
+                for label, samples in (("queue", self._queue_seconds[name]), ("service", self._service_seconds[name])):
+                    values = list(samples)
+                    entry[f"{label}_p50_ms"] = _percentile(values, 50) * 1000.0
+                    entry[f"{label}_p95_ms"] = _percentile(values, 95) * 1000.0
+                report[name] = entry
+            return {"workers": self.workers, "inflight": len(self._inflight), "classes": report}
@@ -0,0 +1,133 @@
+import hashlib
+import os
+import re
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+from config import settings
+from ..utils.metrics import metrics
+
+
+# 出力に使う語彙（プロンプトのハッシュで決定的に選択）
+STUB_VOCABULARY = [
+    "ログ",
+    "エラー",
+    "接続",
+    "要約",
+    "原因",
+    "対策",
+    "時系列",
+    "警告",
+    "データベース",
+    "メモリ",
+    "timeout",
+    "retry",
+    "database",
+    "memory",
+    "network",
+    "。",
+    "、",
+]
+
+# おおよそのトークン分割（英数字の連続は1トークン、それ以外は1文字1トークン）
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9_]+|[^\sA-Za-z0-9_]")
+
+
+def estimate_tokens(text):
+    """トークナイザーを使わずにトークン数を概算"""
+    return len(TOKEN_PATTERN.findall(text))
+
+
+class StubLLM:
+    """モデルやサーバーなしで動作する決定的なスタブLLM
+
+    プリフィル・デコードの遅延をトークン数に応じて模擬し、出力はプロンプトから決定的に生成する。
+    負荷試験やCIでの取り込み・検索・キャッシュ・並行処理の検証に使用する。
+    """
+
+    def __init__(self, model_name=None, prefill_ms_per_token=None, decode_ms_per_token=None, output_tokens=None):
+        self.model = model_name or "stub"
+        self.default_system_prompt = settings.DEFAULT_SYSTEM_PROMPT
+        self.custom_system_prompt = settings.CUSTOM_SYSTEM_PROMPT
+        self.prefill_ms_per_token = (
+            settings.STUB_PREFILL_MS_PER_TOKEN if prefill_ms_per_token is None else prefill_ms_per_token
+        )
+        self.decode_ms_per_token = settings.STUB_DECODE_MS_PER_TOKEN if decode_ms_per_token is None else decode_ms_per_token
+        self.max_tokens = settings.STUB_OUTPUT_TOKENS if output_tokens is None else output_tokens
+        self.calls = 0
+
+    def _generate_tokens(self, prompt):
+        """プロンプトのハッシュから出力トークン列を決定的に生成"""
+        tokens = []
+        digest = b""
+        counter = 0
+        while len(tokens) < self.max_tokens:
+            digest = hashlib.sha256(digest + prompt.encode("utf-8") + counter.to_bytes(4, "little")).digest()
+            tokens.extend(STUB_VOCABULARY[b % len(STUB_VOCABULARY)] for b in digest)
+            counter += 1
+        return tokens[: self.max_tokens]
+
+    def process_stream(self, messages):
+        """トークンごとに出力を返す（デコード遅延を1トークンずつ模擬）"""
+        prompt = "\n".join([f"{m['role']}: {m['content']}" for m in messages])
+        self.calls += 1
+
+        start = time.perf_counter()
+        prompt_tokens = estimate_tokens(prompt)
+        if self.prefill_ms_per_token:
+            time.sleep(prompt_tokens * self.prefill_ms_per_token / 1000.0)
+        first_token_time = time.perf_counter()
+
+        generated = 0
+        for token in self._generate_tokens(prompt):
+            if self.decode_ms_per_token:
+                time.sleep(self.decode_ms_per_token / 1000.0)
+            generated += 1
+            yield token
+
+        end_time = time.perf_counter()
+        metrics.observe("llm.prefill", first_token_time - start)
+        metrics.observe("llm.decode", end_time - first_token_time)
+        metrics.increment("llm.prompt_tokens", prompt_tokens)
+        metrics.increment("llm.generated_tokens", generated)
+
+    def process(self, messages):
+        return "".join(self.process_stream(messages))
+
+    def _messages(self, text):
+        messages = [{"role": "system", "content": self.default_system_prompt}]
+        if self.custom_system_prompt:
+            messages.append({"role": "user", "content": self.custom_system_prompt})
+        messages.append({"role": "user", "content": text})
+        return messages
+
+    def input_text(self, text):
+        return self.process(self._messages(text))
+
+    def input_text_stream(self, text):
+        """生成結果を逐次返す"""
+        return self.process_stream(self._messages(text))
+
+    def input_text_list(self, texts):
+        return [self.input_text(text) for text in texts]
+
+    def summarize_with_context(self, user_request, context_data):
+        if isinstance(context_data, list):
+            context_text = "\n".join([str(item.get("text", item)) for item in context_data])
+        else:
+            context_text = str(context_data)
+
+        messages = [
+            {"role": "system", "content": "あなたは優秀なログ分析・要約の専門家です。"},
+            {
+                "role": "user",
+                "content": f"以下のデータを分析して要約してください。\n\nユーザーの要求: {user_request}\n\nデータ:\n{context_text}",
+            },
+        ]
+        return self.process(messages)
+
+    def input_text_and_vector(self, text, vector):
+        messages = self._messages(text)
+        messages[-1]["vector"] = vector
+        return self.process(messages)
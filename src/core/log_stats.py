@@ -0,0 +1,363 @@
+import calendar
+import re
+import time
+from datetime import datetime
+import numpy as np
+
+
+LEVELS = ("error", "warning", "info", "other")
+
+# 明示的なログレベル表記（あればキーワード判定より優先）
+LEVEL_TOKEN_PATTERN = re.compile(r"\b(FATAL|CRITICAL|SEVERE|ERROR|ERR|WARNING|WARN|INFO|NOTICE|DEBUG|TRACE)\b")
+LEVEL_TOKEN_MAP = {
+    "FATAL": "error",
+    "CRITICAL": "error",
+    "SEVERE": "error",
+    "ERROR": "error",
+    "ERR": "error",
+    "WARNING": "warning",
+    "WARN": "warning",
+    "INFO": "info",
+    "NOTICE": "info",
+    "DEBUG": "other",
+    "TRACE": "other",
+}
+COMPONENT_PATTERN = re.compile(r"\[([^\[\]\s]{1,64})\]")
+# テンプレート化で可変部分（数値・16進・IPなど）を置き換えるパターン
+TEMPLATE_VARIABLE_PATTERN = re.compile(r"0x[0-9a-fA-F]+|[0-9a-fA-F]{8,}|\d+(?:[.:/,-]\d+)*")
+TIMESTAMP_FORMATS = ("%Y-%m-%d %H:%M:%S", "%Y/%m/%d %H:%M:%S")
+
+
+def parse_timestamp(text, timestamp_pattern):
+    """イベント先頭行の最初のタイムスタンプをUNIX秒（タイムゾーンなしとして扱う）に変換
+
+    スタックトレースやメッセージ本文中の日時をイベントの時刻と取り違えないよう、先頭行だけを探す。
+    """
+    end = text.find("\n")
+    match = timestamp_pattern.search(text, 0, len(text) if end < 0 else end)
+    if not match:
+        return None
+    value = match.group(0)
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return calendar.timegm(datetime.strptime(value, fmt).timetuple())
+        except ValueError:
+            continue
+    return None
+
+
+def format_bucket(epoch_seconds):
+    """バケット開始時刻を表示用文字列に変換"""
+    return time.strftime("%Y-%m-%d %H:%M", time.gmtime(epoch_seconds))
+
+
+class _CountTable:
+    """名前 -> 件数 をNumPy配列で保持する小さな集計表"""
+
+    def __init__(self, dtype=np.int64):
+        self.names = []
+        self._index = {}
+        self.counts = np.zeros(16, dtype=dtype)
+
+    def index_of(self, name):
+        idx = self._index.get(name)
+        if idx is None:
+            idx = len(self.names)
+            self._index[name] = idx
+            self.names.append(name)
+            if idx >= len(self.counts):
+                self.counts = np.concatenate([self.counts, np.zeros(len(self.counts), dtype=self.counts.dtype)])
+        return idx
+
+    def add(self, name, count=1):
+        idx = self.index_of(name)  # 配列の拡張後に参照する
+        self.counts[idx] += count
+
+    def as_dict(self, limit=None):
+        n = len(self.names)
+        order = np.argsort(-self.counts[:n], kind="stable")
+        order = order[self.counts[order] > 0]  # 削除で0件になった名前は除く
+        if limit is not None:
+            order = order[:limit]
+        return {self.names[i]: int(self.counts[i]) for i in order}
+
+
+def _grow(array, size):
+    """1次元配列を必要に応じて倍々に拡張"""
+    if size <= len(array):
+        return array
+    new_size = max(size, len(array) * 2)
+    grown = np.zeros(new_size, dtype=array.dtype)
+    grown[: len(array)] = array
+    return grown
+
+
+class LogStatistics:
+    """取り込み時にログイベントを集計し、LLMを使わずに統計を返すクラス"""
+
+    def __init__(self, level_patterns, timestamp_pattern, bucket_seconds=300):
+        """レベル判定用の正規表現とタイムスタンプ正規表現から集計器を初期化"""
+        self.bucket_seconds = int(bucket_seconds)
+        self.timestamp_pattern = re.compile(timestamp_pattern)
+        self.level_patterns = [(level, re.compile(level_patterns[level])) for level in ("error", "warning", "info")]
+        self.reset()
+
+    def reset(self):
+        """集計結果をすべて破棄"""
+        self.total_events = 0
+        self.level_counts = np.zeros(len(LEVELS), dtype=np.int64)
+        self.components = _CountTable()
+        self.signatures = _CountTable()
+        self.templates = _CountTable()
+        self.sources = _CountTable()  # 取り込み元（ログファイル）ごとのイベント数
+        self._source_signatures = {}  # 取り込み元番号 -> {シグネチャ: 件数}
+        # 時間バケット: バケット番号 -> 行、行ごとにレベル別件数
+        self._bucket_rows = {}
+        self.bucket_ids = np.zeros(64, dtype=np.int64)
+        self.bucket_level_counts = np.zeros((64, len(LEVELS)), dtype=np.int32)
+        # イベントごとの (取り込み元, レベル, コンポーネント, バケット行, テンプレート) の記録（該当なしは-1）
+        # 異常検知時に (バケット行, テンプレート) を密行列へ展開し、取り込み元の削除時に件数を差し引く
+        self._event_count = 0
+        self._event_sources = np.zeros(256, dtype=np.int32)
+        self._event_levels = np.zeros(256, dtype=np.int8)
+        self._event_components = np.zeros(256, dtype=np.int32)
+        self._event_rows = np.zeros(256, dtype=np.int32)
+        self._event_templates = np.zeros(256, dtype=np.int32)
+        self.version = 0  # 集計が更新されるたびに増える
+
+    def classify_level(self, text):
+        """イベントのログレベルを判定"""
+        match = LEVEL_TOKEN_PATTERN.search(text)
+        if match:
+            return LEVEL_TOKEN_MAP[match.group(1)]
+        for level, pattern in self.level_patterns:
+            if pattern.search(text):
+                return level
+        return "other"
+
+    def extract_template(self, text):
+        """イベント先頭行から可変部分を除いたテンプレートを抽出"""
+        first_line = text.split("\n", 1)[0]
+        first_line = self.timestamp_pattern.sub("", first_line)
+        return TEMPLATE_VARIABLE_PATTERN.sub("<*>", first_line).strip()[:120]
+
+    def _bucket_row(self, bucket_id):
+        row = self._bucket_rows.get(bucket_id)
+        if row is None:
+            row = len(self._bucket_rows)
+            self._bucket_rows[bucket_id] = row
+            if row >= len(self.bucket_ids):
+                self.bucket_ids = np.concatenate([self.bucket_ids, np.zeros_like(self.bucket_ids)])
+                self.bucket_level_counts = np.concatenate(
+                    [self.bucket_level_counts, np.zeros_like(self.bucket_level_counts)]
+                )
+            self.bucket_ids[row] = bucket_id
+        return row
+
+    def add_event(self, text, signatures=(), timestamp=None, level=None, source=None):
+        """1イベントを集計に追加し、判定結果を返す
+
+        timestamp / level: 形式ごとのパーサーで判定済みの値（Noneならテキストから判定）
+        source: 取り込み元（remove_sourceでまとめて差し引けるよう記録する）
+        """
+        if level not in LEVELS:
+            level = self.classify_level(text)
+        level_idx = LEVELS.index(level)
+        self.total_events += 1
+        self.level_counts[level_idx] += 1
+
+        component_match = COMPONENT_PATTERN.search(text)
+        component = component_match.group(1) if component_match else None
+        component_id = -1
+        if component:
+            component_id = self.components.index_of(component)
+            self.components.counts[component_id] += 1
+
+        source_id = -1
+        if source is not None:
+            source_id = self.sources.index_of(source)
+            self.sources.counts[source_id] += 1
+            source_signatures = self._source_signatures.setdefault(source_id, {})
+        for signature in signatures:
+            self.signatures.add(signature)
+            if source_id >= 0:
+                source_signatures[signature] = source_signatures.get(signature, 0) + 1
+
+        if timestamp is None:
+            timestamp = parse_timestamp(text, self.timestamp_pattern)
+        bucket = None
+        row = template_id = -1
+        if timestamp is not None:
+            bucket = timestamp - timestamp % self.bucket_seconds
+            row = self._bucket_row(bucket // self.bucket_seconds)
+            self.bucket_level_counts[row, level_idx] += 1
+
+            template_id = self.templates.index_of(self.extract_template(text))
+            self.templates.counts[template_id] += 1
+
+        n = self._event_count
+        self._event_sources = _grow(self._event_sources, n + 1)
+        self._event_levels = _grow(self._event_levels, n + 1)
+        self._event_components = _grow(self._event_components, n + 1)
+        self._event_rows = _grow(self._event_rows, n + 1)
+        self._event_templates = _grow(self._event_templates, n + 1)
+        self._event_sources[n] = source_id
+        self._event_levels[n] = level_idx
+        self._event_components[n] = component_id
+        self._event_rows[n] = row
+        self._event_templates[n] = template_id
+        self._event_count = n + 1
+
+        self.version += 1
+        return {"level": level, "component": component, "timestamp": timestamp, "bucket": bucket}
+
+    def remove_source(self, source):
+        """取り込み元のイベントを集計から差し引き、差し引いたイベント数を返す（再取り込み前などに使用）"""
+        source_id = self.sources._index.get(source)
+        if source_id is None:
+            return 0
+        n = self._event_count
+        mask = self._event_sources[:n] == source_id
+        removed = int(mask.sum())
+        if removed:
+            levels = self._event_levels[:n][mask].astype(np.int64)
+            np.subtract.at(self.level_counts, levels, 1)
+            components = self._event_components[:n][mask]
+            np.subtract.at(self.components.counts, components[components >= 0], 1)
+            rows = self._event_rows[:n][mask]
+            dated = rows >= 0
+            np.subtract.at(self.bucket_level_counts, (rows[dated], levels[dated]), 1)
+            templates = self._event_templates[:n][mask]
+            np.subtract.at(self.templates.counts, templates[templates >= 0], 1)
+
+            keep = ~mask
+            for name in ("_event_sources", "_event_levels", "_event_components", "_event_rows", "_event_templates"):
+                array = getattr(self, name)
+                array[: n - removed] = array[:n][keep]
+            self._event_count = n - removed
+            self.total_events -= removed
+        for signature, count in self._source_signatures.pop(source_id, {}).items():
+            self.signatures.counts[self.signatures.index_of(signature)] -= count
+        self.sources.counts[source_id] = 0
+        self.version += 1
+        return removed
+
+    def _live_bucket_rows(self):
+        """イベントが残っているバケットの行番号（削除で空になったバケットを除く）"""
+        return np.nonzero(self.bucket_level_counts[: len(self._bucket_rows)].any(axis=1))[0]
+
+    def bucket_counts(self, period_seconds=None):
+        """時間順に並べた (バケット開始UNIX秒配列, レベル別件数行列) を返す"""
+        rows = self._live_bucket_rows()
+        if len(rows) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros((0, len(LEVELS)), dtype=np.int64)
+
+        starts = self.bucket_ids[rows] * self.bucket_seconds
+        counts = self.bucket_level_counts[rows].astype(np.int64)
+        if period_seconds and period_seconds != self.bucket_seconds:
+            starts = starts - starts % period_seconds
+
+        unique_starts, inverse = np.unique(starts, return_inverse=True)
+        merged = np.zeros((len(unique_starts), len(LEVELS)), dtype=np.int64)
+        np.add.at(merged, inverse, counts)
+        return unique_starts, merged
+
+    def dense_series(self, max_templates=200, max_gap_buckets=288):
+        """欠損バケットを0で埋めた時系列を返す
+
+        戻り値: (バケット開始UNIX秒配列, レベル別件数行列, テンプレート別件数行列, テンプレート名リスト)
+        テンプレートは出現数の多い上位max_templates件に限定する。
+        イベントのないバケットがmax_gap_buckets個を超えて続く区間は、その個数の空バケットに縮める
+        （かけ離れた日時のイベントが1件あっても行列が期間全体に広がらない）。
+        """
+        live_rows = self._live_bucket_rows()
+        empty = np.zeros(0, dtype=np.int64)
+        if len(live_rows) == 0:
+            return empty, np.zeros((0, len(LEVELS))), np.zeros((0, 0)), []
+
+        bucket_ids = self.bucket_ids[live_rows]
+        order = np.argsort(bucket_ids, kind="stable")
+        sorted_ids = bucket_ids[order]
+        steps = np.minimum(np.diff(sorted_ids), max_gap_buckets + 1)
+        sorted_positions = np.concatenate([[0], np.cumsum(steps)])
+        # バケット行 -> 時系列の位置
+        positions = np.full(len(self._bucket_rows), -1, dtype=np.int64)
+        positions[live_rows[order]] = sorted_positions
+        length = int(sorted_positions[-1]) + 1
+        # 各行の開始時刻は直前の出現バケットからの経過で求める
+        rows = np.arange(length, dtype=np.int64)
+        owner = np.searchsorted(sorted_positions, rows, side="right") - 1
+        starts = (sorted_ids[owner] + rows - sorted_positions[owner]) * self.bucket_seconds
+
+        level_counts = np.zeros((length, len(LEVELS)), dtype=np.float64)
+        level_counts[positions[live_rows]] = self.bucket_level_counts[live_rows]
+
+        n_templates = len(self.templates.names)
+        top = np.argsort(-self.templates.counts[:n_templates], kind="stable")
+        top = top[self.templates.counts[top] > 0][:max_templates]
+        column_of = np.full(n_templates, -1, dtype=np.int64)
+        column_of[top] = np.arange(len(top))
+
+        events = self._event_count
+        template_ids = self._event_templates[:events]
+        dated = template_ids >= 0
+        columns = column_of[template_ids[dated]]
+        keep = columns >= 0
+        template_counts = np.zeros((length, len(top)), dtype=np.float64)
+        np.add.at(template_counts, (positions[self._event_rows[:events][dated][keep]], columns[keep]), 1)
+
+        return starts, level_counts, template_counts, [self.templates.names[i] for i in top]
+
+    def rate_per_hour(self, level=None):
+        """時間あたりの平均件数（タイムスタンプのあるイベントの期間で算出）"""
+        starts, counts = self.bucket_counts()
+        if len(starts) == 0:
+            return 0.0
+        span_hours = max((starts[-1] - starts[0] + self.bucket_seconds) / 3600.0, self.bucket_seconds / 3600.0)
+        column = counts.sum(axis=1) if level is None else counts[:, LEVELS.index(level)]
+        return float(column.sum() / span_hours)
+
+    def stats(self, top_n=10, period_seconds=3600):
+        """集計結果を辞書で返す（LLM不要）"""
+        starts, counts = self.bucket_counts(period_seconds)
+        return {
+            "total_events": int(self.total_events),
+            "levels": {level: int(count) for level, count in zip(LEVELS, self.level_counts)},
+            "components": self.components.as_dict(top_n),
+            "signatures": self.signatures.as_dict(top_n),
+            "period_seconds": period_seconds,
+            "periods": [
+                {"start": format_bucket(int(start)), **{level: int(c) for level, c in zip(LEVELS, row)}}
+                for start, row in zip(starts, counts)
+            ],
+            "error_rate_per_hour": self.rate_per_hour("error"),
+            "warning_rate_per_hour": self.rate_per_hour("warning"),
+        }
+
+    def format_table(self, top_n=5, period_seconds=3600, max_periods=24):
+        """プロンプト埋め込み用のコンパクトな統計表を生成"""
+        if self.total_events == 0:
+            return ""
+
+        summary = self.stats(top_n=top_n, period_seconds=period_seconds)
+        levels = summary["levels"]
+        lines = [
+            f"総イベント数: {summary['total_events']} "
+            f"(error={levels['error']}, warning={levels['warning']}, info={levels['info']}, other={levels['other']})",
+            f"エラー率: {summary['error_rate_per_hour']:.1f}件/時, 警告率: {summary['warning_rate_per_hour']:.1f}件/時",
+        ]
+        if summary["components"]:
+            lines.append("コンポーネント別: " + ", ".join(f"{k}={v}" for k, v in summary["components"].items()))
+        if summary["signatures"]:
+            lines.append("シグネチャ別: " + ", ".join(f"{k}={v}" for k, v in summary["signatures"].items()))
+
+        periods = summary["periods"]
+        if periods:
+            lines.append(f"期間別 ({period_seconds // 60}分単位) | error | warning | info")
+            shown = periods[-max_periods:]
+            if len(shown) < len(periods):
+                lines.append(f"(直近{len(shown)}期間のみ表示)")
+            for row in shown:
+                lines.append(f"{row['start']} | {row['error']} | {row['warning']} | {row['info']}")
+
+        return "\n".join(lines)
@@ -1,8 +1,35 @@
+import copy
+import json
 import os
+import shutil
+import threading
 import time
+from array import array
 from pathlib import Path
+import sys
 import faiss
 import numpy as np
+from ..utils.cache import LRUCache
+from ..utils.log_reader import LogDecoder, iter_decoded_lines
+from ..utils.metrics import metrics
+from ..utils.rwlock import ReadWriteLock
+from .rerank import mmr_select, suppress_near_duplicates
+from .text_store import compact_text_store, create_text_store
+from .vector_index import (
+    RawVectorStore,
+    codes_compatible,
+    compacted_index,
+    create_index,
+    index_codes,
+    index_signature,
+    reconstruct_vectors,
+    rerank_exact,
+    search_subset,
+    supports_selector,
+)
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+from config import settings
 
 
 def file_exists(file_path):
@@ -18,6 +45,31 @@ def load_text_file(file_path):
         return file.read()
 
 
+def write_records(file_path, texts, metadata):
+    """テキストとメタデータをJSON Lines形式で書き出し"""
+    with open(file_path, "w", encoding="utf-8") as file:
+        for text, meta in zip(texts, metadata):
+            file.write(json.dumps({"text": text, "metadata": meta}, ensure_ascii=False) + "\n")
+
+
+def read_records(file_path):
+    """JSON Lines形式のテキストとメタデータを読み込み"""
+    with open(file_path, "r", encoding="utf-8") as file:
+        for line in file:
+            record = json.loads(line)
+            yield record["text"], record.get("metadata") or {}
+
+
+def write_json_atomic(file_path, data):
+    """一時ファイルに書いてからrenameすることでJSONを原子的に更新"""
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False, indent=2)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, file_path)
+
+
 def text_to_vector(text, vector_dim=512):
     # Fixed dimension vector representation
     # Simple hash-based approach for consistent dimensions
@@ -29,11 +81,91 @@ def text_to_vector(text, vector_dim=512):
     return vector
 
 
+def configure_faiss_threads(num_threads):
+    """FaissのOpenMPスレッド数を設定（Noneの場合はFaissの既定値のまま）"""
+    if num_threads:
+        faiss.omp_set_num_threads(int(num_threads))
+
+
+configure_faiss_threads(settings.FAISS_OMP_THREADS)
+
+
+def _time_ranges_key(time_ranges):
+    """キャッシュキー用に時間範囲をハッシュ可能な形へ正規化"""
+    if not time_ranges:
+        return None
+    return tuple(sorted((int(start), int(end)) for start, end in time_ranges))
+
+
 class RAG:
-    def __init__(self, vector_dim=512):
+    """Faissインデックスとテキストストアによる検索拡張
+
+    並行性: 検索（query / query_many）は読み取りロック、追加・削除・コンパクションの置き換え・読み込みは
+    書き込みロック（書き込み優先の読み書きロック）で排他する。埋め込み・インデックスの学習・コンパクションの
+    作り直しはロックの外か読み取りロック下で行い、書き込みロックは完成したバッチをインデックスとテキストへ
+    まとめて公開する間だけ保持する。そのため検索がテキストのないインデックス項目を見ることはなく、
+    長い取り込みバッチの埋め込み中も検索は止まらない。
+    """
+
+    def __init__(
+        self,
+        vector_dim=512,
+        query_cache_size=None,
+        embedding_cache_size=None,
+        embedder=None,
+        index_type=None,
+        raw_vector_path=None,
+        rerank_factor=None,
+        mmr_lambda=None,
+        dedup_distance=None,
+        text_store=None,
+        index_template=None,
+    ):
+        """embedderを渡すとtext_to_vectorの代わりに使用し、次元数はモデルから取得する
+
+        index_type: "flat", "sq8", "sqfp16", "pq"（学習が必要な方式は件数がたまるまでflatで保持）
+        raw_vector_path: 生ベクトルをディスクに保存するファイル（再ランキング用）
+        rerank_factor: 0より大きい場合、k*rerank_factor件の候補を生ベクトルで正確に並べ替える
+        mmr_lambda: 指定するとMMRで多様性を考慮して候補からk件を選ぶ（1に近いほど関連度重視）
+        dedup_distance: 指定するとSimHashのハミング距離がこの値以下の候補を重複として除外する
+        text_store: テキストの保持方式（"list", "arena", "zstd", "file"）
+        index_template: 学習済みの空インデックス。指定すると学習せずにその量子化で格納する
+            （複数ノードの部分インデックスを劣化なく統合できるよう量子化を揃える場合）
+        """
+        self.embedder = embedder
+        if embedder is not None:
+            vector_dim = embedder.dim
         self.vector_dim = vector_dim
-        self.index = faiss.IndexFlatL2(vector_dim)
-        self.texts = []  # Store original texts for reference
+        self.index_type = index_type or settings.RAG_INDEX_TYPE
+        self.index_template = index_template
+        self.rerank_factor = settings.RAG_RERANK_FACTOR if rerank_factor is None else rerank_factor
+        self.mmr_lambda = settings.RAG_MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+        self.dedup_distance = settings.RAG_DEDUP_HAMMING if dedup_distance is None else dedup_distance
+        # 既存ファイルは最初の追加時に件数を確認してから扱う（load_latestで再利用できるよう即座には消さない）
+        self.raw_vectors = RawVectorStore(raw_vector_path, vector_dim, truncate=False) if raw_vector_path else None
+        # 検索結果キャッシュ（インデックス世代でタグ付けし、追加後の古い結果は返さない）とクエリ埋め込みキャッシュ
+        self.generation = 0
+        self._query_cache = LRUCache(settings.RAG_QUERY_CACHE_SIZE if query_cache_size is None else query_cache_size)
+        self._embedding_cache = LRUCache(
+            settings.RAG_EMBEDDING_CACHE_SIZE if embedding_cache_size is None else embedding_cache_size
+        )
+        self.index = self._new_index()
+        self.text_store_type = text_store or settings.RAG_TEXT_STORE
+        self.texts = create_text_store(self.text_store_type)  # Store original texts for reference
+        self.metadata = []  # Per-text metadata (signatures, source file, ...)
+        self.timestamps = array("q")  # Per-text UNIX timestamp (-1 if unknown) for time filtering
+        # 位置（Faissの格納順）ごとの安定したチャンクID。IDは単調増加で割り当てるため配列は常に昇順
+        self.ids = array("q")
+        self.next_id = 0
+        # 削除済み（トゥームストーン）フラグ。検索からは除外し、しきい値を超えたらコンパクションで詰める
+        self._deleted = bytearray()
+        self.deleted_count = 0
+        self._deleted_cache = (-1, None)
+        self._removed_since_snapshot = []  # 前回のスナップショット以降に削除したID
+        self._snapshot_count = 0  # Number of entries already persisted by save_snapshot()
+        self._lock = ReadWriteLock()  # 検索（読み取り）と追加・削除・置き換え（書き込み）の排他
+        self._train_lock = threading.Lock()  # インデックスの学習は同時に1つだけ
+        self._save_lock = threading.Lock()  # スナップショットの保存は同時に1つだけ
 
     def __del__(self):
         try:
@@ -48,51 +180,554 @@ class RAG:
             # デストラクタでの例外は無視
             pass
 
-    def add_text(self, text):
-        vector = text_to_vector(text, self.vector_dim)
-        self.index.add(np.array([vector]).astype(np.float32))
-        self.texts.append(text)
+    def __len__(self):
+        """削除済みを除いたチャンク数"""
+        return len(self.texts) - self.deleted_count
 
-    def query(self, text, k=5):
-        # Check if there are any texts in the index
-        if len(self.texts) == 0:
-            return []
+    def _new_index(self):
+        if self.index_template is not None:
+            return faiss.clone_index(self.index_template)
+        index = create_index(self.index_type, self.vector_dim, settings.RAG_PQ_M, settings.RAG_PQ_NBITS)
+        # 学習が必要な方式は、学習用の件数がたまるまでflatで保持する
+        return index if index.is_trained else faiss.IndexFlatL2(self.vector_dim)
+
+    @property
+    def is_compressed(self):
+        return not isinstance(self.index, faiss.IndexFlat)
 
-        vector = text_to_vector(text, self.vector_dim)
-        actual_k = min(k, len(self.texts))
+    def train_index(self, force=False):
+        """flatで保持しているベクトルで圧縮インデックスを学習して置き換える
 
+        force=Falseの場合はRAG_INDEX_TRAIN_SIZE件以上たまっている時だけ学習する。
+        学習はロックの外で行い、その間に追加されたベクトルを加えてから書き込みロック下で置き換える。
+        """
+        if not self._train_lock.acquire(blocking=False):
+            return False  # 別のスレッドが学習中
         try:
-            D, I = self.index.search(np.array([vector]).astype(np.float32), k=actual_k)
-        except Exception as e:
-            print(f"Search error: {e}")
-            return []
+            with self._lock.read():
+                if self.index_type == "flat" or self.is_compressed or self.index.ntotal == 0:
+                    return False
+                if not force and self.index.ntotal < settings.RAG_INDEX_TRAIN_SIZE:
+                    return False
+                source = self.index
+                trained_count = source.ntotal
+                vectors = source.reconstruct_n(0, trained_count)  # flatなので劣化なし
+            sample = vectors
+            if len(vectors) > settings.RAG_INDEX_TRAIN_SIZE:
+                rng = np.random.default_rng(0)
+                sample = vectors[rng.choice(len(vectors), settings.RAG_INDEX_TRAIN_SIZE, replace=False)]
+            compressed = create_index(self.index_type, self.vector_dim, settings.RAG_PQ_M, settings.RAG_PQ_NBITS)
+            with metrics.span("index_train"):
+                compressed.train(sample)
+                compressed.add(vectors)
+            with self._lock.write():
+                if self.index is not source:
+                    return False  # 学習中にコンパクションや読み込みでインデックスが置き換わった
+                if source.ntotal > trained_count:
+                    compressed.add(source.reconstruct_n(trained_count, source.ntotal - trained_count))
+                self.index = compressed
+                self.generation += 1
+        finally:
+            self._train_lock.release()
+        print(f"インデックスを学習しました（{self.index_type}, {len(sample)}件で学習, {compressed.code_size}バイト/件）")
+        return True
+
+    def _add_vectors(self, vectors):
+        if self.raw_vectors is not None and len(self.raw_vectors) != self.index.ntotal:
+            if self.index.ntotal == 0:
+                self.raw_vectors.truncate()
+            else:
+                print(f"生ベクトルの件数がインデックスと一致しないため再ランキングを無効にします: {self.raw_vectors.path}")
+                self.raw_vectors.close()
+                self.raw_vectors = None
+        with metrics.span("index_add"):
+            self.index.add(vectors)
+            if self.raw_vectors is not None:
+                self.raw_vectors.append(vectors)
+
+    def _append_record(self, text, metadata, ref=None, record_id=None):
+        self.generation += 1
+        if ref is not None:
+            self.texts.append(text, ref=ref)
+        else:
+            self.texts.append(text)
+        self.metadata.append(metadata)
+        timestamp = metadata.get("timestamp")
+        self.timestamps.append(-1 if timestamp is None else int(timestamp))
+        if record_id is None:
+            record_id = self.next_id
+        self.ids.append(record_id)
+        self.next_id = max(self.next_id, record_id + 1)
+        self._deleted.append(0)
+
+    # --- 削除・コンパクション ---
+
+    def _deleted_positions(self):
+        """削除済みの位置（昇順、世代ごとにキャッシュ）"""
+        generation, positions = self._deleted_cache
+        if generation != self.generation or positions is None:
+            flags = np.frombuffer(self._deleted, dtype=np.uint8) if len(self._deleted) else np.zeros(0, np.uint8)
+            positions = np.nonzero(flags)[0].astype(np.int64)
+            self._deleted_cache = (self.generation, positions)
+        return positions
+
+    def _live_positions(self):
+        flags = np.frombuffer(self._deleted, dtype=np.uint8) if len(self._deleted) else np.zeros(0, np.uint8)
+        return np.nonzero(flags == 0)[0].astype(np.int64)
+
+    def positions_of(self, ids):
+        """安定IDを現在の位置に変換（存在しないIDは除外）"""
+        ids = np.asarray(ids, dtype=np.int64)
+        all_ids = np.frombuffer(self.ids, dtype=np.int64) if len(self.ids) else np.zeros(0, np.int64)
+        positions = np.searchsorted(all_ids, ids)
+        found = positions < len(all_ids)
+        found[found] = all_ids[positions[found]] == ids[found]
+        return positions[found]
+
+    def _remove_positions(self, positions):
+        """指定位置をトゥームストーンにして件数を返す（ストレージはコンパクションまで保持）"""
+        removed = 0
+        for position in positions:
+            if not self._deleted[position]:
+                self._deleted[position] = 1
+                self._removed_since_snapshot.append(self.ids[position])
+                removed += 1
+        if removed:
+            self.deleted_count += removed
+            self.generation += 1
+            metrics.increment("rag.removed", removed)
+        return removed
+
+    def remove_ids(self, ids):
+        """安定IDを指定してチャンクを削除"""
+        with self._lock.write():
+            return self._remove_positions(self.positions_of(ids))
+
+    def _ids_at(self, positions):
+        return np.frombuffer(self.ids, dtype=np.int64)[np.asarray(positions, dtype=np.int64)] if len(self.ids) else []
+
+    def remove_by_file(self, file_path):
+        """指定したログファイルから取り込んだチャンクを削除（修正版の再取り込み前などに使用）"""
+        target = os.path.abspath(str(file_path))
+        # 対象の走査は読み取りロック下で行い、位置が変わっても追えるよう安定IDで削除する
+        with self._lock.read():
+            positions = [
+                position
+                for position, metadata in enumerate(self.metadata)
+                if metadata.get("source") is not None and os.path.abspath(metadata["source"]) == target
+            ]
+            ids = self._ids_at(positions)
+        return self.remove_ids(ids)
+
+    def remove_before(self, timestamp):
+        """指定したUNIX時刻より前のタイムスタンプを持つチャンクを削除（タイムスタンプ不明のものは残す）"""
+        with self._lock.read():
+            timestamps = np.frombuffer(self.timestamps, dtype=np.int64) if len(self.timestamps) else np.zeros(0, np.int64)
+            ids = self._ids_at(np.nonzero((timestamps >= 0) & (timestamps < int(timestamp)))[0])
+        return self.remove_ids(ids)
+
+    @property
+    def has_unsaved_changes(self):
+        """前回のスナップショット以降に追加・削除・コンパクションがあったか"""
+        return self._snapshot_count != len(self.texts) or bool(self._removed_since_snapshot)
+
+    def needs_compaction(self, threshold=None):
+        """削除済みの割合がしきい値を超えているか"""
+        threshold = settings.RAG_COMPACT_THRESHOLD if threshold is None else threshold
+        return self.deleted_count > 0 and self.deleted_count >= threshold * len(self.texts)
+
+    def build_compaction(self):
+        """削除済みを除いたインデックス・テキスト・メタデータを作る（現在の状態は変更しない）
+
+        書き込みだけを止めて（stable）行うため、作り直しの間も検索は書き込み待ちの後ろに並ばずに実行でき、
+        検索を止めるのはinstall_compactionの置き換えだけになる。
+        """
+        with self._lock.stable():
+            return self._build_compaction()
+
+    def _build_compaction(self):
+        keep = self._live_positions()
+        with metrics.span("compaction"):
+            state = {
+                "generation": self.generation,
+                "index": compacted_index(self.index, keep),
+                "texts": compact_text_store(self.texts, keep),
+                "metadata": [self.metadata[i] for i in keep],
+                "timestamps": array("q", np.frombuffer(self.timestamps, dtype=np.int64)[keep].tobytes()),
+                "ids": array("q", np.frombuffer(self.ids, dtype=np.int64)[keep].tobytes()),
+                "raw_path": None,
+            }
+            if self.raw_vectors is not None and len(self.raw_vectors) == self.index.ntotal:
+                state["raw_path"] = f"{self.raw_vectors.path}.compact"
+                self.raw_vectors.write_subset(state["raw_path"], keep)
+        return state
+
+    def install_compaction(self, state):
+        """build_compactionの結果で置き換える（その間に追加・削除があった場合は破棄してFalse）"""
+        with self._lock.write():
+            removed = self._install_compaction(state)
+        if removed is None:
+            return False
+        metrics.increment("rag.compactions")
+        print(f"コンパクションを行いました（削除済み{removed}件を除去、残り{len(self.texts)}件）")
+        return True
+
+    def _install_compaction(self, state):
+        if state["generation"] != self.generation:
+            if state["raw_path"]:
+                os.remove(state["raw_path"])
+            return None
+        removed = self.deleted_count
+        old_texts = self.texts
+        self.index = state["index"]
+        self.texts = state["texts"]
+        self.metadata = state["metadata"]
+        self.timestamps = state["timestamps"]
+        self.ids = state["ids"]
+        self._deleted = bytearray(len(self.ids))
+        self.deleted_count = 0
+        if hasattr(old_texts, "close"):
+            old_texts.close()
+        if self.raw_vectors is not None:
+            path = self.raw_vectors.path
+            self.raw_vectors.close()
+            if state["raw_path"]:
+                os.replace(state["raw_path"], path)
+                self.raw_vectors = RawVectorStore(path, self.vector_dim, truncate=False)
+            else:
+                self.raw_vectors = None
+        self.generation += 1
+        # 位置が変わったため、次回のスナップショットはベースから書き直す（未保存なら全体が新規のまま）
+        if self._snapshot_count > 0:
+            self._snapshot_count = -1
+        return removed
+
+    def compact(self):
+        """削除済みのチャンクをインデックスとテキストストアから取り除く"""
+        if self.deleted_count == 0:
+            return False
+        return self.install_compaction(self.build_compaction())
+
+    @property
+    def embedder_name(self):
+        return self.embedder.name if self.embedder is not None else f"hash-{self.vector_dim}"
+
+    def embed(self, texts):
+        """テキストのリストを (件数, 次元) のfloat32行列に変換"""
+        if self.embedder is not None:
+            return np.ascontiguousarray(self.embedder.embed(texts), dtype=np.float32)
+        return np.array([text_to_vector(text, self.vector_dim) for text in texts], dtype=np.float32)
+
+    def add_text(self, text, metadata=None):
+        with metrics.span("embed"):
+            vectors = self.embed([text])
+        self.add_embedded([text], vectors, [metadata])
+
+    def add_texts(self, texts, metadata_list=None, refs=None):
+        """複数のテキストをまとめて埋め込み・追加（モデル埋め込みのバッチ推論を活かす）"""
+        if not texts:
+            return
+        with metrics.span("embed"):
+            vectors = self.embed(texts)
+        self.add_embedded(texts, vectors, metadata_list, refs)
+
+    def add_embedded(self, texts, vectors, metadata_list=None, refs=None):
+        """埋め込み済みのベクトルとテキストを追加（取り込みパイプラインで埋め込みを別スレッドで行う場合）
+
+        refs: 元ログへの参照 (パス, オフセット, 長さ, エンコーディング) のリスト（"file" ストアでのみ使用）
+        """
+        if not texts:
+            return
+        metadata_list = metadata_list or [None] * len(texts)
+        if refs is None or self.text_store_type != "file":
+            refs = [None] * len(texts)
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        # インデックスへの追加とテキスト・メタデータの追加を1回の書き込みロックでまとめて公開する
+        with self._lock.write():
+            self._add_vectors(vectors)
+            for text, metadata, ref in zip(texts, metadata_list, refs):
+                self._append_record(text, metadata or {}, ref)
+        if self.index_type != "flat" and not self.is_compressed:
+            self.train_index()
+
+    def merge_from(self, other, extra_metadata=None):
+        """別のRAG（他ノードで作った部分インデックスなど）の削除済みでないチャンクを末尾に統合し、IDのオフセットを返す
+
+        統合したチャンクのIDは「元のID + オフセット（統合前のnext_id）」に付け替える。量子化の学習結果が同じなら
+        Faissのmerge_fromで格納コードをそのまま移し、異なる場合は復号したベクトルを追加し直す（精度が落ちる）。
+        extra_metadata: 統合したチャンクのメタデータに加える項目（取り込んだノード名など）
+        """
+        if other.vector_dim != self.vector_dim:
+            raise ValueError(f"ベクトル次元が一致しません: {other.vector_dim} != {self.vector_dim}")
+        with other._lock.read():
+            keep = other._live_positions()
+            source = compacted_index(other.index, keep)  # merge_fromは統合元を空にするため複製を使う
+            texts = [other.texts[i] for i in keep]
+            metadata_list = [dict(other.metadata[i], **(extra_metadata or {})) for i in keep]
+            ids = other._ids_at(keep)
+        with self._lock.write():
+            id_offset = self.next_id
+            if not texts:
+                return id_offset
+            self._merge_index(source)
+            if self.raw_vectors is not None:
+                print(f"統合したチャンクの生ベクトルがないため再ランキングを無効にします: {self.raw_vectors.path}")
+                self.raw_vectors.close()
+                self.raw_vectors = None
+            for text, metadata, chunk_id in zip(texts, metadata_list, ids):
+                self._append_record(text, metadata, record_id=id_offset + int(chunk_id))
+        metrics.increment("rag.merged", len(texts))
+        if self.index_type != "flat" and not self.is_compressed:
+            self.train_index()
+        return id_offset
+
+    def _merge_index(self, source):
+        """統合するチャンクの格納コードをインデックスの末尾に加える"""
+        if codes_compatible(self.index, source):
+            self.index.merge_from(source)
+            return
+        expected = create_index(self.index_type, self.vector_dim, settings.RAG_PQ_M, settings.RAG_PQ_NBITS)
+        if self.index.ntotal == 0 and source.is_trained and index_signature(source) == index_signature(expected):
+            # 空のうちは統合元の学習済みインデックスをそのまま引き継ぐ
+            self.index = source
+            return
+        if not isinstance(source, faiss.IndexFlat):
+            print("量子化の学習結果が異なるため、復号したベクトルで追加し直します（量子化をノード間で揃えると劣化しません）")
+        with metrics.span("index_add"):
+            self.index.add(reconstruct_vectors(source, np.arange(source.ntotal)))
+
+    def ids_in_time_ranges(self, time_ranges):
+        """指定した時間範囲 [start, end) に含まれるテキストの位置を返す"""
+        timestamps = np.frombuffer(self.timestamps, dtype=np.int64) if len(self.timestamps) else np.zeros(0, np.int64)
+        mask = np.zeros(len(timestamps), dtype=bool)
+        for start, end in time_ranges:
+            mask |= (timestamps >= start) & (timestamps < end)
+        return np.nonzero(mask)[0].astype(np.int64)
+
+    def _query_vector(self, text):
+        """クエリ埋め込みを取得（同じクエリ文字列は再計算しない）"""
+        vector = self._embedding_cache.get(text)
+        if vector is not None:
+            metrics.increment("rag.embedding_cache.hit")
+            return vector
+        metrics.increment("rag.embedding_cache.miss")
+        with metrics.span("embed"):
+            vector = self.embed([text])
+        self._embedding_cache.put(text, vector)
+        return vector
+
+    def _query_vectors(self, texts):
+        """複数クエリの埋め込みを行列で取得（キャッシュにないものだけをまとめて計算）"""
+        vectors = [self._embedding_cache.get(text) for text in texts]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        metrics.increment("rag.embedding_cache.hit", len(texts) - len(missing))
+        metrics.increment("rag.embedding_cache.miss", len(missing))
+        if missing:
+            with metrics.span("embed"):
+                computed = self.embed([texts[i] for i in missing])
+            for row, i in enumerate(missing):
+                vectors[i] = computed[row : row + 1]
+                self._embedding_cache.put(texts[i], vectors[i])
+        return np.vstack(vectors)
 
-        # Return actual text content and distances
+    def _search(self, vectors, k, time_ranges=None):
+        """ベクトル行列で検索し (D, I) を返す（時間範囲の絞り込み・生ベクトルでの再ランキングを含む）"""
+        candidate_ids = None
+        excluded = self._deleted_positions() if self.deleted_count else None
+        if time_ranges:
+            candidate_ids = self.ids_in_time_ranges(time_ranges)
+            if excluded is not None:
+                candidate_ids = np.setdiff1d(candidate_ids, excluded, assume_unique=True)
+                excluded = None
+            if len(candidate_ids) == 0:
+                return None
+        elif excluded is not None and not supports_selector(self.index):
+            # セレクター非対応の場合は削除済みを除いた位置を候補として、候補のコードだけを復号して検索する
+            # （削除済みの件数分だけ多めに取る方式では、削除が増えるほど検索件数が膨らむ）
+            candidate_ids = self._live_positions()
+            excluded = None
+        available = len(self) if candidate_ids is None else len(candidate_ids)
+        if available == 0:
+            return None
+        actual_k = min(k, available)
+
+        # 圧縮インデックスでは多めに候補を取り、生ベクトルとの正確な距離で並べ替える
+        rerank = self.is_compressed and self.rerank_factor > 0 and self.raw_vectors is not None
+        search_k = min(k * self.rerank_factor, available) if rerank else actual_k
+
+        if candidate_ids is not None and not supports_selector(self.index):
+            D, I = search_subset(self.index, vectors, candidate_ids, search_k)
+        else:
+            params = None
+            if candidate_ids is not None:
+                selector = faiss.IDSelectorBatch(candidate_ids)  # 検索完了まで参照を保持
+                params = faiss.SearchParameters(sel=selector)
+            elif excluded is not None:
+                deleted = faiss.IDSelectorBatch(excluded)
+                selector = faiss.IDSelectorNot(deleted)
+                params = faiss.SearchParameters(sel=selector)
+            D, I = self.index.search(vectors, k=search_k, params=params)
+
+        if rerank:
+            with metrics.span("rerank"):
+                D, I = rerank_exact(self.raw_vectors, vectors, D, I, actual_k)
+        return D, I
+
+    @property
+    def diversifies(self):
+        return self.mmr_lambda is not None or self.dedup_distance is not None
+
+    def _candidate_k(self, k):
+        """多様化する場合は多めに候補を取る"""
+        return k * max(1, settings.RAG_MMR_CANDIDATES) if self.diversifies else k
+
+    def _diversify(self, vectors, D, I, k):
+        """候補から近似重複を除き、MMRでk件を選ぶ（(D, I, 吸収した重複件数) を返す）"""
+        out_d = np.full((len(vectors), k), np.inf, dtype=np.float32)
+        out_i = np.full((len(vectors), k), -1, dtype=np.int64)
+        out_dup = np.zeros((len(vectors), k), dtype=np.int64)
+        for row, query in enumerate(vectors):
+            valid = (I[row] >= 0) & (I[row] < len(self.texts))
+            ids, distances = I[row][valid], D[row][valid]
+            duplicates = np.zeros(len(ids), dtype=np.int64)
+            if self.dedup_distance is not None:
+                kept, counts = suppress_near_duplicates([self.texts[idx] for idx in ids], self.dedup_distance)
+                metrics.increment("rag.duplicates_suppressed", len(ids) - len(kept))
+                ids, distances, duplicates = ids[kept], distances[kept], np.array(counts, dtype=np.int64)
+            if self.mmr_lambda is not None and len(ids) > k:
+                order = mmr_select(query, reconstruct_vectors(self.index, ids, self.raw_vectors), k, self.mmr_lambda)
+            else:
+                order = list(range(min(k, len(ids))))
+            out_d[row, : len(order)] = distances[order]
+            out_i[row, : len(order)] = ids[order]
+            out_dup[row, : len(order)] = duplicates[order]
+        return out_d, out_i, out_dup
+
+    def _search_results(self, vectors, k, time_ranges=None):
+        """検索（必要なら多様化）して結果の行列を返す（(D, I, 重複件数またはNone)、対象がなければNone）"""
+        searched = self._search(vectors, self._candidate_k(k), time_ranges)
+        if searched is None:
+            return None
+        D, I = searched
+        if not self.diversifies:
+            return D, I, None
+        with metrics.span("diversify"):
+            return self._diversify(vectors, D, I, k)
+
+    def _format_results(self, distances, ids, duplicates=None):
+        """検索結果の1行分をテキスト・距離・メタデータの辞書リストに変換"""
         results = []
-        for i, idx in enumerate(I[0]):
+        for position, (distance, idx) in enumerate(zip(distances, ids)):
             if idx != -1 and idx < len(self.texts):
-                results.append(
-                    {
-                        "text": self.texts[idx][:200] + "..." if len(self.texts[idx]) > 200 else self.texts[idx],
-                        "distance": D[0][i],
-                        "index": idx,
-                    }
-                )
+                text = self.texts[idx]  # アリーナ型ストアではアクセスごとにデコードされるため1回だけ取り出す
+                result = {
+                    "text": text[:200] + "..." if len(text) > 200 else text,
+                    "distance": distance,
+                    "index": idx,
+                    "id": self.ids[idx],
+                    "metadata": self.metadata[idx] if idx < len(self.metadata) else {},
+                }
+                if duplicates is not None and duplicates[position]:
+                    result["duplicates"] = int(duplicates[position])
+                results.append(result)
         return results
 
-    def add_log_file(self, file_path):
-        """ログファイル専用の追加メソッド"""
-        try:
-            with open(file_path, "r", encoding="utf-8") as file:
-                content = file.read()
+    @staticmethod
+    def _copy_results(results):
+        """呼び出し側が変更してもキャッシュや保持中のメタデータに影響しないよう、メタデータごと複製して返す"""
+        return [dict(result, metadata=copy.deepcopy(result["metadata"])) for result in results]
+
+    def _cached_results(self, cache_key):
+        cached = self._query_cache.get(cache_key)
+        if cached is not None and cached[0] == self.generation:
+            metrics.increment("rag.query_cache.hit")
+            return self._copy_results(cached[1])
+        metrics.increment("rag.query_cache.miss")
+        return None
+
+    def query(self, text, k=5, time_ranges=None):
+        # Check if there are any texts in the index
+        if len(self) == 0:
+            return []
 
+        # 同じ世代のインデックスに対する同一クエリはキャッシュから返す
+        cache_key = (text, k, _time_ranges_key(time_ranges))
+        cached = self._cached_results(cache_key)
+        if cached is not None:
+            return cached
+
+        vector = self._query_vector(text)  # 埋め込みはロックの外で行う
+        with self._lock.read():
+            generation = self.generation
+            try:
+                with metrics.span("faiss_search"):
+                    searched = self._search_results(vector, k, time_ranges)
+            except Exception as e:
+                print(f"Search error: {e}")
+                return []
+            if searched is None:
+                return []
+            D, I, duplicates = searched
+
+            # Return actual text content and distances
+            results = self._format_results(D[0], I[0], None if duplicates is None else duplicates[0])
+        self._query_cache.put(cache_key, (generation, results))
+        return self._copy_results(results)
+
+    def query_many(self, texts, k=5, time_ranges=None):
+        """複数クエリを1つの行列にまとめて1回のindex.searchで検索（結果はクエリごとにqueryと同じ形式）"""
+        results = [[] for _ in texts]
+        if len(self) == 0 or not texts:
+            return results
+
+        ranges_key = _time_ranges_key(time_ranges)
+        pending = []  # キャッシュになかったクエリの位置
+        for position, text in enumerate(texts):
+            cached = self._cached_results((text, k, ranges_key))
+            if cached is not None:
+                results[position] = cached
+            else:
+                pending.append(position)
+        if not pending:
+            return results
+
+        # 同じクエリ文字列は1回だけ検索する
+        unique_texts = list(dict.fromkeys(texts[position] for position in pending))
+        vectors = self._query_vectors(unique_texts)
+        with self._lock.read():
+            generation = self.generation
+            try:
+                with metrics.span("faiss_search_batch"):
+                    searched = self._search_results(vectors, k, time_ranges)
+            except Exception as e:
+                print(f"Search error: {e}")
+                return results
+            if searched is None:
+                return results
+            D, I, duplicates = searched
+            rows = {
+                text: self._format_results(D[row], I[row], None if duplicates is None else duplicates[row])
+                for row, text in enumerate(unique_texts)
+            }
+        metrics.increment("rag.batch_queries", len(unique_texts))
+
+        for text, text_results in rows.items():
+            self._query_cache.put((text, k, ranges_key), (generation, text_results))
+        for position in pending:
+            results[position] = self._copy_results(rows[texts[position]])
+        return results
+
+    def add_log_file(self, file_path, encoding="auto"):
+        """ログファイル専用の追加メソッド（エンコーディング自動判定、行単位でデコード）"""
+        try:
             # ログファイルを行ごとに分割して追加
-            lines = content.split("\n")
-            for line in lines:
+            added = 0
+            for line in iter_decoded_lines(file_path, LogDecoder(encoding)):
                 if line.strip():  # 空行でない場合のみ追加
                     self.add_text(line.strip())
+                    added += 1
 
-            print(f"ログファイル '{file_path}' から {len([l for l in lines if l.strip()])} 行を追加しました。")
+            print(f"ログファイル '{file_path}' から {added} 行を追加しました。")
             return True
 
         except Exception as e:
@@ -119,8 +754,9 @@ class RAG:
         except Exception as e:
             print(f"Error accessing vector store: {e}")
 
-    def save_all(self, base_path="./rag_data"):
-        """インデックスとテキストを一括保存"""
+    def save_all(self, base_path=None):
+        """インデックスとテキストを一括保存（base_path省略時は settings.RAG_DATA_DIR）"""
+        base_path = base_path or settings.RAG_DATA_DIR
         try:
             import time
             now = time.strftime("%Y%m%d_%H%M%S")
@@ -156,7 +792,10 @@ class RAG:
         if not file_exists(file_path):
             print(f"File {file_path} does not exist")
             return
-        self.index = faiss.read_index(file_path)
+        index = faiss.read_index(file_path)
+        with self._lock.write():
+            self.index = index
+            self.generation += 1
         print(f"Index loaded from {file_path}")
 
     def save_texts(self, file_path):
@@ -172,6 +811,229 @@ class RAG:
             return False
 
 
+    def save_to_directory(self, dir_path):
+        """インデックスとテキスト・メタデータをディレクトリに保存（index.faiss, texts.jsonl）"""
+        try:
+            mkdir_p(dir_path)
+            with self._lock.read():
+                faiss.write_index(self.index, os.path.join(dir_path, "index.faiss"))
+                write_records(os.path.join(dir_path, "texts.jsonl"), self.texts, self.metadata)
+                self._save_ids(dir_path, 0, self._deleted_ids())
+            return True
+        except Exception as e:
+            print(f"保存エラー: {e}")
+            return False
+
+    def _deleted_ids(self):
+        return np.frombuffer(self.ids, dtype=np.int64)[self._deleted_positions()] if len(self.ids) else []
+
+    def _save_ids(self, dir_path, start, removed):
+        """位置start以降の安定IDと、削除したIDを保存（ids.npy, removed.npy）"""
+        ids = np.frombuffer(self.ids, dtype=np.int64)[start:] if len(self.ids) else np.zeros(0, np.int64)
+        np.save(os.path.join(dir_path, "ids.npy"), ids)
+        np.save(os.path.join(dir_path, "removed.npy"), np.asarray(removed, dtype=np.int64))
+
+    def _load_ids(self, dir_path, start):
+        """位置start以降に読み込んだレコードへ保存済みのIDと削除を反映（IDのない旧形式は連番のまま）"""
+        ids_path = os.path.join(dir_path, "ids.npy")
+        if file_exists(ids_path):
+            ids = np.load(ids_path).astype(np.int64)
+            if len(ids) != len(self.ids) - start:
+                raise ValueError(f"IDの件数がテキストと一致しません: {ids_path}")
+            if len(ids):
+                self.ids[start:] = array("q", ids.tobytes())
+                self.next_id = max(self.next_id, int(ids.max()) + 1)
+        removed_path = os.path.join(dir_path, "removed.npy")
+        if file_exists(removed_path):
+            self._remove_positions(self.positions_of(np.load(removed_path)))
+
+    def load_directory(self, dir_path):
+        """save_to_directoryで保存したデータを読み込み"""
+        index_path = os.path.join(dir_path, "index.faiss")
+        texts_path = os.path.join(dir_path, "texts.jsonl")
+        if not file_exists(index_path) or not file_exists(texts_path):
+            print(f"Directory {dir_path} does not contain saved RAG data")
+            return False
+
+        with self._lock.write():
+            self._load_directory(dir_path, index_path, texts_path)
+        return True
+
+    def _load_directory(self, dir_path, index_path, texts_path):
+        self.index = faiss.read_index(index_path)
+        self.vector_dim = self.index.d
+        self._query_cache.clear()
+        if hasattr(self.texts, "close"):
+            self.texts.close()
+        self.texts = create_text_store(self.text_store_type)
+        self.metadata = []
+        self.timestamps = array("q")
+        self.ids = array("q")
+        self.next_id = 0
+        self._deleted = bytearray()
+        self.deleted_count = 0
+        for text, metadata in read_records(texts_path):
+            self._append_record(text, metadata)
+        self._load_ids(dir_path, 0)
+        self._removed_since_snapshot = []
+
+    def save_snapshot(self, base_path=None, compact_every=10, overwrite=False):
+        """前回のスナップショット以降に追加された分だけを差分として追記保存（base_path省略時は settings.RAG_SNAPSHOT_PATH）
+
+        base_path/manifest.json がベースと差分ディレクトリの一覧を持ち、各ディレクトリは
+        一時名で書き終えてからrenameし、最後にマニフェストを原子的に置き換えてコミットする。
+        差分がcompact_every個たまったら全体を新しいベースとして書き直し（コンパクション）、古いものを削除する。
+        書き出しは書き込みだけを止めて（stable）行うため、保存中も検索できる（追加・削除は保存の完了を待つ）。
+        overwrite: 保存先にこのインスタンスから保存したものではないスナップショットがある場合に、
+            それを置き換える（Falseでは保存せずにFalseを返す）
+        """
+        base_path = base_path or settings.RAG_SNAPSHOT_PATH
+        with self._save_lock, self._lock.stable():
+            return self._save_snapshot(base_path, compact_every, overwrite)
+
+    def _save_snapshot(self, base_path, compact_every, overwrite=False):
+        try:
+            mkdir_p(base_path)
+            manifest_path = os.path.join(base_path, "manifest.json")
+            manifest = None
+            sequence = 1
+            if file_exists(manifest_path):
+                with open(manifest_path, "r", encoding="utf-8") as file:
+                    manifest = json.load(file)
+                # ベースから作り直す場合も既存ディレクトリと名前が衝突しないよう連番は引き継ぐ
+                sequence = manifest.get("next_sequence", 1)
+                if manifest.get("count") != self._snapshot_count:
+                    # コンパクションで位置が変わった場合（件数は-1）だけは自分のスナップショットなのでベースから作り直す
+                    if self._snapshot_count != -1 and not overwrite:
+                        print(
+                            f"保存先のスナップショット（{manifest.get('count')}件）はこのインデックスから保存したものではありません。"
+                            f"load_latestで読み込んでから追加するか、overwrite=Trueで置き換えてください: {base_path}"
+                        )
+                        return False
+                    manifest = None
+                # 学習・圧縮方式の変更でコード形式が変わった場合も差分は追記できない
+                elif manifest.get("index_signature", index_signature(self.index)) != index_signature(self.index):
+                    manifest = None
+
+            new_count = len(self.texts) - self._snapshot_count
+            if manifest is not None and new_count == 0 and not self._removed_since_snapshot:
+                print("新しく保存するデータがありません")
+                return True
+
+            compact = manifest is None or len(manifest["deltas"]) >= compact_every
+
+            if compact:
+                name = f"base-{sequence:06d}"
+                tmp_path = os.path.join(base_path, f".tmp-{name}")
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                mkdir_p(tmp_path)
+                faiss.write_index(self.index, os.path.join(tmp_path, "index.faiss"))
+                write_records(os.path.join(tmp_path, "texts.jsonl"), self.texts, self.metadata)
+                self._save_ids(tmp_path, 0, self._deleted_ids())
+                os.rename(tmp_path, os.path.join(base_path, name))
+                new_manifest = {
+                    "vector_dim": self.vector_dim,
+                    "embedder": self.embedder_name,
+                    "index_type": self.index_type,
+                    "index_signature": index_signature(self.index),
+                    "base": name,
+                    "deltas": [],
+                }
+            else:
+                name = f"delta-{sequence:06d}"
+                tmp_path = os.path.join(base_path, f".tmp-{name}")
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                mkdir_p(tmp_path)
+                # 量子化インデックスでもreconstructによる劣化がないよう、格納コードをそのまま保存
+                np.save(os.path.join(tmp_path, "codes.npy"), index_codes(self.index, self._snapshot_count, new_count))
+                write_records(
+                    os.path.join(tmp_path, "texts.jsonl"),
+                    self.texts[self._snapshot_count :],
+                    self.metadata[self._snapshot_count :],
+                )
+                self._save_ids(tmp_path, self._snapshot_count, self._removed_since_snapshot)
+                os.rename(tmp_path, os.path.join(base_path, name))
+                new_manifest = dict(manifest, deltas=manifest["deltas"] + [name])
+
+            new_manifest["count"] = len(self.texts)
+            new_manifest["next_id"] = self.next_id
+            new_manifest["next_sequence"] = sequence + 1
+            new_manifest["updated_at"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+            write_json_atomic(manifest_path, new_manifest)
+            self._snapshot_count = len(self.texts)
+            self._removed_since_snapshot = []
+
+            # コミット後、マニフェストから参照されないベース・差分ディレクトリを削除
+            referenced = {new_manifest["base"], *new_manifest["deltas"]}
+            for entry in os.listdir(base_path):
+                entry_path = os.path.join(base_path, entry)
+                if (
+                    os.path.isdir(entry_path)
+                    and entry.startswith(("base-", "delta-", ".tmp-"))
+                    and entry not in referenced
+                ):
+                    shutil.rmtree(entry_path, ignore_errors=True)
+
+            kind = "ベース" if compact else "差分"
+            print(f"スナップショットを保存しました（{kind}: {name}, {new_count if not compact else len(self.texts)}件）")
+            return True
+
+        except Exception as e:
+            print(f"スナップショット保存エラー: {e}")
+            return False
+
+    @classmethod
+    def load_latest(cls, base_path=None, embedder=None, raw_vector_path=None):
+        """マニフェストからベースと差分を再生して最新状態を復元（スナップショットがなければNone）
+
+        base_path: 省略時は settings.RAG_SNAPSHOT_PATH
+        raw_vector_path: 再ランキング用の生ベクトルファイル（件数が一致する場合のみ使用）
+        """
+        base_path = base_path or settings.RAG_SNAPSHOT_PATH
+        manifest_path = os.path.join(base_path, "manifest.json")
+        if not file_exists(manifest_path):
+            print(f"スナップショットが見つかりません: {base_path}")
+            return None
+
+        with open(manifest_path, "r", encoding="utf-8") as file:
+            manifest = json.load(file)
+
+        rag = cls(manifest["vector_dim"], embedder=embedder, index_type=manifest.get("index_type"))
+        saved_embedder = manifest.get("embedder", f"hash-{manifest['vector_dim']}")
+        if saved_embedder != rag.embedder_name or rag.vector_dim != manifest["vector_dim"]:
+            print(f"スナップショットの埋め込み方式 ({saved_embedder}) が現在の設定 ({rag.embedder_name}) と異なります。再インデックスしてください")
+            return None
+        if not rag.load_directory(os.path.join(base_path, manifest["base"])):
+            return None
+        for name in manifest["deltas"]:
+            delta_path = os.path.join(base_path, name)
+            codes_path = os.path.join(delta_path, "codes.npy")
+            if file_exists(codes_path):
+                codes = np.load(codes_path)
+                if len(codes):
+                    rag.index.add_sa_codes(np.ascontiguousarray(codes))
+            else:
+                vectors = np.load(os.path.join(delta_path, "vectors.npy"))
+                if len(vectors):
+                    rag.index.add(np.ascontiguousarray(vectors, dtype=np.float32))
+            start = len(rag.texts)
+            for text, metadata in read_records(os.path.join(delta_path, "texts.jsonl")):
+                rag._append_record(text, metadata)
+            rag._load_ids(delta_path, start)
+
+        rag.next_id = max(rag.next_id, manifest.get("next_id", 0))
+        rag._removed_since_snapshot = []
+        rag._snapshot_count = len(rag.texts)
+        if raw_vector_path and os.path.isfile(raw_vector_path):
+            raw_vectors = RawVectorStore(raw_vector_path, rag.vector_dim, truncate=False)
+            if len(raw_vectors) == len(rag.texts):
+                rag.raw_vectors = raw_vectors
+            else:
+                raw_vectors.close()
+                print(f"生ベクトルの件数がスナップショットと一致しないため再ランキングを無効にします: {raw_vector_path}")
+        print(f"スナップショットを読み込みました: {base_path}（{len(rag)}件、差分{len(manifest['deltas'])}個）")
+        return rag
+
 if __name__ == "__main__":
     rag = RAG()
     # rag.load_index("path/to/index/file")
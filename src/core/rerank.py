@@ -0,0 +1,81 @@
+import hashlib
+import re
+import numpy as np
+
+
+_TOKEN_PATTERN = re.compile(r"\w+")
+_NUMBER_PATTERN = re.compile(r"\d+")
+_BITS = np.arange(64, dtype=np.uint64)
+
+
+def simhash(text):
+    """テキストの64bit SimHash（数字は同一視するため、タイムスタンプやIDだけが違う行は近い値になる）"""
+    tokens = _TOKEN_PATTERN.findall(_NUMBER_PATTERN.sub("0", text.lower()))
+    if not tokens:
+        return 0
+    # 単語と連続2単語を特徴量にする（語順の違いもある程度反映）
+    features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little") for feature in features],
+        dtype=np.uint64,
+    )
+    bits = ((hashes[:, None] >> _BITS) & np.uint64(1)).astype(np.int32)
+    votes = (2 * bits - 1).sum(axis=0)
+    return int(sum(1 << int(bit) for bit in np.nonzero(votes > 0)[0]))
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def suppress_near_duplicates(texts, max_distance=3):
+    """関連度順のテキスト列から、先に残したものとSimHashが近いものを除外
+
+    (残す位置のリスト, 残した各位置に吸収された重複件数のリスト) を返す。
+    """
+    kept = []
+    fingerprints = []
+    duplicates = []
+    for position, text in enumerate(texts):
+        fingerprint = simhash(text)
+        for slot, other in enumerate(fingerprints):
+            if hamming_distance(fingerprint, other) <= max_distance:
+                duplicates[slot] += 1
+                break
+        else:
+            kept.append(position)
+            fingerprints.append(fingerprint)
+            duplicates.append(0)
+    return kept, duplicates
+
+
+def mmr_select(query_vector, vectors, k, lambda_=0.5):
+    """最大周辺関連性（MMR）で候補からk件を選び、選んだ順の位置を返す
+
+    score = lambda_ * クエリとの類似度 - (1 - lambda_) * 選択済みとの最大類似度（コサイン類似度）
+    """
+    count = len(vectors)
+    if count == 0:
+        return []
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    normalized = vectors / np.maximum(norms, 1e-12)
+    query = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+    relevance = normalized @ query
+
+    selected = []
+    max_similarity = np.full(count, -np.inf, dtype=np.float32)
+    available = np.ones(count, dtype=bool)
+    for _ in range(min(k, count)):
+        if selected:
+            scores = lambda_ * relevance - (1 - lambda_) * max_similarity
+        else:
+            scores = relevance.copy()
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        # 選択済みとの最大類似度を差分更新
+        np.maximum(max_similarity, normalized @ normalized[best], out=max_similarity)
+    return selected
@@ -0,0 +1,366 @@
+import calendar
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .rag import RAG, mkdir_p, text_to_vector
+from .rerank import suppress_near_duplicates
+from ..utils.metrics import metrics
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+from config import settings
+
+
+UNDATED_SHARD = "undated"
+UNPARTITIONED_SHARD = "all"  # 時間で分割していない部分インデックス（検索時は常に対象にし、期間はシャード内で絞る）
+NODE_SEPARATOR = "@"  # 登録した他ノードのシャードのキー（例: "20240115@node1"）
+PARTITION_FORMATS = {
+    "daily": ("%Y%m%d", 86400),
+    "hourly": ("%Y%m%d%H", 3600),
+}
+
+
+def is_unpartitioned(key):
+    """時間で分割していない（期間で選べない）シャードか"""
+    return key.split(NODE_SEPARATOR, 1)[0] == UNPARTITIONED_SHARD
+
+
+class ShardedRAG:
+    """時間で分割したシャード（シャードごとに独立したFaissインデックスとテキスト）を束ねるRAG
+
+    検索は対象期間に重なるシャードだけにスレッドプールで並列に投げ、上位k件をマージする。
+    保持期間の管理は古いシャードディレクトリを削除するだけで済む。
+    シャードの対応表の更新は短いロック下で行い、検索はその時点の対応表のコピーを使う
+    （各シャード内の排他はRAG自身の読み書きロックで行う）。
+    他ノードで作った部分インデックスは「期間キー@ノード名」のキーで登録でき、同じ期間のシャードとして検索される。
+    """
+
+    def __init__(
+        self,
+        base_path=None,
+        vector_dim=512,
+        partition="daily",
+        max_workers=4,
+        compact_every=10,
+        embedder=None,
+        keep_raw_vectors=False,
+        index_template=None,
+    ):
+        """シャードの保存先（省略時は settings.RAG_SHARD_PATH）・分割単位・並列検索数・スナップショットのコンパクション間隔・埋め込みクラスを設定
+
+        keep_raw_vectors: シャードディレクトリに再ランキング用の生ベクトル（vectors.f32）を保存する
+        index_template: 新しいシャードに使う学習済みの空インデックス（RAGのindex_templateを参照）
+        """
+        if partition not in PARTITION_FORMATS:
+            raise ValueError(f"未対応のシャード分割単位です: {partition}")
+        self.base_path = base_path or settings.RAG_SHARD_PATH
+        self.embedder = embedder
+        self.vector_dim = embedder.dim if embedder is not None else vector_dim
+        self.partition = partition
+        self.max_workers = max_workers
+        self.compact_every = compact_every
+        self.keep_raw_vectors = keep_raw_vectors
+        self.index_template = index_template
+        self.shards = {}  # シャードキー -> RAG
+        self._shards_lock = threading.Lock()  # シャードの追加・削除と対応表のコピーの排他
+        self._dirty = set()  # 前回保存以降に更新されたシャード
+        self._executor = ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._snapshot().values())
+
+    def _snapshot(self):
+        """シャードの対応表のコピー（取り込みと並行して走査できるよう、反復はコピーに対して行う）"""
+        with self._shards_lock:
+            return dict(self.shards)
+
+    def shard_key(self, timestamp):
+        """タイムスタンプ（UNIX秒）からシャードキーを決定"""
+        if timestamp is None:
+            return UNDATED_SHARD
+        key_format, _ = PARTITION_FORMATS[self.partition]
+        return time.strftime(key_format, time.gmtime(timestamp))
+
+    def shard_range(self, key):
+        """シャードがカバーする期間 [開始, 終了) を返す（日付なし・時間で分割していないシャードはNone）"""
+        key = key.split(NODE_SEPARATOR, 1)[0]
+        if key in (UNDATED_SHARD, UNPARTITIONED_SHARD):
+            return None
+        key_format, span = PARTITION_FORMATS[self.partition]
+        start = calendar.timegm(time.strptime(key, key_format))
+        return start, start + span
+
+    def _get_shard(self, key):
+        """追加先のシャードを返す（読み込んでいない保存済みシャードは読み込んでから追記する）"""
+        shard = self.shards.get(key)
+        if shard is None:
+            # 保存済みのシャードを空のRAGで置き換えると、次の保存で既存のデータを上書きしてしまう
+            path = self.shard_path(key)
+            saved = None
+            if self._is_saved(path):
+                saved = self._load_shard(path)
+                if saved is None:
+                    raise RuntimeError(f"保存済みのシャードを読み込めないため追加できません: {path}")
+            with self._shards_lock:
+                shard = self.shards.get(key)
+                if shard is None and saved is not None:
+                    shard = self.shards[key] = saved
+                elif shard is None:
+                    shard = self.shards[key] = RAG(
+                        self.vector_dim,
+                        embedder=self.embedder,
+                        raw_vector_path=self._raw_vector_path(path),
+                        index_template=self.index_template,
+                    )
+        return shard
+
+    def add_text(self, text, metadata=None):
+        key = self.shard_key((metadata or {}).get("timestamp"))
+        self._get_shard(key).add_text(text, metadata)
+        self._dirty.add(key)
+
+    def _group_by_shard(self, metadata_list):
+        groups = {}
+        for position, metadata in enumerate(metadata_list):
+            groups.setdefault(self.shard_key((metadata or {}).get("timestamp")), []).append(position)
+        return groups
+
+    def add_texts(self, texts, metadata_list=None, refs=None):
+        """シャードごとにまとめてバッチ追加"""
+        metadata_list = metadata_list or [None] * len(texts)
+        for key, positions in self._group_by_shard(metadata_list).items():
+            self._get_shard(key).add_texts(
+                [texts[i] for i in positions],
+                [metadata_list[i] for i in positions],
+                None if refs is None else [refs[i] for i in positions],
+            )
+            self._dirty.add(key)
+
+    def embed(self, texts):
+        """テキストのリストを (件数, 次元) のfloat32行列に変換"""
+        if self.embedder is not None:
+            return self.embedder.embed(texts)
+        return np.array([text_to_vector(text, self.vector_dim) for text in texts], dtype=np.float32)
+
+    def add_embedded(self, texts, vectors, metadata_list=None, refs=None):
+        """埋め込み済みのベクトルをシャードごとに振り分けて追加"""
+        metadata_list = metadata_list or [None] * len(texts)
+        for key, positions in self._group_by_shard(metadata_list).items():
+            self._get_shard(key).add_embedded(
+                [texts[i] for i in positions],
+                vectors[positions],
+                [metadata_list[i] for i in positions],
+                None if refs is None else [refs[i] for i in positions],
+            )
+            self._dirty.add(key)
+
+    def select_shards(self, time_ranges=None, shards=None):
+        """検索対象の時間範囲に重なるシャードキーを返す（shards: 対応表のコピー）"""
+        shards = self._snapshot() if shards is None else shards
+        if not time_ranges:
+            return sorted(shards)
+        selected = []
+        for key in sorted(shards):
+            if is_unpartitioned(key):
+                selected.append(key)
+                continue
+            shard_range = self.shard_range(key)
+            if shard_range is None:
+                continue
+            shard_start, shard_end = shard_range
+            if any(start < shard_end and end > shard_start for start, end in time_ranges):
+                selected.append(key)
+        return selected
+
+    def query(self, text, k=5, time_ranges=None):
+        """対象シャードへ並列に検索し、距離順に上位k件をマージ"""
+        shards = self._snapshot()
+        keys = [key for key in self.select_shards(time_ranges, shards) if len(shards[key])]
+        if not keys:
+            return []
+
+        def search(key):
+            results = shards[key].query(text, k=k, time_ranges=time_ranges)
+            for result in results:
+                result["shard"] = key
+            return results
+
+        with metrics.span("shard_fanout"):
+            if self._executor is not None and len(keys) > 1:
+                shard_results = list(self._executor.map(search, keys))
+            else:
+                shard_results = [search(key) for key in keys]
+
+        return self._merge([result for results in shard_results for result in results], k)
+
+    def query_many(self, texts, k=5, time_ranges=None):
+        """複数クエリをシャードごとに1回のバッチ検索で処理し、クエリごとに上位k件をマージ"""
+        shards = self._snapshot()
+        keys = [key for key in self.select_shards(time_ranges, shards) if len(shards[key])]
+        if not keys or not texts:
+            return [[] for _ in texts]
+
+        def search(key):
+            shard_results = shards[key].query_many(texts, k=k, time_ranges=time_ranges)
+            for results in shard_results:
+                for result in results:
+                    result["shard"] = key
+            return shard_results
+
+        with metrics.span("shard_fanout"):
+            if self._executor is not None and len(keys) > 1:
+                per_shard = list(self._executor.map(search, keys))
+            else:
+                per_shard = [search(key) for key in keys]
+
+        return [
+            self._merge([result for shard_results in per_shard for result in shard_results[position]], k)
+            for position in range(len(texts))
+        ]
+
+    def _merge(self, results, k):
+        """シャードごとの結果を距離順にマージ（重複除去が有効ならシャードをまたぐ近似重複も除く）"""
+        results.sort(key=lambda result: result["distance"])
+        if settings.RAG_DEDUP_HAMMING is not None:
+            kept, counts = suppress_near_duplicates([result["text"] for result in results], settings.RAG_DEDUP_HAMMING)
+            for position, count in zip(kept, counts):
+                if count:
+                    results[position]["duplicates"] = results[position].get("duplicates", 0) + count
+            results = [results[position] for position in kept]
+        return results[:k]
+
+    def search_by_keyword(self, keyword, k=10):
+        """キーワードでログエントリを検索"""
+        return self.query(keyword, k=k)
+
+    def shard_path(self, key, base_path=None):
+        return os.path.join(base_path or self.base_path, key)
+
+    def save(self, base_path=None, only_dirty=True):
+        """シャードごとに独立したディレクトリへ差分スナップショットとして保存（既定では更新のあったシャードのみ）"""
+        base_path = base_path or self.base_path
+        mkdir_p(base_path)
+        saved = 0
+        for key, shard in self._snapshot().items():
+            if only_dirty and key not in self._dirty and not shard.has_unsaved_changes and base_path == self.base_path:
+                continue
+            if base_path == self.base_path:
+                success = shard.save_snapshot(self.shard_path(key, base_path), self.compact_every)
+            else:
+                success = shard.save_to_directory(self.shard_path(key, base_path))
+            if success:
+                saved += 1
+                self._dirty.discard(key)
+        print(f"{saved}個のシャードを保存しました: {base_path}")
+        return True
+
+    def save_all(self, base_path=None):
+        """インデックスとテキストを一括保存（RAG.save_allとの互換用）"""
+        return self.save(base_path, only_dirty=False)
+
+    def list_saved_shards(self, base_path=None):
+        """保存済みシャードのキー一覧"""
+        base_path = base_path or self.base_path
+        if not os.path.isdir(base_path):
+            return []
+        return sorted(name for name in os.listdir(base_path) if self._is_saved(os.path.join(base_path, name)))
+
+    @staticmethod
+    def _is_saved(path):
+        """シャードディレクトリに保存済みのデータ（スナップショットまたは旧形式のインデックス）があるか"""
+        return os.path.isfile(os.path.join(path, "manifest.json")) or os.path.isfile(os.path.join(path, "index.faiss"))
+
+    def _raw_vector_path(self, path):
+        return os.path.join(path, "vectors.f32") if self.keep_raw_vectors else None
+
+    def _load_shard(self, path):
+        if os.path.isfile(os.path.join(path, "manifest.json")):
+            return RAG.load_latest(path, embedder=self.embedder, raw_vector_path=self._raw_vector_path(path))
+        shard = RAG(self.vector_dim, embedder=self.embedder)
+        return shard if shard.load_directory(path) else None
+
+    def load(self, base_path=None, time_ranges=None):
+        """保存済みシャードを読み込み（time_rangesを指定すると該当期間のみ読み込んでメモリを抑える）"""
+        base_path = base_path or self.base_path
+        loaded = 0
+        for key in self.list_saved_shards(base_path):
+            shard_range = self.shard_range(key)
+            if time_ranges and not is_unpartitioned(key) and (
+                shard_range is None
+                or not any(start < shard_range[1] and end > shard_range[0] for start, end in time_ranges)
+            ):
+                continue
+            shard = self._load_shard(self.shard_path(key, base_path))
+            if shard is not None:
+                with self._shards_lock:
+                    self.shards[key] = shard
+                loaded += 1
+        print(f"{loaded}個のシャードを読み込みました: {base_path}")
+        return loaded
+
+    def unload(self, key):
+        """シャードをメモリから外す（未保存の変更は保存してから外す）"""
+        with self._shards_lock:
+            shard = self.shards.pop(key, None)
+        if shard is None:
+            self._dirty.discard(key)
+            return
+        if key in self._dirty:
+            shard.save_snapshot(self.shard_path(key), self.compact_every)
+            self._dirty.discard(key)
+
+    def _drop_shard(self, key):
+        """シャードをメモリとディスクから削除"""
+        with self._shards_lock:
+            self.shards.pop(key, None)
+        self._dirty.discard(key)
+        path = self.shard_path(key)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+
+    def apply_retention(self, retention_days, now=None):
+        """保持期間より古いシャードをメモリとディスクから削除"""
+        cutoff = (now if now is not None else time.time()) - retention_days * 86400
+        removed = []
+        for key in set(self._snapshot()) | set(self.list_saved_shards()):
+            shard_range = self.shard_range(key)
+            if shard_range is None or shard_range[1] > cutoff:
+                continue
+            self._drop_shard(key)
+            removed.append(key)
+        if removed:
+            print(f"保持期間切れのシャードを削除しました: {', '.join(sorted(removed))}")
+        return sorted(removed)
+
+    def remove_by_file(self, file_path):
+        """読み込み済みの全シャードから、指定したログファイル由来のチャンクを削除"""
+        removed = 0
+        for key, shard in self._snapshot().items():
+            count = shard.remove_by_file(file_path)
+            if count:
+                self._dirty.add(key)
+                removed += count
+        return removed
+
+    def remove_before(self, timestamp):
+        """指定時刻より前のチャンクを削除（期間全体が古いシャードはディレクトリごと削除）"""
+        removed = 0
+        shards = self._snapshot()
+        for key in set(shards) | set(self.list_saved_shards()):
+            shard_range = self.shard_range(key)
+            if shard_range is not None and shard_range[1] <= timestamp:
+                removed += len(shards[key]) if key in shards else 0
+                self._drop_shard(key)
+            elif key in shards:
+                count = shards[key].remove_before(timestamp)
+                if count:
+                    self._dirty.add(key)
+                    removed += count
+        return removed
+
+    def compaction_candidates(self):
+        """削除済みの割合がしきい値を超えたシャード"""
+        return [shard for shard in self._snapshot().values() if shard.needs_compaction()]
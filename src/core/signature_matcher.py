@@ -0,0 +1,109 @@
+from collections import deque
+
+
+class SignatureMatcher:
+    """Aho-Corasickオートマトンによる複数シグネチャの一括照合クラス"""
+
+    def __init__(self, signatures=None):
+        """シグネチャ集合からオートマトンを構築"""
+        # 各ノードは遷移表・失敗リンク・出力（マッチしたシグネチャ）を持つ
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        self.signatures = []
+        if signatures:
+            self.build(signatures)
+
+    def build(self, signatures):
+        """シグネチャ集合からオートマトンを構築（大文字小文字は区別しない）"""
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+
+        seen = set()
+        self.signatures = []
+        for signature in signatures:
+            signature = str(signature).strip().lower()
+            if signature and signature not in seen:
+                seen.add(signature)
+                self.signatures.append(signature)
+
+        # トライ木を構築
+        terminal = {}
+        for signature in self.signatures:
+            node = 0
+            for char in signature:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                node = next_node
+            terminal[node] = signature
+
+        for node, signature in terminal.items():
+            self._output[node] = (signature,)
+
+        # 幅優先で失敗リンクと出力を計算
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail_target = self._goto[fail].get(char, 0)
+                self._fail[child] = fail_target if fail_target != child else 0
+                if self._output[self._fail[child]]:
+                    self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+        return self
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def iter_matches(self, text):
+        """テキストを1回走査し、(終了位置, シグネチャ)を順に返す"""
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        node = 0
+        for position, char in enumerate(text.lower()):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if output[node]:
+                for signature in output[node]:
+                    yield position, signature
+
+    def find_all(self, text):
+        """テキスト中に現れるシグネチャの集合を返す"""
+        if not self.signatures or not text:
+            return set()
+        return {signature for _, signature in self.iter_matches(text)}
+
+    def count_all(self, text):
+        """テキスト中のシグネチャ出現回数を返す"""
+        counts = {}
+        if not self.signatures or not text:
+            return counts
+        for _, signature in self.iter_matches(text):
+            counts[signature] = counts.get(signature, 0) + 1
+        return counts
+
+
+def load_signature_file(file_path):
+    """シグネチャファイル（1行1シグネチャ、#はコメント）を読み込み"""
+    signatures = []
+    try:
+        with open(file_path, "r", encoding="utf-8") as file:
+            for line in file:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    signatures.append(line)
+    except Exception as e:
+        print(f"シグネチャファイル読み込みエラー: {e}")
+    return signatures
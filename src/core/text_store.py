@@ -0,0 +1,262 @@
+import os
+import threading
+from array import array
+from bisect import bisect_right
+from collections.abc import Sequence
+from ..utils.cache import LRUCache
+
+try:
+    import zstandard
+except ImportError:  # zstdは任意依存
+    zstandard = None
+
+
+TEXT_STORE_TYPES = ("list", "arena", "zstd", "file")
+
+
+class TextArena(Sequence):
+    """チャンクのUTF-8バイト列を1つの連続バッファに詰め、オフセット配列で参照するテキストストア
+
+    Pythonのstrを1件ずつ保持する場合のオブジェクトヘッダ（1件あたり約50バイト以上）がなくなり、
+    アクセス時にだけデコードする。list[str]と同じくインデックス・スライス・反復で読み出せる。
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._offsets = array("Q", [0])
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._get(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("テキストストアの範囲外です")
+        return self._get(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._get(i)
+
+    def _get(self, i):
+        return self._buffer[self._offsets[i] : self._offsets[i + 1]].decode("utf-8", errors="surrogatepass")
+
+    def _append_bytes(self, data):
+        self._buffer += data
+        self._offsets.append(self._offsets[-1] + len(data))
+
+    def append(self, text, ref=None):
+        """テキストを追加（refは参照型ストアとの互換用で、ここでは使用しない）"""
+        self._append_bytes(text.encode("utf-8", errors="surrogatepass"))
+
+    def extend(self, texts):
+        for text in texts:
+            self.append(text)
+
+    def _raw(self, i):
+        return bytes(self._buffer[self._offsets[i] : self._offsets[i + 1]])
+
+    def compacted(self, positions):
+        """指定した位置のテキストだけを詰め直した新しいストアを返す（削除済みチャンクのコンパクション用）"""
+        store = self._empty()
+        for i in positions:
+            store._append_bytes(self._raw(i))
+        return store
+
+    def _empty(self):
+        return type(self)()
+
+    @property
+    def nbytes(self):
+        """保持しているバッファとオフセット配列のバイト数"""
+        return len(self._buffer) + self._offsets.itemsize * len(self._offsets)
+
+    def close(self):
+        pass
+
+
+class CompressedTextArena(TextArena):
+    """一定サイズごとのブロックをzstdで圧縮して保持するテキストストア
+
+    追記中のブロックだけを非圧縮で持ち、block_bytesを超えたらチャンク境界で圧縮して確定する。
+    読み出し時は該当ブロックを展開し、直近に展開したブロックはLRUキャッシュで再利用する。
+    """
+
+    def __init__(self, block_bytes=64 * 1024, level=3, cache_blocks=16):
+        if zstandard is None:
+            raise RuntimeError("zstd圧縮テキストストアには zstandard パッケージが必要です")
+        super().__init__()
+        self.block_bytes = block_bytes
+        self.level = level
+        self.cache_blocks = cache_blocks
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._blocks = []  # 圧縮済みブロック
+        self._block_starts = array("Q")  # 各ブロック先頭の（非圧縮での）バイト位置
+        self._sealed_bytes = 0  # 圧縮済みブロックの合計バイト数（非圧縮）
+        self._cache = LRUCache(cache_blocks)
+        self._local = threading.local()  # 展開器はスレッドごとに持つ
+
+    def _decompress(self, block):
+        data = self._cache.get(block)
+        if data is None:
+            decompressor = getattr(self._local, "decompressor", None)
+            if decompressor is None:
+                decompressor = self._local.decompressor = zstandard.ZstdDecompressor()
+            data = decompressor.decompress(self._blocks[block])
+            self._cache.put(block, data)
+        return data
+
+    def _raw(self, i):
+        start, end = self._offsets[i], self._offsets[i + 1]
+        # 追記中のブロックの確定と並行して読めるよう、バッファを先に参照してから境界を確認する
+        buffer = self._buffer
+        sealed_bytes = self._sealed_bytes
+        if start >= sealed_bytes:
+            data, base = buffer, sealed_bytes
+        else:
+            block = bisect_right(self._block_starts, start) - 1
+            data, base = self._decompress(block), self._block_starts[block]
+        return bytes(data[start - base : end - base])
+
+    def _get(self, i):
+        return self._raw(i).decode("utf-8", errors="surrogatepass")
+
+    def _empty(self):
+        return type(self)(self.block_bytes, self.level, self.cache_blocks)
+
+    def _append_bytes(self, data):
+        super()._append_bytes(data)
+        if len(self._buffer) >= self.block_bytes:
+            self._seal()
+
+    def _seal(self):
+        """追記中のブロックを圧縮して確定"""
+        self._blocks.append(self._compressor.compress(bytes(self._buffer)))
+        self._block_starts.append(self._sealed_bytes)
+        self._sealed_bytes += len(self._buffer)
+        self._buffer = bytearray()
+
+    @property
+    def nbytes(self):
+        compressed = sum(len(block) for block in self._blocks)
+        return compressed + len(self._buffer) + self._offsets.itemsize * len(self._offsets)
+
+
+class FileTextStore(TextArena):
+    """元のログファイルへの参照（ファイル, バイトオフセット, 長さ）だけを保持するテキストストア
+
+    参照を持たないテキスト（圧縮ファイル由来・分割されたチャンク・スナップショットからの復元分）は
+    通常のアリーナに格納する。元ログが移動・削除されると該当チャンクは読み出せなくなる。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._files = []  # (パス, エンコーディング)
+        self._file_ids = {}
+        self._sources = array("i")  # 参照先ファイルID（-1はアリーナ格納）
+        self._starts = array("Q")  # ファイル内またはアリーナ内の開始位置
+        self._lengths = array("I")
+        self._fds = {}
+        self._fd_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._sources)
+
+    def _fd(self, file_id):
+        with self._fd_lock:
+            fd = self._fds.get(file_id)
+            if fd is None:
+                fd = self._fds[file_id] = os.open(self._files[file_id][0], os.O_RDONLY)
+            return fd
+
+    def _get(self, i):
+        file_id, start, length = self._sources[i], self._starts[i], self._lengths[i]
+        if file_id < 0:
+            return self._buffer[start : start + length].decode("utf-8", errors="surrogatepass")
+        path, encoding = self._files[file_id]
+        try:
+            raw = os.pread(self._fd(file_id), length, start)
+        except OSError as e:
+            return f"[参照先のログを読み込めません: {path} ({e})]"
+        return raw.decode(encoding, errors="replace")
+
+    def append(self, text, ref=None):
+        """テキストを追加（ref=(パス, オフセット, 長さ, エンコーディング) を渡すと参照だけを保持）"""
+        if ref is None:
+            data = text.encode("utf-8", errors="surrogatepass")
+            self._sources.append(-1)
+            self._starts.append(len(self._buffer))
+            self._lengths.append(len(data))
+            self._buffer += data
+            return
+        path, offset, length, encoding = ref
+        key = (os.path.abspath(path), encoding)
+        file_id = self._file_ids.get(key)
+        if file_id is None:
+            file_id = self._file_ids[key] = len(self._files)
+            self._files.append(key)
+        self._sources.append(file_id)
+        self._starts.append(offset)
+        self._lengths.append(length)
+
+    def compacted(self, positions):
+        """指定した位置のエントリだけを詰め直した新しいストアを返す（参照はそのまま引き継ぐ）"""
+        store = FileTextStore()
+        store._files = list(self._files)
+        store._file_ids = dict(self._file_ids)
+        for i in positions:
+            file_id, start, length = self._sources[i], self._starts[i], self._lengths[i]
+            if file_id < 0:
+                store._starts.append(len(store._buffer))
+                store._buffer += self._buffer[start : start + length]
+            else:
+                store._starts.append(start)
+            store._sources.append(file_id)
+            store._lengths.append(length)
+        return store
+
+    @property
+    def nbytes(self):
+        arrays = (self._sources, self._starts, self._lengths)
+        return len(self._buffer) + sum(values.itemsize * len(values) for values in arrays)
+
+    def close(self):
+        with self._fd_lock:
+            for fd in self._fds.values():
+                os.close(fd)
+            self._fds.clear()
+
+
+def make_file_ref(file_path, offset, raw, text, encoding):
+    """元ログのバイト列からそのまま復元できるチャンクであれば参照を返す（それ以外はNone）"""
+    if not encoding:
+        return None
+    try:
+        if raw.decode(encoding) != text:
+            return None
+    except (UnicodeDecodeError, LookupError):
+        return None
+    return (str(file_path), offset, len(raw), encoding)
+
+
+def compact_text_store(store, positions):
+    """テキストストア（またはlist）から指定した位置だけを残したものを返す"""
+    if isinstance(store, list):
+        return [store[i] for i in positions]
+    return store.compacted(positions)
+
+
+def create_text_store(store_type="arena"):
+    """種別を指定してテキストストアを生成（"list" は従来のlist[str]）"""
+    if store_type == "list":
+        return []
+    if store_type == "arena":
+        return TextArena()
+    if store_type == "zstd":
+        return CompressedTextArena()
+    if store_type == "file":
+        return FileTextStore()
+    raise ValueError(f"未対応のテキストストア種別です: {store_type}")
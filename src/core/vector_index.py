@@ -0,0 +1,190 @@
+import hashlib
+import os
+import faiss
+import numpy as np
+
+
+INDEX_TYPES = ("flat", "sq8", "sqfp16", "pq")
+
+
+def create_index(index_type, vector_dim, pq_m=64, pq_nbits=8):
+    """圧縮方式を指定してFaissインデックスを生成
+
+    flat: float32そのまま（1件あたり 4*次元 バイト）
+    sq8 / sqfp16: スカラー量子化（1次元あたり1 / 2バイト）
+    pq: 直積量子化（1件あたり pq_m * pq_nbits / 8 バイト）
+    """
+    if index_type == "flat":
+        return faiss.IndexFlatL2(vector_dim)
+    if index_type == "sq8":
+        return faiss.IndexScalarQuantizer(vector_dim, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+    if index_type == "sqfp16":
+        return faiss.IndexScalarQuantizer(vector_dim, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    if index_type == "pq":
+        if vector_dim % pq_m != 0:
+            raise ValueError(f"PQの分割数 {pq_m} はベクトル次元 {vector_dim} を割り切る必要があります")
+        return faiss.IndexPQ(vector_dim, pq_m, pq_nbits)
+    raise ValueError(f"未対応のインデックス種別です: {index_type}")
+
+
+def index_signature(index):
+    """インデックスのコード形式を表す文字列（差分スナップショットの互換性判定用）"""
+    return f"{type(index).__name__}:{index.d}:{index.code_size}"
+
+
+def quantizer_fingerprint(index):
+    """量子化の学習結果を表すハッシュ（flatはNone）"""
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        data = f"{index.sq.qtype}:".encode() + faiss.vector_to_array(index.sq.trained).tobytes()
+    elif isinstance(index, faiss.IndexPQ):
+        data = f"{index.pq.M}:{index.pq.nbits}:".encode() + faiss.vector_to_array(index.pq.centroids).tobytes()
+    else:
+        return None
+    return hashlib.sha1(data).hexdigest()
+
+
+def codes_compatible(index, other):
+    """otherの格納コードをそのままindexへ移せるか
+
+    Faissのmerge_fromはコード長しか確認しないため、学習結果の異なるインデックス同士でも黙って統合してしまう。
+    """
+    return index_signature(index) == index_signature(other) and quantizer_fingerprint(index) == quantizer_fingerprint(
+        other
+    )
+
+
+def empty_copy(index):
+    """学習済みの状態だけを引き継いだ空のインデックス（ノード間で量子化を揃えるテンプレート用）"""
+    copy = faiss.clone_index(index)
+    copy.reset()
+    return copy
+
+
+def bytes_per_vector(index):
+    return index.code_size
+
+
+def index_codes(index, start, count):
+    """start番目からcount件分の格納コードをコピーして返す（flatの場合はfloat32の生バイト列）
+
+    reconstructと違い量子化済みインデックスでも劣化なく差分保存・復元できる。
+    """
+    code_size = index.code_size
+    codes = faiss.rev_swig_ptr(index.codes.data(), index.ntotal * code_size)
+    return np.array(codes[start * code_size : (start + count) * code_size]).reshape(count, code_size)
+
+
+def compacted_index(index, positions, block_size=65536):
+    """学習済みの状態を保ったまま、指定した位置の格納コードだけを持つインデックスを作り直す"""
+    compacted = empty_copy(index)
+    code_size = index.code_size
+    codes = np.asarray(faiss.rev_swig_ptr(index.codes.data(), index.ntotal * code_size)).reshape(index.ntotal, code_size)
+    for start in range(0, len(positions), block_size):
+        compacted.add_sa_codes(np.ascontiguousarray(codes[positions[start : start + block_size]]))
+    return compacted
+
+
+def supports_selector(index):
+    """SearchParametersのIDセレクターに対応しているか（IndexPQは非対応）"""
+    return not isinstance(index, faiss.IndexPQ)
+
+
+def search_subset(index, vectors, candidate_ids, k, block_size=65536):
+    """候補IDのコードだけを復号して総当たり検索（セレクター非対応のインデックス用）"""
+    n = len(vectors)
+    k = min(k, len(candidate_ids))
+    best_d = np.full((n, 0), np.inf, dtype=np.float32)
+    best_i = np.full((n, 0), -1, dtype=np.int64)
+    code_size = index.code_size
+    codes = faiss.rev_swig_ptr(index.codes.data(), index.ntotal * code_size)
+    codes = np.asarray(codes).reshape(index.ntotal, code_size)
+    for start in range(0, len(candidate_ids), block_size):
+        ids = candidate_ids[start : start + block_size]
+        decoded = index.sa_decode(np.ascontiguousarray(codes[ids]))
+        D, I = faiss.knn(vectors, decoded, min(k, len(ids)))
+        best_d = np.hstack([best_d, D])
+        best_i = np.hstack([best_i, ids[I]])
+        order = np.argsort(best_d, axis=1)[:, :k]
+        best_d = np.take_along_axis(best_d, order, axis=1)
+        best_i = np.take_along_axis(best_i, order, axis=1)
+    return best_d, best_i
+
+
+def reconstruct_vectors(index, ids, raw_vectors=None):
+    """指定IDのベクトルを取得（生ベクトルがあればそれを、なければ格納コードを復号して返す）"""
+    ids = np.asarray(ids, dtype=np.int64)
+    if len(ids) == 0:
+        return np.zeros((0, index.d), dtype=np.float32)
+    if raw_vectors is not None and len(raw_vectors) == index.ntotal:
+        return raw_vectors.get(ids)
+    code_size = index.code_size
+    codes = faiss.rev_swig_ptr(index.codes.data(), index.ntotal * code_size)
+    codes = np.asarray(codes).reshape(index.ntotal, code_size)
+    return index.sa_decode(np.ascontiguousarray(codes[ids]))
+
+
+class RawVectorStore:
+    """再ランキング用にfloat32の生ベクトルをディスクへ追記保存し、memmapで読み出す"""
+
+    def __init__(self, path, vector_dim, truncate=True):
+        self.path = path
+        self.vector_dim = vector_dim
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        if truncate or not os.path.isfile(path):
+            open(path, "wb").close()
+        self._file = open(path, "ab")
+        self._mmap = None
+
+    def __len__(self):
+        return os.path.getsize(self.path) // (4 * self.vector_dim)
+
+    def truncate(self):
+        """保存済みのベクトルをすべて破棄"""
+        self._mmap = None
+        self._file.truncate(0)
+
+    def append(self, vectors):
+        self._file.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+        self._file.flush()
+        self._mmap = None
+
+    def _vectors(self):
+        count = len(self)
+        if self._mmap is None or len(self._mmap) != count:
+            if count == 0:
+                return np.zeros((0, self.vector_dim), dtype=np.float32)
+            self._mmap = np.memmap(self.path, dtype=np.float32, mode="r", shape=(count, self.vector_dim))
+        return self._mmap
+
+    def get(self, ids):
+        """指定IDの生ベクトルを取得"""
+        return np.asarray(self._vectors()[ids], dtype=np.float32)
+
+    def read(self, start, count):
+        return np.asarray(self._vectors()[start : start + count], dtype=np.float32)
+
+    def write_subset(self, path, positions, block_size=65536):
+        """指定した位置のベクトルだけを別ファイルへ書き出す（コンパクション用）"""
+        with open(path, "wb") as file:
+            for start in range(0, len(positions), block_size):
+                file.write(self.get(positions[start : start + block_size]).tobytes())
+
+    def close(self):
+        self._mmap = None
+        self._file.close()
+
+
+def rerank_exact(raw_vectors, queries, D, I, k):
+    """圧縮インデックスの候補を生ベクトルとの正確なL2距離で並べ替えて上位k件を返す"""
+    out_d = np.full((len(queries), k), np.inf, dtype=np.float32)
+    out_i = np.full((len(queries), k), -1, dtype=np.int64)
+    for row, query in enumerate(queries):
+        ids = I[row][I[row] >= 0]
+        if len(ids) == 0:
+            continue
+        exact = ((raw_vectors.get(ids) - query) ** 2).sum(axis=1)
+        order = np.argsort(exact)[:k]
+        out_d[row, : len(order)] = exact[order]
+        out_i[row, : len(order)] = ids[order]
+    return out_d, out_i
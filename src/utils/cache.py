@@ -0,0 +1,43 @@
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """スレッドセーフな件数上限付きLRUキャッシュ"""
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """値を取得（見つかった場合は最近使用したものとして扱う）"""
+        if self.max_size <= 0:
+            return default
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+                return self._data[key]
+            except KeyError:
+                return default
+
+    def put(self, key, value):
+        """値を登録し、上限を超えたら最も古いものから破棄"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
@@ -0,0 +1,278 @@
+"""
+複数ノードでの分散取り込み
+
+各ノードのワーカーが手元のログから部分インデックス（ベクトル・テキスト・メタデータを含む自己完結したディレクトリ）を作り、
+コーディネーターがそれらをFaissのmerge_fromで1つのインデックスへ統合する（IDは付け替える）か、
+時間分割シャードとして登録してシャード横断検索の対象にします。ノード間で転送するのは部分インデックスだけです。
+
+量子化インデックス（RAG_INDEX_TYPE が sq8 / sqfp16 / pq）の場合、ノードごとに学習すると量子化が揃わず統合時に
+復号・再量子化が必要になるため、quantizer で作った学習済みの空インデックスを各ワーカーに配ってください。
+
+使用例:
+    python -m src.utils.distributed_index quantizer --output quantizer.faiss ./sample_logs
+    python -m src.utils.distributed_index build --output ./partials/node1 --quantizer quantizer.faiss ./logs
+    python -m src.utils.distributed_index merge ./partials/node1 ./partials/node2
+    python -m src.utils.distributed_index register ./partials/node1 ./partials/node2
+"""
+
+import argparse
+import json
+import os
+import shutil
+import socket
+import sys
+import time
+
+import faiss
+from ..core.embedder import create_embedder
+from ..core.rag import RAG, file_exists, mkdir_p, write_json_atomic
+from ..core.sharded_rag import NODE_SEPARATOR, UNPARTITIONED_SHARD, ShardedRAG
+from ..core.vector_index import empty_copy, index_signature, quantizer_fingerprint
+from .log_summarizer import LogSummarizer
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+from config import settings
+
+
+PARTIAL_MANIFEST = "partial.json"  # 部分インデックスの内容（ノード名・埋め込み方式・シャードごとの件数）
+MERGE_LOG = "merged_partials.json"  # 統合済みの部分インデックスとIDのオフセット（同じものの二重統合を防ぐ）
+PARTIAL_FORMAT = 1
+
+
+def _ingest(summarizer, paths):
+    for path in paths:
+        if os.path.isdir(path):
+            summarizer.load_log_directory(path)
+        else:
+            summarizer.load_log_file(path)
+
+
+def build_partial(paths, output_dir, name=None, quantizer_path=None):
+    """ログファイル・ディレクトリから部分インデックスを作り、マニフェストを返す
+
+    シャードごとに output_dir/<シャードキー>/ へスナップショット形式で保存する（時間分割しない場合のキーは "all"）。
+    quantizer_path: quantizer で作った学習済みの空インデックス（量子化をノード間で揃える）
+    """
+    name = name or socket.gethostname()
+    if NODE_SEPARATOR in name:
+        raise ValueError(f"ノード名に {NODE_SEPARATOR} は使えません: {name}")
+    if file_exists(os.path.join(output_dir, PARTIAL_MANIFEST)):
+        raise ValueError(f"部分インデックスが既にあります: {output_dir}")
+    template = faiss.read_index(quantizer_path) if quantizer_path else None
+
+    summarizer = LogSummarizer(load_llm=False)
+    if settings.RAG_SHARDING:
+        summarizer.rag = ShardedRAG(
+            output_dir,
+            partition=settings.RAG_SHARDING,
+            max_workers=1,
+            embedder=summarizer.embedder,
+            index_template=template,
+        )
+    else:
+        summarizer.rag = RAG(embedder=summarizer.embedder, index_template=template)
+    _ingest(summarizer, paths)
+
+    shards = dict(summarizer.rag.shards) if settings.RAG_SHARDING else {UNPARTITIONED_SHARD: summarizer.rag}
+    mkdir_p(output_dir)
+    shard_info = {}
+    for key, shard in sorted(shards.items()):
+        if not shard.save_snapshot(os.path.join(output_dir, key), settings.RAG_SNAPSHOT_COMPACT_EVERY):
+            raise RuntimeError(f"部分インデックスの保存に失敗しました: {key}")
+        shard_info[key] = {
+            "count": len(shard),
+            "index_signature": index_signature(shard.index),
+            "quantizer": quantizer_fingerprint(shard.index),
+        }
+    if template is None and any(info["quantizer"] for info in shard_info.values()):
+        print("量子化をこのノードで学習しました。統合時は他ノードと量子化が揃わず再量子化されます（--quantizer で揃えられます）")
+
+    manifest = {
+        "format": PARTIAL_FORMAT,
+        "name": name,
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "vector_dim": summarizer.rag.vector_dim,
+        "embedder": summarizer.embedder.name,
+        "index_type": settings.RAG_INDEX_TYPE,
+        "partition": settings.RAG_SHARDING,
+        "chunks": sum(info["count"] for info in shard_info.values()),
+        "shards": shard_info,
+        "files": summarizer.log_formats,
+    }
+    write_json_atomic(os.path.join(output_dir, PARTIAL_MANIFEST), manifest)
+    print(f"部分インデックスを作成しました: {output_dir}（ノード: {name}, {manifest['chunks']}件, シャード{len(shard_info)}個）")
+    return manifest
+
+
+def read_partial(partial_dir):
+    """部分インデックスのマニフェストを読み込み"""
+    manifest_path = os.path.join(partial_dir, PARTIAL_MANIFEST)
+    if not file_exists(manifest_path):
+        raise ValueError(f"部分インデックスではありません: {partial_dir}")
+    with open(manifest_path, "r", encoding="utf-8") as file:
+        manifest = json.load(file)
+    if manifest.get("format") != PARTIAL_FORMAT:
+        raise ValueError(f"未対応の部分インデックス形式です: {partial_dir}")
+    return manifest
+
+
+def _read_partials(partial_dirs):
+    manifests = [read_partial(partial_dir) for partial_dir in partial_dirs]
+    for attribute in ("embedder", "vector_dim", "partition"):
+        values = {manifest[attribute] for manifest in manifests}
+        if len(values) > 1:
+            raise ValueError(f"部分インデックスの {attribute} が一致しません: {', '.join(map(str, values))}")
+    return manifests
+
+
+def _load_target(path, embedder):
+    """統合先のスナップショットを読み込み（なければ空のRAG）"""
+    if not file_exists(os.path.join(path, "manifest.json")):
+        return RAG(embedder=embedder)
+    target = RAG.load_latest(path, embedder=embedder)
+    if target is None:
+        raise ValueError(f"統合先のスナップショットを読み込めません: {path}")
+    return target
+
+
+def merge_partials(partial_dirs, output_path=None, embedder=None):
+    """部分インデックスを統合先のスナップショットへ統合し、統合した部分インデックスの記録を返す
+
+    時間分割した部分インデックスはシャードごとに output_path/<シャードキー>/ へ、それ以外は output_path へ統合する
+    （省略時は RAG_SHARD_PATH / RAG_SNAPSHOT_PATH）。統合先に既存のデータがあれば、その後ろに追加する。
+    """
+    manifests = _read_partials(partial_dirs)
+    partition = manifests[0]["partition"] if manifests else None
+    output_path = output_path or (settings.RAG_SHARD_PATH if partition else settings.RAG_SNAPSHOT_PATH)
+    embedder = embedder or create_embedder()
+    mkdir_p(output_path)
+
+    log_path = os.path.join(output_path, MERGE_LOG)
+    merged = {"partials": []}
+    if file_exists(log_path):
+        with open(log_path, "r", encoding="utf-8") as file:
+            merged = json.load(file)
+    done = {(entry["name"], entry["created_at"]) for entry in merged["partials"]}
+
+    targets = {}
+    added = []
+    for partial_dir, manifest in zip(partial_dirs, manifests):
+        if (manifest["name"], manifest["created_at"]) in done:
+            print(f"統合済みのためスキップします: {partial_dir}（ノード: {manifest['name']}）")
+            continue
+        id_offsets = {}
+        for key in sorted(manifest["shards"]):
+            source = RAG.load_latest(os.path.join(partial_dir, key), embedder=embedder)
+            if source is None:
+                raise ValueError(f"部分インデックスのシャードを読み込めません: {partial_dir}/{key}")
+            target_path = os.path.join(output_path, key) if partition else output_path
+            if target_path not in targets:
+                targets[target_path] = _load_target(target_path, embedder)
+            id_offsets[key] = targets[target_path].merge_from(source, {"node": manifest["name"]})
+        entry = {
+            "name": manifest["name"],
+            "created_at": manifest["created_at"],
+            "path": os.path.abspath(partial_dir),
+            "chunks": manifest["chunks"],
+            "id_offsets": id_offsets,  # 統合後のID = 部分インデックスでのID + オフセット
+            "merged_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        }
+        merged["partials"].append(entry)
+        added.append(entry)
+        done.add((manifest["name"], manifest["created_at"]))
+
+    for target_path, target in targets.items():
+        if not target.save_snapshot(target_path, settings.RAG_SNAPSHOT_COMPACT_EVERY):
+            raise RuntimeError(f"統合結果の保存に失敗しました: {target_path}")
+    # スナップショットを保存してから記録する（途中で失敗した場合は次回もう一度統合される）
+    write_json_atomic(log_path, merged)
+    print(f"{len(added)}個の部分インデックスを統合しました: {output_path}（{sum(entry['chunks'] for entry in added)}件）")
+    return added
+
+
+def register_partials(partial_dirs, shard_path=None):
+    """部分インデックスのシャードを「キー@ノード名」として時間分割シャードの保存先へコピーし、登録したキーを返す
+
+    統合せずにシャード横断検索の対象にする（RAG_SHARDING が必要。ShardedRAG.load で読み込まれる）。
+    """
+    if not settings.RAG_SHARDING:
+        raise ValueError("部分インデックスの登録には RAG_SHARDING の設定が必要です（統合する場合は merge を使用）")
+    shard_path = shard_path or settings.RAG_SHARD_PATH
+    manifests = _read_partials(partial_dirs)
+    registered = []
+    for partial_dir, manifest in zip(partial_dirs, manifests):
+        if manifest["partition"] not in (None, settings.RAG_SHARDING):
+            raise ValueError(f"シャードの分割単位が異なります: {manifest['partition']} != {settings.RAG_SHARDING}")
+        for key in sorted(manifest["shards"]):
+            registered_key = f"{key}{NODE_SEPARATOR}{manifest['name']}"
+            destination = os.path.join(shard_path, registered_key)
+            if os.path.exists(destination):
+                print(f"登録済みのためスキップします: {registered_key}")
+                continue
+            shutil.copytree(os.path.join(partial_dir, key), destination)
+            registered.append(registered_key)
+    print(f"{len(registered)}個のシャードを登録しました: {shard_path}")
+    return registered
+
+
+def export_quantizer(output_file, snapshot_path=None, paths=None):
+    """学習済みの空インデックスを書き出す（既存のスナップショットから、またはサンプルのログで学習）"""
+    if snapshot_path:
+        rag = RAG.load_latest(snapshot_path, embedder=create_embedder())
+        if rag is None:
+            raise ValueError(f"スナップショットを読み込めません: {snapshot_path}")
+    else:
+        summarizer = LogSummarizer(load_llm=False)
+        rag = summarizer.rag = RAG(embedder=summarizer.embedder)
+        _ingest(summarizer, paths or [])
+        rag.train_index(force=True)
+    if not rag.is_compressed:
+        raise ValueError("学習済みの量子化インデックスがありません（RAG_INDEX_TYPE が flat の場合は不要です）")
+    mkdir_p(os.path.dirname(os.path.abspath(output_file)))
+    faiss.write_index(empty_copy(rag.index), output_file)
+    print(f"量子化の学習結果を書き出しました: {output_file}（{index_signature(rag.index)}）")
+    return quantizer_fingerprint(rag.index)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="複数ノードでの分散取り込み（部分インデックスの作成・統合・登録）")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="手元のログから部分インデックスを作成")
+    build.add_argument("paths", nargs="+", help="ログファイルまたはディレクトリ")
+    build.add_argument("--output", required=True, help="部分インデックスの出力先ディレクトリ")
+    build.add_argument("--name", default=None, help="ノード名（省略時はホスト名）")
+    build.add_argument("--quantizer", default=None, help="quantizer で作った学習済みの空インデックス")
+
+    merge = commands.add_parser("merge", help="部分インデックスを1つのインデックスへ統合")
+    merge.add_argument("partials", nargs="+", help="部分インデックスのディレクトリ")
+    merge.add_argument("--output", default=None, help="統合先（省略時は RAG_SHARD_PATH / RAG_SNAPSHOT_PATH）")
+
+    register = commands.add_parser("register", help="部分インデックスをシャードとして登録（統合せずに横断検索）")
+    register.add_argument("partials", nargs="+", help="部分インデックスのディレクトリ")
+    register.add_argument("--shard-path", default=None, help="シャードの保存先（省略時は RAG_SHARD_PATH）")
+
+    quantizer = commands.add_parser("quantizer", help="ワーカーに配る学習済みの空インデックスを作成")
+    quantizer.add_argument("paths", nargs="*", help="学習に使うサンプルのログファイルまたはディレクトリ")
+    quantizer.add_argument("--output", required=True, help="出力するインデックスファイル")
+    quantizer.add_argument("--snapshot", default=None, help="既存のスナップショットの量子化を使う")
+
+    args = parser.parse_args()
+    try:
+        if args.command == "build":
+            build_partial(args.paths, args.output, args.name, args.quantizer)
+        elif args.command == "merge":
+            merge_partials(args.partials, args.output)
+        elif args.command == "register":
+            register_partials(args.partials, args.shard_path)
+        elif not args.snapshot and not args.paths:
+            parser.error("quantizer には --snapshot または学習用のログを指定してください")
+        else:
+            export_quantizer(args.output, args.snapshot, args.paths)
+    except (ValueError, RuntimeError) as e:
+        print(f"エラー: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,38 @@
 #!/usr/bin/env python3
 """
-GPU使用状況テストスクリプト
+GPU使用状況テスト・ハードウェア計測スクリプト
+
+引数なしで実行すると従来どおりGPU環境をチェックします。--probe を付けると、行列積のGFLOPS・メモリ帯域・
+Faissの検索スループット・トークナイザーの処理速度・生成のトークン/秒を計測し、その結果から
+TORCH_DTYPE・量子化・スレッド数・インデックス種別・バッチサイズの推奨値を表示します。
+--write を付けると推奨値を config/tuned_settings.json に書き出し、settings.py の値を上書きします。
+
+使用例:
+    PYTHONPATH=/path/to/intelligent_log_analyzer python src/utils/gpu_test.py --probe --write
 """
 
-import sys
+import argparse
+import json
 import os
+import socket
+import sys
+import time
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+from config import settings
 
-sys.path.append(os.path.join(os.path.dirname(__file__)))
+RECALL_MIN = 0.9  # インデックス種別の推奨に必要な recall@k
+THREAD_SCALING_MIN = 0.9  # 最速の9割以上の性能が出る最小のスレッド数を推奨する
+EMBEDDING_BATCH_CANDIDATES = (8, 16, 32, 64, 128)
+SAMPLE_LOG_LINES = (
+    "2024-01-15 10:23:45 ERROR [db-pool] Connection timeout after 30000ms to host db-{n}.internal:5432",
+    "2024-01-15 10:23:46 WARNING [api] Slow response: GET /api/v1/users/{n} took 2350ms",
+    "2024-01-15 10:23:47 INFO [auth] ユーザー user{n} がログインしました (session={n})",
+    "2024-01-15 10:23:48 ERROR [backup] ディスク容量不足のためバックアップに失敗しました: /var/backup/{n}",
+    "2024-01-15 10:23:49 INFO [worker-{n}] Processed batch of 512 records in 1.2s",
+    "java.lang.IllegalStateException: Connection pool exhausted (active={n}, max=50)",
+)
 
 
 def test_gpu_environment():
@@ -74,5 +100,457 @@ def test_gpu_environment():
     print("\n🔍 GPU環境チェック完了")
 
 
+def _import_torch():
+    try:
+        import torch
+
+        return torch
+    except ImportError:
+        return None
+
+
+def _best_seconds(func, repeat):
+    """funcをrepeat回実行した最短時間（初回はウォームアップとして除く）"""
+    func()
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def thread_candidates(max_threads):
+    """スレッド数の候補（1, 2, 4, ... と上限値）"""
+    candidates = []
+    threads = 1
+    while threads < max_threads:
+        candidates.append(threads)
+        threads *= 2
+    candidates.append(max_threads)
+    return candidates
+
+
+def smallest_near_best(throughputs):
+    """最速の THREAD_SCALING_MIN 倍以上のスループットが出る最小の設定値（スレッド数・バッチサイズ）"""
+    best = max(throughputs.values())
+    return min(threads for threads, value in throughputs.items() if value >= best * THREAD_SCALING_MIN)
+
+
+def probe_system():
+    """コア数・メモリ容量・bfloat16対応などの基本情報"""
+    from src.core.cpu_inference import cpu_supports_bf16
+
+    logical = os.cpu_count() or 1
+    available = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else logical
+    physical = None
+    try:
+        with open("/proc/cpuinfo", "r") as file:
+            cores = set()
+            physical_id = core_id = None
+            for line in file:
+                key, _, value = line.partition(":")
+                key = key.strip()
+                if key == "physical id":
+                    physical_id = value.strip()
+                elif key == "core id":
+                    core_id = value.strip()
+                    cores.add((physical_id, core_id))
+            physical = len(cores) or None
+    except OSError:
+        pass
+    try:
+        memory_bytes = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (ValueError, OSError, AttributeError):
+        memory_bytes = None
+    torch = _import_torch()
+    return {
+        "host": socket.gethostname(),
+        "logical_cpus": logical,
+        "available_cpus": available,
+        # 物理コア数はアフィニティで制限されたコア数を超えない
+        "physical_cores": min(physical, available) if physical else None,
+        "memory_bytes": memory_bytes,
+        "cpu_bf16": cpu_supports_bf16(torch),
+        "torch": torch.__version__ if torch else None,
+        "cuda": bool(torch and torch.cuda.is_available()),
+    }
+
+
+def probe_matmul(size=1024, repeat=5, max_threads=None):
+    """numpy / torch（CPU・GPU）の行列積GFLOPS。torchがあればスレッド数ごとにも計測"""
+    flops = 2.0 * size**3
+    a = np.random.rand(size, size).astype(np.float32)
+    b = np.random.rand(size, size).astype(np.float32)
+    results = {"size": size, "numpy_float32": flops / _best_seconds(lambda: a @ b, repeat) / 1e9}
+
+    torch = _import_torch()
+    if torch is None:
+        return results
+    from src.core.cpu_inference import cpu_supports_bf16
+
+    original_threads = torch.get_num_threads()
+    x = torch.rand(size, size)
+    y = torch.rand(size, size)
+    by_threads = {}
+    for threads in thread_candidates(max_threads or original_threads):
+        torch.set_num_threads(threads)
+        by_threads[threads] = flops / _best_seconds(lambda: torch.mm(x, y), repeat) / 1e9
+    torch.set_num_threads(original_threads)
+    results["torch_float32_by_threads"] = by_threads
+    results["torch_float32"] = max(by_threads.values())
+    if cpu_supports_bf16(torch):
+        xb, yb = x.to(torch.bfloat16), y.to(torch.bfloat16)
+        results["torch_bfloat16"] = flops / _best_seconds(lambda: torch.mm(xb, yb), repeat) / 1e9
+
+    if torch.cuda.is_available():
+        properties = torch.cuda.get_device_properties(0)
+        results["gpu_name"] = properties.name
+        results["gpu_memory_bytes"] = properties.total_memory
+        results["gpu_bf16"] = torch.cuda.is_bf16_supported()
+        gpu_size = size * 4
+        gpu_flops = 2.0 * gpu_size**3
+        dtypes = [("float32", torch.float32), ("float16", torch.float16)]
+        if results["gpu_bf16"]:
+            dtypes.append(("bfloat16", torch.bfloat16))
+        for name, dtype in dtypes:
+            xg = torch.rand(gpu_size, gpu_size, device="cuda", dtype=dtype)
+            yg = torch.rand(gpu_size, gpu_size, device="cuda", dtype=dtype)
+
+            def run():
+                torch.mm(xg, yg)
+                torch.cuda.synchronize()
+
+            results[f"gpu_{name}"] = gpu_flops / _best_seconds(run, repeat) / 1e9
+            del xg, yg
+        torch.cuda.empty_cache()
+    return results
+
+
+def probe_memory_bandwidth(megabytes=256, repeat=5):
+    """大きな配列のコピーで計測したメモリ帯域（GB/s、読み込み＋書き込み）"""
+    source = np.ones(megabytes * 1024 * 1024 // 8, dtype=np.float64)
+    target = np.empty_like(source)
+    seconds = _best_seconds(lambda: np.copyto(target, source), repeat)
+    return {"megabytes": megabytes, "copy_gb_per_sec": 2 * source.nbytes / seconds / 1e9}
+
+
+def _clustered_vectors(count, dim, rng, centers=256):
+    """ログの埋め込みに近いよう、クラスタに偏った乱数ベクトルを生成"""
+    means = rng.standard_normal((centers, dim)).astype(np.float32)
+    labels = rng.integers(0, centers, count)
+    return means[labels] + 0.3 * rng.standard_normal((count, dim)).astype(np.float32)
+
+
+def probe_faiss(num_vectors=50000, vector_dim=None, num_queries=256, k=5, max_threads=None, index_types=None):
+    """インデックス種別ごとの検索スループット・1件あたりの遅延・recall@k と、現在の種別のスレッド数ごとのスループット"""
+    import faiss
+    from src.core.vector_index import INDEX_TYPES, bytes_per_vector, create_index
+
+    vector_dim = vector_dim or settings.EMBEDDING_VECTOR_DIM
+    rng = np.random.default_rng(0)
+    vectors = _clustered_vectors(num_vectors, vector_dim, rng)
+    queries = vectors[rng.integers(0, num_vectors, num_queries)] + 0.1 * rng.standard_normal(
+        (num_queries, vector_dim)
+    ).astype(np.float32)
+
+    index_types = list(index_types or INDEX_TYPES)
+    # 現在の種別を先に計測する
+    if settings.RAG_INDEX_TYPE in index_types:
+        index_types.remove(settings.RAG_INDEX_TYPE)
+        index_types.insert(0, settings.RAG_INDEX_TYPE)
+    exact = faiss.IndexFlatL2(vector_dim)
+    exact.add(vectors)
+    _, truth = exact.search(queries, k)
+
+    results = {"num_vectors": num_vectors, "vector_dim": vector_dim, "k": k, "index_types": {}}
+    indexes = {}
+    for index_type in index_types:
+        try:
+            index = create_index(index_type, vector_dim, settings.RAG_PQ_M, settings.RAG_PQ_NBITS)
+        except ValueError as e:
+            print(f"  {index_type}: スキップします（{e}）")
+            continue
+        start = time.perf_counter()
+        if not index.is_trained:
+            index.train(vectors[: settings.RAG_INDEX_TRAIN_SIZE])
+        index.add(vectors)
+        build_seconds = time.perf_counter() - start
+        batch_seconds = _best_seconds(lambda: index.search(queries, k), 3)
+        _, found = index.search(queries, k)
+        single = []
+        for query in queries[:100]:
+            start = time.perf_counter()
+            index.search(query.reshape(1, -1), k)
+            single.append(time.perf_counter() - start)
+        recall = np.mean([len(set(found[i]) & set(truth[i])) / k for i in range(num_queries)])
+        results["index_types"][index_type] = {
+            "build_seconds": build_seconds,
+            "batch_qps": num_queries / batch_seconds,
+            "single_query_ms": float(np.median(single)) * 1000,
+            "recall_at_k": float(recall),
+            "bytes_per_vector": bytes_per_vector(index),
+        }
+        indexes[index_type] = index
+
+    current = indexes.get(settings.RAG_INDEX_TYPE)
+    if current is not None:
+        original_threads = faiss.omp_get_max_threads()
+        by_threads = {}
+        for threads in thread_candidates(max_threads or original_threads):
+            faiss.omp_set_num_threads(threads)
+            by_threads[threads] = num_queries / _best_seconds(lambda: current.search(queries, k), 3)
+        faiss.omp_set_num_threads(original_threads)
+        results["current_qps_by_threads"] = by_threads
+    return results
+
+
+def _sample_texts(count):
+    return [SAMPLE_LOG_LINES[i % len(SAMPLE_LOG_LINES)].format(n=i * 7919 % 100000) for i in range(count)]
+
+
+def probe_tokenizer(model_name, count=2000):
+    """トークナイザーの処理速度（トークン/秒）と1トークンあたりの文字数"""
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    texts = _sample_texts(count)
+    seconds = _best_seconds(lambda: tokenizer(texts, add_special_tokens=False), 3)
+    tokens = sum(len(ids) for ids in tokenizer(texts, add_special_tokens=False)["input_ids"])
+    return {
+        "model": model_name,
+        "tokens_per_sec": tokens / seconds,
+        "lines_per_sec": count / seconds,
+        "chars_per_token": sum(len(text) for text in texts) / max(tokens, 1),
+    }
+
+
+def probe_embedding_batches(count=512, batch_sizes=EMBEDDING_BATCH_CANDIDATES):
+    """transformers埋め込みのバッチサイズごとのスループット（チャンク/秒）"""
+    from src.core.embedder import TransformerEmbedder
+
+    embedder = TransformerEmbedder(
+        settings.EMBEDDING_MODEL,
+        max_length=settings.EMBEDDING_MAX_LENGTH,
+        quantization=settings.EMBEDDING_QUANTIZATION,
+        num_threads=settings.EMBEDDING_NUM_THREADS,
+    )
+    texts = _sample_texts(count)
+    by_batch = {}
+    for batch_size in batch_sizes:
+        embedder.batch_size = batch_size
+        by_batch[batch_size] = count / _best_seconds(lambda: embedder.embed(texts), 2)
+    return {"model": settings.EMBEDDING_MODEL, "chunks_per_sec_by_batch": by_batch}
+
+
+def probe_generation(max_new_tokens=32):
+    """設定中のモデルで短い生成を行い、プリフィル時間とデコード速度を計測"""
+    from src.core.llm import LLM
+
+    llm = LLM(settings.MODEL)
+    llm.measure_generation(max_new_tokens=4)  # ウォームアップ
+    result = llm.measure_generation(max_new_tokens=max_new_tokens)
+    result["model"] = settings.MODEL
+    result["parameters"] = sum(parameter.numel() for parameter in llm.model.parameters())
+    result["device"] = str(llm.model.device)
+    return result
+
+
+def recommend_settings(results):
+    """計測結果から設定の推奨値を決める（{設定名: (推奨値, 理由)}）"""
+    system = results["system"]
+    matmul = results.get("matmul") or {}
+    faiss_results = results.get("faiss") or {}
+    generation = results.get("generation") or {}
+    recommendations = {}
+
+    cores = system["physical_cores"] or system["available_cpus"]
+    by_threads = matmul.get("torch_float32_by_threads")
+    if by_threads:
+        threads = smallest_near_best(by_threads)
+        recommendations["TORCH_NUM_THREADS"] = (threads, f"行列積が最速の{THREAD_SCALING_MIN:.0%}以上になる最小のスレッド数")
+    else:
+        threads = cores
+        recommendations["TORCH_NUM_THREADS"] = (threads, "物理コア数（torch未導入のためスレッド数ごとの計測なし）")
+    if settings.EMBEDDING_BACKEND == "transformers":
+        recommendations["EMBEDDING_NUM_THREADS"] = (threads, "TORCH_NUM_THREADS と同じ値")
+
+    if faiss_results.get("current_qps_by_threads"):
+        recommendations["FAISS_OMP_THREADS"] = (
+            smallest_near_best(faiss_results["current_qps_by_threads"]),
+            f"{settings.RAG_INDEX_TYPE} の検索が最速の{THREAD_SCALING_MIN:.0%}以上になる最小のスレッド数",
+        )
+
+    if system["cuda"] and settings.USE_GPU:
+        if matmul.get("gpu_bf16"):
+            recommendations["TORCH_DTYPE"] = ("bfloat16", "GPUがbfloat16に対応（float16よりオーバーフローしにくい）")
+        else:
+            recommendations["TORCH_DTYPE"] = ("float16", "GPUがbfloat16に非対応")
+        parameters = generation.get("parameters")
+        gpu_memory = matmul.get("gpu_memory_bytes")
+        if parameters and gpu_memory:
+            # 重み以外（KVキャッシュ・活性化）に2割の余裕を見る
+            if parameters * 2 * 1.2 <= gpu_memory:
+                recommendations["QUANTIZATION"] = (None, "16bitの重みがGPUメモリに収まる")
+            elif parameters * 1 * 1.2 <= gpu_memory:
+                recommendations["QUANTIZATION"] = ("8bit", "16bitの重みはGPUメモリに収まらない")
+            else:
+                recommendations["QUANTIZATION"] = ("4bit", "8bitの重みもGPUメモリに収まらない")
+    else:
+        recommendations["TORCH_DTYPE"] = ("float32", "CPU推論（低精度化は CPU_QUANTIZATION で指定）")
+        bf16_speedup = (matmul.get("torch_bfloat16") or 0) / (matmul.get("torch_float32") or float("inf"))
+        if "torch_float32" not in matmul:
+            pass  # torchがなければCPU推論の方式は判断しない
+        elif system["cpu_bf16"] and bf16_speedup > 1.2:
+            recommendations["CPU_QUANTIZATION"] = ("bfloat16", f"bfloat16の行列積がfloat32の{bf16_speedup:.1f}倍")
+        else:
+            # CPUのデコードはメモリ帯域律速のため、重みを小さくするほど速い
+            recommendations["CPU_QUANTIZATION"] = ("int8_dynamic", "bfloat16の高速化がないため重みをint8にして帯域を節約")
+
+    candidates = {
+        name: values
+        for name, values in faiss_results.get("index_types", {}).items()
+        if values["recall_at_k"] >= RECALL_MIN
+    }
+    if candidates:
+        fastest = max(values["batch_qps"] for values in candidates.values())
+        # 最速の9割以上の速度が出る種別のうち、1件あたりのバイト数が最小のもの
+        name = min(
+            (name for name, values in candidates.items() if values["batch_qps"] >= fastest * THREAD_SCALING_MIN),
+            key=lambda name: candidates[name]["bytes_per_vector"],
+        )
+        values = candidates[name]
+        recommendations["RAG_INDEX_TYPE"] = (
+            name,
+            f"recall@{faiss_results['k']}={values['recall_at_k']:.2f}、{values['batch_qps']:.0f}クエリ/秒、"
+            f"1件{values['bytes_per_vector']}バイト",
+        )
+
+    embedding = results.get("embedding_batches")
+    if embedding:
+        speeds = embedding["chunks_per_sec_by_batch"]
+        batch_size = smallest_near_best(speeds)
+        recommendations["EMBEDDING_BATCH_SIZE"] = (batch_size, f"埋め込みが最速の{THREAD_SCALING_MIN:.0%}以上になる最小のバッチ")
+    else:
+        batch_size = settings.EMBEDDING_BATCH_SIZE
+    # 1バッチで埋め込みのバッチを数回回せる大きさにする
+    recommendations["INGEST_BATCH_EVENTS"] = (
+        max(settings.INGEST_BATCH_EVENTS, batch_size * 8),
+        "埋め込みバッチの8倍以上",
+    )
+    return recommendations
+
+
+def run_probes(args):
+    """各計測を実行し、結果の辞書を返す（依存パッケージがない計測はスキップ）"""
+    results = {"generated_at": time.strftime("%Y-%m-%d %H:%M:%S"), "system": probe_system()}
+    max_threads = results["system"]["available_cpus"]
+    steps = [
+        ("matmul", "行列積", lambda: probe_matmul(max_threads=max_threads)),
+        ("memory", "メモリ帯域", probe_memory_bandwidth),
+        ("faiss", "Faiss検索", lambda: probe_faiss(args.vectors, max_threads=max_threads)),
+    ]
+    if not args.skip_model:
+        steps.append(("tokenizer", "トークナイザー", lambda: probe_tokenizer(settings.MODEL)))
+        if settings.EMBEDDING_BACKEND == "transformers":
+            steps.append(("embedding_batches", "埋め込みバッチ", probe_embedding_batches))
+        if settings.LLM_BACKEND == "transformers":
+            steps.append(("generation", "生成", lambda: probe_generation(args.max_new_tokens)))
+    for key, label, probe in steps:
+        print(f"🔍 {label}を計測中...")
+        try:
+            results[key] = probe()
+        except ImportError as e:
+            print(f"  ⚠️ {label}の計測をスキップしました（{e}）")
+        except Exception as e:
+            print(f"  ❌ {label}の計測に失敗しました: {e}")
+    return results
+
+
+def print_report(results, recommendations):
+    system = results["system"]
+    memory = system["memory_bytes"]
+    print(f"\n📊 計測結果 ({system['host']})")
+    memory_text = f"{memory / 1024**3:.1f}GB" if memory else "不明"
+    print(
+        f"   - CPU: 論理{system['logical_cpus']} / 利用可能{system['available_cpus']} / "
+        f"物理{system['physical_cores']}コア, bfloat16: {system['cpu_bf16']}, メモリ: {memory_text}"
+    )
+    matmul = results.get("matmul")
+    if matmul:
+        line = f"   - 行列積({matmul['size']}): numpy {matmul['numpy_float32']:.1f} GFLOPS"
+        for key in ("torch_float32", "torch_bfloat16", "gpu_float32", "gpu_float16", "gpu_bfloat16"):
+            if key in matmul:
+                line += f", {key} {matmul[key]:.1f}"
+        print(line)
+    if "memory" in results:
+        print(f"   - メモリ帯域: {results['memory']['copy_gb_per_sec']:.1f} GB/s")
+    faiss_results = results.get("faiss")
+    if faiss_results:
+        print(f"   - Faiss（{faiss_results['num_vectors']}件 × {faiss_results['vector_dim']}次元）:")
+        for name, values in faiss_results["index_types"].items():
+            print(
+                f"       {name:<8}{values['batch_qps']:>10.0f} クエリ/秒  {values['single_query_ms']:>7.2f} ms/件  "
+                f"recall@{faiss_results['k']} {values['recall_at_k']:.2f}  {values['bytes_per_vector']} B/件"
+            )
+    if "tokenizer" in results:
+        tokenizer = results["tokenizer"]
+        print(
+            f"   - トークナイザー: {tokenizer['tokens_per_sec']:.0f} トークン/秒"
+            f"（1トークンあたり{tokenizer['chars_per_token']:.1f}文字）"
+        )
+    if "generation" in results:
+        generation = results["generation"]
+        print(
+            f"   - 生成（{generation['device']}）: デコード {generation['decode_tokens_per_sec'] or 0:.1f} トークン/秒, "
+            f"プリフィル {generation['prefill_seconds']:.2f} 秒"
+        )
+
+    print("\n💡 推奨設定")
+    for name, (value, reason) in recommendations.items():
+        current = getattr(settings, name, None)
+        mark = "  " if current == value else "→ "
+        print(f"   {mark}{name} = {value!r}（現在: {current!r}）  # {reason}")
+
+
+def write_tuned_settings(path, results, recommendations):
+    """推奨値を settings.py が読み込む上書きファイルに書き出す"""
+    data = {
+        "generated_at": results["generated_at"],
+        "host": results["system"]["host"],
+        "settings": {name: value for name, (value, _) in recommendations.items()},
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(data, file, ensure_ascii=False, indent=2)
+    print(f"\n✅ 推奨設定を書き出しました: {path}（次回の起動から settings.py の値を上書きします）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="GPU環境チェックとハードウェア計測による設定の推奨")
+    parser.add_argument("--probe", action="store_true", help="性能を計測して推奨設定を表示")
+    parser.add_argument("--write", action="store_true", help="推奨設定を TUNED_SETTINGS_PATH に書き出す")
+    parser.add_argument("--skip-model", action="store_true", help="モデルを読み込む計測（トークナイザー・埋め込み・生成）を省略")
+    parser.add_argument("--vectors", type=int, default=50000, help="Faiss計測に使うベクトル数")
+    parser.add_argument("--max-new-tokens", type=int, default=32, help="生成の計測で出力するトークン数")
+    parser.add_argument("--output", default=None, help="計測結果のJSONを保存するパス")
+    args = parser.parse_args()
+
+    if not (args.probe or args.write):
+        test_gpu_environment()
+        return
+
+    results = run_probes(args)
+    recommendations = recommend_settings(results)
+    print_report(results, recommendations)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(dict(results, recommendations=recommendations), file, ensure_ascii=False, indent=2)
+        print(f"\n計測結果を保存しました: {args.output}")
+    if args.write:
+        write_tuned_settings(settings.TUNED_SETTINGS_PATH, results, recommendations)
+
+
 if __name__ == "__main__":
-    test_gpu_environment()
+    main()
@@ -0,0 +1,332 @@
+import heapq
+import os
+import queue
+import sys
+import threading
+import time
+from .log_reader import LogDecoder, iter_log_events
+from .metrics import metrics
+from ..core.text_store import make_file_ref
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+from config import settings
+
+
+_END = object()  # ステージ終了を下流に伝える番兵
+
+
+class StageStats:
+    """ステージごとの処理件数・処理時間・待ち時間"""
+
+    def __init__(self, name, workers):
+        self.name = name
+        self.workers = workers
+        self.batches = 0
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.wait_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, items, busy_seconds, wait_seconds):
+        with self._lock:
+            self.batches += 1
+            self.items += items
+            self.busy_seconds += busy_seconds
+            self.wait_seconds += wait_seconds
+        metrics.increment(f"ingest.{self.name}.items", items)
+        metrics.observe(f"ingest.{self.name}", busy_seconds)
+
+    def as_dict(self, elapsed):
+        # ワーカーあたりの稼働率が最も高いステージがボトルネック
+        utilization = self.busy_seconds / (elapsed * self.workers) if elapsed > 0 else 0.0
+        return {
+            "workers": self.workers,
+            "batches": self.batches,
+            "items": self.items,
+            "busy_seconds": self.busy_seconds,
+            "wait_seconds": self.wait_seconds,
+            "items_per_sec": self.items / self.busy_seconds * self.workers if self.busy_seconds > 0 else 0.0,
+            "utilization": utilization,
+        }
+
+
+class IngestPipeline:
+    """読み込み → チャンク化 → 埋め込み → 書き込み の段階的な取り込みパイプライン
+
+    各ステージは件数上限付きのキューでつながり、下流が詰まると上流が待つ（バックプレッシャー）ため、
+    読み込みが速くてもメモリに溜め込む量はキューサイズ×バッチサイズで頭打ちになる。
+    スレッドで重ね合わせられるのはGILを解放するファイルI/O・numpy/faiss・torchの処理だけで、
+    チャンク化（Pythonの正規表現・パーサー）とハッシュ埋め込みはGILを保持するため、スレッドを増やしても速くならない。
+    統計の更新とインデックスへの追加は単一の書き込みスレッドで、読み込み順に行う。
+    summarizer.lock（集計用の読み書きロック）とRAG内部の書き込みロックはバッチごとにだけ取得するため、取り込み中も検索できる。
+    """
+
+    def __init__(
+        self,
+        summarizer,
+        reader_threads=2,
+        chunker_threads=1,
+        embedder_threads=1,
+        queue_size=8,
+        batch_size=64,
+    ):
+        self.summarizer = summarizer
+        self.reader_threads = max(1, reader_threads)
+        self.chunker_threads = max(1, chunker_threads)
+        self.embedder_threads = max(1, embedder_threads)
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.stages = {
+            "read": StageStats("read", self.reader_threads),
+            "chunk": StageStats("chunk", self.chunker_threads),
+            "embed": StageStats("embed", self.embedder_threads),
+            "write": StageStats("write", 1),
+        }
+        self.file_chunks = {}  # ファイルごとの追加チャンク数
+        self.errors = {}  # ファイル（またはステージ）ごとのエラー
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+
+    def _put(self, target, item):
+        """停止要求を確認しながらキューへ投入（満杯なら待つ）"""
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                break
+            except queue.Full:
+                continue
+        return time.perf_counter() - start
+
+    def _get(self, source):
+        """キューから取り出す（停止要求があれば番兵を返す）"""
+        start = time.perf_counter()
+        while not self._stop.is_set():
+            try:
+                return source.get(timeout=0.1), time.perf_counter() - start
+            except queue.Empty:
+                continue
+        return _END, time.perf_counter() - start
+
+    def _fail(self, key, error):
+        self.errors[key] = error
+        print(f"取り込みエラー ({key}): {error}")
+
+    # --- ステージ ---
+
+    def _read_files(self, files, next_file, lock, chunk_queue):
+        """ファイルを読み込み、生イベントのバッチを順序番号付きで下流へ流す"""
+        summarizer = self.summarizer
+        stats = self.stages["read"]
+        while not self._stop.is_set():
+            with lock:
+                if next_file[0] >= len(files):
+                    return
+                file_index = next_file[0]
+                next_file[0] += 1
+            file_path = files[file_index]
+            decoder = LogDecoder(settings.LOG_ENCODING, settings.LOG_FALLBACK_ENCODINGS)
+            parser = None
+            batch_index = 0
+            try:
+                use_refs = summarizer._uses_file_refs(file_path)
+                parser = summarizer.parser_for(file_path)
+                events = iter_log_events(
+                    file_path,
+                    decoder,
+                    event_start_pattern=parser.start_pattern,
+                    use_mmap=settings.LOG_USE_MMAP,
+                    continuation_pattern=parser.continuation_pattern,
+                )
+                batch = []
+                start = time.perf_counter()
+                for offset, raw_event in events:
+                    batch.append((offset, raw_event))
+                    if len(batch) >= self.batch_size:
+                        busy = time.perf_counter() - start
+                        wait = self._put(
+                            chunk_queue, ((file_index, batch_index), file_path, decoder, parser, batch, use_refs, False)
+                        )
+                        stats.record(len(batch), busy, wait)
+                        batch = []
+                        batch_index += 1
+                        start = time.perf_counter()
+                busy = time.perf_counter() - start
+                # ファイル末尾のバッチ（空でも送ってファイル完了を伝える）
+                wait = self._put(
+                    chunk_queue, ((file_index, batch_index), file_path, decoder, parser, batch, use_refs, True)
+                )
+                stats.record(len(batch), busy, wait)
+            except Exception as e:
+                self._fail(str(file_path), e)
+                # 読み込み済みのバッチの後にファイル完了を伝える
+                self._put(chunk_queue, ((file_index, batch_index), file_path, decoder, parser, [], False, True))
+
+    def _chunk(self, chunk_queue, embed_queue):
+        """デコード・形式ごとの時刻とレベルの抽出・長さ制限・シグネチャ付与（"file" ストアでは元ログへの参照も）を行う"""
+        summarizer = self.summarizer
+        stats = self.stages["chunk"]
+        while True:
+            item, wait = self._get(chunk_queue)
+            if item is _END:
+                return
+            order, file_path, decoder, parser, raw_events, use_refs, last = item
+            start = time.perf_counter()
+            chunks = []
+            signatures = []
+            events = []  # (イベント全文（チャンクが1つの場合はNone）, 時刻・レベル, チャンク数)
+            refs = []
+            try:
+                for offset, raw_event in raw_events:
+                    if not raw_event.strip():
+                        continue
+                    text = decoder.decode(raw_event)
+                    event_chunks, event_fields = summarizer._split_event(text, parser)
+                    added = 0
+                    for chunk in event_chunks:
+                        if chunk.strip():
+                            chunks.append(chunk)
+                            signatures.append(sorted(summarizer.signature_matcher.find_all(chunk)))
+                            refs.append(
+                                make_file_ref(file_path, offset, raw_event, chunk, decoder.detected_encoding)
+                                if use_refs and len(event_chunks) == 1
+                                else None
+                            )
+                            added += 1
+                    if added:
+                        events.append((text if len(event_chunks) > 1 else None, event_fields, added))
+            except Exception as e:
+                self._fail(str(file_path), e)
+                chunks, signatures, events, refs = [], [], [], []
+            busy = time.perf_counter() - start
+            wait += self._put(embed_queue, (order, file_path, chunks, signatures, events, refs, last))
+            stats.record(len(chunks), busy, wait)
+
+    def _embed(self, embed_queue, write_queue):
+        """チャンクをまとめて埋め込む"""
+        rag = self.summarizer.rag
+        stats = self.stages["embed"]
+        while True:
+            item, wait = self._get(embed_queue)
+            if item is _END:
+                return
+            order, file_path, chunks, signatures, events, refs, last = item
+            start = time.perf_counter()
+            vectors = None
+            if chunks:
+                try:
+                    vectors = rag.embed(chunks)
+                except Exception as e:
+                    self._fail(str(file_path), e)
+                    chunks, signatures, events, refs = [], [], [], []
+            busy = time.perf_counter() - start
+            wait += self._put(write_queue, (order, file_path, chunks, signatures, events, refs, vectors, last))
+            stats.record(len(chunks), busy, wait)
+
+    def _write(self, write_queue, file_count):
+        """統計の更新とインデックスへの追加（単一スレッド、読み込み順に並べ直して処理）"""
+        try:
+            self._write_batches(write_queue, file_count)
+        except Exception as e:
+            # 書き込みが止まると上流が詰まるため、パイプライン全体を停止する
+            self._fail("write", e)
+            self._stop.set()
+
+    def _write_batches(self, write_queue, file_count):
+        summarizer = self.summarizer
+        stats = self.stages["write"]
+        pending = []  # 順序待ちのバッチ（ヒープ）
+        expected = {}  # ファイルごとの次に書き込むバッチ番号
+        finished = 0
+        while finished < file_count:
+            item, wait = self._get(write_queue)
+            if item is _END:
+                return
+            heapq.heappush(pending, (item[0], id(item), item))
+            start = time.perf_counter()
+            written = 0
+            while pending:
+                (file_index, batch_index), _, ready = pending[0]
+                if batch_index != expected.get(file_index, 0):
+                    break
+                heapq.heappop(pending)
+                _, file_path, chunks, signatures, events, refs, vectors, last = ready
+                if chunks:
+                    # 集計はイベントごとに1回（分割されたチャンクはタグ付けのみ）
+                    with summarizer.lock.write():
+                        metadata_list = summarizer._tag_events(file_path, chunks, signatures, events)
+                    # RAGへの追加はRAG内部の書き込みロックでバッチごとに公開される
+                    try:
+                        summarizer.rag.add_embedded(chunks, vectors, metadata_list, refs)
+                    except Exception as e:
+                        self._fail(str(file_path), e)
+                    self.file_chunks[file_path] = self.file_chunks.get(file_path, 0) + len(chunks)
+                    written += len(chunks)
+                else:
+                    self.file_chunks.setdefault(file_path, 0)
+                expected[file_index] = batch_index + 1
+                if last:
+                    finished += 1
+            stats.record(written, time.perf_counter() - start, wait)
+
+    def run(self, files):
+        """ファイル群を取り込み、ファイルごとの追加チャンク数を返す"""
+        files = list(files)
+        self._stop.clear()
+        if not files:
+            return {}
+        chunk_queue = queue.Queue(maxsize=self.queue_size)
+        embed_queue = queue.Queue(maxsize=self.queue_size)
+        write_queue = queue.Queue(maxsize=self.queue_size)
+        next_file = [0]
+        lock = threading.Lock()
+
+        def run_stage(target, count, *args):
+            threads = [threading.Thread(target=target, args=args, daemon=True) for _ in range(count)]
+            for thread in threads:
+                thread.start()
+            return threads
+
+        start = time.perf_counter()
+        readers = run_stage(self._read_files, min(self.reader_threads, len(files)), files, next_file, lock, chunk_queue)
+        chunkers = run_stage(self._chunk, self.chunker_threads, chunk_queue, embed_queue)
+        embedders = run_stage(self._embed, self.embedder_threads, embed_queue, write_queue)
+        writer = run_stage(self._write, 1, write_queue, len(files))[0]
+
+        try:
+            # 上流のスレッドが終わったら下流のワーカー数だけ番兵を流す
+            for threads, target, downstream in (
+                (readers, chunk_queue, self.chunker_threads),
+                (chunkers, embed_queue, self.embedder_threads),
+                (embedders, write_queue, 1),
+            ):
+                for thread in threads:
+                    thread.join()
+                for _ in range(downstream):
+                    self._put(target, _END)
+            writer.join()
+        except KeyboardInterrupt:
+            self._stop.set()
+            raise
+        finally:
+            self.elapsed = time.perf_counter() - start
+
+        for name, stage in self.stages.items():
+            metrics.set_gauge(f"ingest.{name}.utilization", stage.as_dict(self.elapsed)["utilization"])
+        return dict(self.file_chunks)
+
+    def report(self):
+        """ステージごとのスループットとボトルネック（稼働率が最大のステージ）を返す"""
+        stages = {name: stage.as_dict(self.elapsed) for name, stage in self.stages.items()}
+        bottleneck = max(stages, key=lambda name: stages[name]["utilization"]) if self.elapsed else None
+        return {"elapsed_seconds": self.elapsed, "bottleneck": bottleneck, "stages": stages}
+
+    def format_report(self):
+        report = self.report()
+        lines = [f"取り込み時間: {report['elapsed_seconds']:.2f}秒 (ボトルネック: {report['bottleneck']})"]
+        for name, stage in report["stages"].items():
+            lines.append(
+                f"  {name}: {stage['items']}件, {stage['items_per_sec']:.0f}件/秒, "
+                f"稼働率 {stage['utilization']:.0%}, 待ち {stage['wait_seconds']:.2f}秒 (x{stage['workers']})"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,287 @@
+import calendar
+import json
+import re
+import time
+from datetime import datetime
+from ..core.log_stats import LEVEL_TOKEN_MAP, TIMESTAMP_FORMATS, parse_timestamp
+from .log_reader import TIMESTAMP_BYTES_PATTERN
+
+
+# 既定形式のタイムスタンプ（LogSummarizer.log_patterns["timestamp"] と同じ）
+TIMESTAMP_PATTERN = re.compile(r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}|\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}")
+
+# 直前のイベントに含める継続行（インデント行・Java/Pythonの例外とスタックトレース）
+CONTINUATION_BYTES_PATTERN = re.compile(
+    rb"^(?:\s"
+    rb"|Caused by:|Suppressed:|\.\.\. \d+ (?:more|common frames omitted)"
+    rb"|Traceback \(most recent call last\):"
+    rb"|During handling of the above exception|The above exception was the direct cause"
+    rb"|[\w$.]*(?:Error|Exception|Throwable)\b[\w$.]*(?::|$))",
+    re.M,
+)
+
+MONTH_NAMES = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+MONTHS = {name: i for i, name in enumerate(MONTH_NAMES, 1)}
+
+DETECT_MIN_SCORE = 0.5  # 自動判定で採用する最小の一致率
+SPLIT_HEADER_CHARS = 120  # 分割したイベントの2つ目以降に付ける先頭行の最大文字数
+
+
+def parse_iso_timestamp(value):
+    """ISO 8601形式の時刻をUNIX秒に変換（タイムゾーンなしはUTCとして扱う）"""
+    value = value.strip()
+    if value.endswith("Z"):
+        value = value[:-1] + "+00:00"
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        for fmt in TIMESTAMP_FORMATS:
+            try:
+                parsed = datetime.strptime(value[:19], fmt)
+                break
+            except ValueError:
+                continue
+        else:
+            return None
+    if parsed.tzinfo is None:
+        return calendar.timegm(parsed.timetuple())
+    return int(parsed.timestamp())
+
+
+def _split_line(line, target_chars):
+    """長い1行を空白位置（なければtarget_chars）で分割"""
+    while len(line) > target_chars:
+        cut = line.rfind(" ", target_chars // 2, target_chars)
+        if cut <= 0:
+            yield line[:target_chars]
+            line = line[target_chars:]
+        else:
+            yield line[:cut]
+            line = line[cut + 1 :]
+    yield line
+
+
+def split_long_event(text, max_chars=1000, target_chars=800):
+    """長すぎるイベントを行境界（長い行は空白位置）で分割
+
+    スタックトレースのフレームを途中で切らないよう行単位でまとめ、2つ目以降の断片には
+    どのイベントの続きか分かるよう先頭行を付ける。
+    """
+    if len(text) <= max_chars:
+        return [text]
+    lines = text.split("\n")
+    header = lines[0][:SPLIT_HEADER_CHARS] if len(lines) > 1 else None
+    pieces = []
+    current = []
+    size = 0
+    for line in lines:
+        for segment in _split_line(line, target_chars):
+            if current and size + len(segment) + 1 > target_chars:
+                pieces.append("\n".join(current))
+                current = []
+                size = 0
+            current.append(segment)
+            size += len(segment) + 1
+    if current:
+        pieces.append("\n".join(current))
+    if header:
+        pieces[1:] = [f"{header} …(続き)\n{piece}" for piece in pieces[1:]]
+    return pieces
+
+
+class LogParser:
+    """ログ形式ごとのイベント境界・タイムスタンプ・レベルの判定（既定はタイムスタンプを含む行で区切る形式）
+
+    start_pattern / continuation_pattern はバイト列の正規表現で、行単位で照合する
+    （行頭に固定する場合は re.M と ^ を使う）。continuation_pattern に一致する行は
+    start_pattern に一致しても直前のイベントに含める。
+    """
+
+    name = "timestamp"
+    start_pattern = TIMESTAMP_BYTES_PATTERN
+    continuation_pattern = None
+
+    def score(self, lines):
+        """サンプル行のうちイベント開始行と判定できる割合（継続行は分母から除く）"""
+        candidates = [line for line in lines if not CONTINUATION_BYTES_PATTERN.match(line)]
+        if not candidates:
+            return 0.0
+        return sum(1 for line in candidates if self.start_pattern.search(line)) / len(candidates)
+
+    def parse(self, text):
+        """イベントから {"timestamp": UNIX秒, "level": レベル} を取り出す（判定できない値はNone）"""
+        return {"timestamp": parse_timestamp(text, TIMESTAMP_PATTERN), "level": None}
+
+    def split(self, text, max_chars=1000, target_chars=800):
+        """長すぎるイベントを分割"""
+        return split_long_event(text, max_chars, target_chars)
+
+
+class MultilineParser(LogParser):
+    """タイムスタンプのないログ用。インデント行や例外・スタックトレースを直前の行と同じイベントにまとめる"""
+
+    name = "multiline"
+    start_pattern = re.compile(rb"^\S", re.M)
+    continuation_pattern = CONTINUATION_BYTES_PATTERN
+
+
+class JsonLinesParser(LogParser):
+    """1行1イベントのJSON Lines形式（時刻・レベルはフィールドから取り出す）"""
+
+    name = "json"
+    start_pattern = re.compile(rb"^\s*\{", re.M)
+    timestamp_keys = ("@timestamp", "timestamp", "time", "ts", "datetime", "date")
+    level_keys = ("level", "severity", "levelname", "log.level", "lvl", "loglevel")
+    # bunyan/pino形式の数値レベル
+    numeric_levels = ((50, "error"), (40, "warning"), (30, "info"))
+
+    def parse(self, text):
+        try:
+            record = json.loads(text.split("\n", 1)[0])
+        except ValueError:
+            return super().parse(text)
+        if not isinstance(record, dict):
+            return super().parse(text)
+        return {"timestamp": self._timestamp(record), "level": self._level(record)}
+
+    def _timestamp(self, record):
+        for key in self.timestamp_keys:
+            value = record.get(key)
+            if isinstance(value, bool) or value is None:
+                continue
+            if isinstance(value, (int, float)):
+                # 大きすぎる値はミリ秒として扱う
+                return int(value / 1000) if value > 1e11 else int(value)
+            if isinstance(value, str):
+                timestamp = parse_iso_timestamp(value)
+                if timestamp is not None:
+                    return timestamp
+        return None
+
+    def _level(self, record):
+        for key in self.level_keys:
+            value = record.get(key)
+            if isinstance(value, bool) or value is None:
+                continue
+            if isinstance(value, (int, float)):
+                return next((level for threshold, level in self.numeric_levels if value >= threshold), "other")
+            if isinstance(value, str):
+                return LEVEL_TOKEN_MAP.get(value.strip().upper())
+        return None
+
+
+class SyslogParser(LogParser):
+    """RFC 3164（BSD）/ RFC 5424 形式のsyslog（PRIがあれば重大度からレベルを判定）"""
+
+    name = "syslog"
+    start_pattern = re.compile(
+        rb"^(?:<\d{1,3}>\d{1,2} (?:\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\S*|-) "
+        rb"|(?:<\d{1,3}>)?(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec) [ \d]\d \d{2}:\d{2}:\d{2} )",
+        re.M,
+    )
+    header_pattern = re.compile(
+        r"^(?:<(?P<pri>\d{1,3})>)?(?:\d{1,2} (?P<iso>\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}\S*|-) "
+        r"|(?P<month>[A-Z][a-z]{2}) (?P<day>[ \d]\d) (?P<clock>\d{2}:\d{2}:\d{2}) )"
+    )
+
+    def parse(self, text):
+        match = self.header_pattern.match(text)
+        if not match:
+            return super().parse(text)
+        timestamp = None
+        if match.group("iso"):
+            timestamp = parse_iso_timestamp(match.group("iso"))
+        elif match.group("month") in MONTHS:
+            timestamp = self._bsd_timestamp(match.group("month"), match.group("day"), match.group("clock"))
+        level = None
+        if match.group("pri"):
+            severity = int(match.group("pri")) % 8
+            level = "error" if severity <= 3 else "warning" if severity == 4 else "info" if severity <= 6 else "other"
+        return {"timestamp": timestamp, "level": level}
+
+    @staticmethod
+    def _bsd_timestamp(month, day, clock):
+        """年のないRFC 3164の時刻を現在の年（未来になる場合は前年）として変換"""
+        hour, minute, second = (int(value) for value in clock.split(":"))
+        now = time.time()
+        year = time.gmtime(now).tm_year
+        try:
+            timestamp = calendar.timegm((year, MONTHS[month], int(day), hour, minute, second))
+            if timestamp > now + 86400:
+                timestamp = calendar.timegm((year - 1, MONTHS[month], int(day), hour, minute, second))
+        except (ValueError, OverflowError):
+            return None
+        return timestamp
+
+
+class AccessLogParser(LogParser):
+    """Apache/nginxのcommon・combined形式のアクセスログ（ステータス5xxはerror、4xxはwarning）"""
+
+    name = "access"
+    start_pattern = re.compile(rb'^\S+ \S+ \S+ \[\d{2}/[A-Z][a-z]{2}/\d{4}:\d{2}:\d{2}:\d{2} [+-]\d{4}\] "', re.M)
+    line_pattern = re.compile(
+        r'^\S+ \S+ \S+ \[(?P<day>\d{2})/(?P<month>[A-Z][a-z]{2})/(?P<year>\d{4}):(?P<clock>\d{2}:\d{2}:\d{2}) '
+        r'(?P<zone>[+-]\d{4})\] "[^"]*" (?P<status>\d{3})'
+    )
+
+    def parse(self, text):
+        match = self.line_pattern.match(text)
+        if not match or match.group("month") not in MONTHS:
+            return super().parse(text)
+        hour, minute, second = (int(value) for value in match.group("clock").split(":"))
+        zone = match.group("zone")
+        offset = (int(zone[1:3]) * 3600 + int(zone[3:5]) * 60) * (1 if zone[0] == "+" else -1)
+        timestamp = calendar.timegm(
+            (int(match.group("year")), MONTHS[match.group("month")], int(match.group("day")), hour, minute, second)
+        )
+        status = int(match.group("status"))
+        level = "error" if status >= 500 else "warning" if status >= 400 else "info"
+        return {"timestamp": timestamp - offset, "level": level}
+
+
+_PARSERS = {}
+
+
+def register_parser(parser):
+    """ログ形式のパーサーを登録（同名の登録は置き換える）
+
+    自動判定では一致率が同じなら先に登録した形式を優先するため、汎用的な形式ほど後に登録する。
+    """
+    _PARSERS[parser.name] = parser
+    return parser
+
+
+def get_parser(name):
+    """形式名からパーサーを取得"""
+    try:
+        return _PARSERS[name]
+    except KeyError:
+        raise ValueError(f"未対応のログ形式です: {name}（対応形式: {', '.join(_PARSERS)}）")
+
+
+def available_formats():
+    return list(_PARSERS)
+
+
+def detect_parser(sample, min_score=DETECT_MIN_SCORE):
+    """ファイル先頭のバイト列から形式を判定（どれにも当てはまらなければ複数行形式）"""
+    lines = sample.split(b"\n")
+    if len(lines) > 1:
+        lines = lines[:-1]  # 途中で切れた最終行は使わない
+    lines = [line.rstrip(b"\r") for line in lines if line.strip()]
+    if not lines:
+        return _PARSERS["timestamp"]
+    best, best_score = None, 0.0
+    for parser in _PARSERS.values():
+        if parser.name == "multiline":
+            continue  # 判定できなかった場合の受け皿
+        score = parser.score(lines)
+        if score > best_score:
+            best, best_score = parser, score
+    if best is None or best_score < min_score:
+        return _PARSERS["multiline"]
+    return best
+
+
+for _parser in (JsonLinesParser(), SyslogParser(), AccessLogParser(), LogParser(), MultilineParser()):
+    register_parser(_parser)
@@ -0,0 +1,268 @@
+import bz2
+import codecs
+import fnmatch
+import gzip
+import io
+import lzma
+import mmap
+import os
+import re
+from pathlib import Path
+
+try:
+    import zstandard
+except ImportError:  # zstdは任意依存
+    zstandard = None
+
+
+# 先頭バイトによる圧縮形式の判定（拡張子のないローテーションファイル用）
+MAGIC_NUMBERS = (
+    (b"\x1f\x8b", "gzip"),
+    (b"BZh", "bz2"),
+    (b"\xfd7zXZ\x00", "xz"),
+    (b"\x28\xb5\x2f\xfd", "zstd"),
+)
+EXTENSIONS = {
+    ".gz": "gzip",
+    ".bz2": "bz2",
+    ".xz": "xz",
+    ".lzma": "xz",
+    ".zst": "zstd",
+}
+
+
+def detect_compression(file_path):
+    """拡張子または先頭バイトから圧縮形式を判定（非圧縮ならNone）"""
+    compression = EXTENSIONS.get(Path(file_path).suffix.lower())
+    if compression:
+        return compression
+    with open(file_path, "rb") as file:
+        head = file.read(8)
+    for magic, name in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def open_binary_stream(file_path):
+    """圧縮ファイルも含めてバイナリストリームとして開く（展開はストリーミングで行う）"""
+    compression = detect_compression(file_path)
+    if compression == "gzip":
+        return gzip.open(file_path, "rb")
+    if compression == "bz2":
+        return bz2.open(file_path, "rb")
+    if compression == "xz":
+        return lzma.open(file_path, "rb")
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError(f"zstd圧縮ファイルを読むには zstandard パッケージが必要です: {file_path}")
+        raw = open(file_path, "rb")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw, closefd=True))
+    return open(file_path, "rb")
+
+
+def open_log_stream(file_path, encoding="utf-8", errors="replace"):
+    """ログファイルをテキストストリームとして開く（圧縮ファイルは透過的に展開）"""
+    return io.TextIOWrapper(open_binary_stream(file_path), encoding=encoding, errors=errors, newline="")
+
+
+# 既定のイベント開始判定（タイムスタンプを含む行）。バイト列のまま照合する
+TIMESTAMP_BYTES_PATTERN = re.compile(rb"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}|\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}")
+DEFAULT_FALLBACK_ENCODINGS = ("utf-8", "cp932", "euc_jp")
+ENCODING_SAMPLE_BYTES = 64 * 1024
+
+
+class LogDecoder:
+    """イベント単位でバイト列を文字列に変換するクラス（エンコーディング自動判定）"""
+
+    def __init__(self, encoding="auto", fallback_encodings=DEFAULT_FALLBACK_ENCODINGS):
+        """encodingに"auto"を指定するとファイル先頭のサンプルから判定"""
+        self.encoding = encoding
+        self.fallback_encodings = tuple(fallback_encodings)
+        self.detected_encoding = None if encoding == "auto" else encoding
+
+    def detect(self, sample):
+        """サンプルバイト列からエンコーディングを推定"""
+        if sample.startswith(codecs.BOM_UTF8):
+            return "utf-8-sig"
+        # 途中で切れた文字を避けるため最後の改行までで判定
+        cut = sample.rfind(b"\n")
+        if cut > 0:
+            sample = sample[:cut]
+        for encoding in self.fallback_encodings:
+            try:
+                sample.decode(encoding)
+                return encoding
+            except UnicodeDecodeError:
+                continue
+        return "utf-8"
+
+    def start_file(self, sample):
+        """新しいファイルの読み込み開始時に呼び出す"""
+        if self.encoding == "auto":
+            self.detected_encoding = self.detect(sample)
+        return self.detected_encoding
+
+    def decode(self, raw):
+        """1イベント分のバイト列を変換（混在エンコーディングはイベント単位でフォールバック）"""
+        text = self._decode(raw)
+        if "\r" in text:
+            text = text.replace("\r\n", "\n")
+        return text
+
+    def _decode(self, raw):
+        encoding = self.detected_encoding or "utf-8"
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+        for fallback in self.fallback_encodings:
+            if fallback == encoding:
+                continue
+            try:
+                return raw.decode(fallback)
+            except UnicodeDecodeError:
+                continue
+        return raw.decode(encoding, errors="replace")
+
+
+def iter_line_spans(buffer, start=0, end=None):
+    """バッファ内の行を (開始, 終了) で返す（改行検索はmemchr相当のfindで行う）"""
+    if end is None:
+        end = len(buffer)
+    position = start
+    while position < end:
+        newline = buffer.find(b"\n", position, end)
+        if newline < 0:
+            yield position, end
+            return
+        yield position, newline
+        position = newline + 1
+
+
+def _strip_line_end(buffer, start, end):
+    if end > start and buffer[end - 1 : end] == b"\r":
+        return end - 1
+    return end
+
+
+def iter_event_spans(buffer, event_start_pattern=TIMESTAMP_BYTES_PATTERN, continuation_pattern=None):
+    """バッファ上でイベント境界を検出し (開始, 終了) を返す（デコードは行わない）
+
+    continuation_pattern に一致する行は、開始行のパターンに一致しても直前のイベントに含める。
+    """
+    event_start = None
+    event_end = None
+    for line_start, line_end in iter_line_spans(buffer):
+        if (
+            event_start is not None
+            and event_start_pattern.search(buffer, line_start, line_end)
+            and not (continuation_pattern and continuation_pattern.match(buffer, line_start, line_end))
+        ):
+            yield event_start, event_end
+            event_start = line_start
+        elif event_start is None:
+            event_start = line_start
+        event_end = _strip_line_end(buffer, line_start, line_end)
+    if event_start is not None:
+        yield event_start, event_end
+
+
+def _iter_stream_events(stream, event_start_pattern, continuation_pattern=None):
+    """非シーク可能なストリーム（圧縮ファイル）からイベントを逐次生成"""
+    offset = 0
+    event_offset = 0
+    current = []
+    for line in stream:
+        line_length = len(line)
+        line = line.rstrip(b"\r\n")
+        if (
+            current
+            and event_start_pattern.search(line)
+            and not (continuation_pattern and continuation_pattern.match(line))
+        ):
+            yield event_offset, b"\n".join(current)
+            current = []
+            event_offset = offset
+        current.append(line)
+        offset += line_length
+    if current:
+        yield event_offset, b"\n".join(current)
+
+
+def iter_log_events(
+    file_path, decoder=None, event_start_pattern=TIMESTAMP_BYTES_PATTERN, use_mmap=True, continuation_pattern=None
+):
+    """ログファイルからイベントを (バイトオフセット, バイト列) で逐次生成
+
+    非圧縮ファイルはmmapでページキャッシュを直接走査し、ファイル全体をPythonヒープへコピーしない。
+    圧縮ファイルはストリーミング展開しながら同じ境界判定を行う。
+    decoderを渡すとファイル先頭のサンプルでエンコーディング判定を行う。
+    """
+    compression = detect_compression(file_path)
+    if compression is None and use_mmap:
+        size = os.path.getsize(file_path)
+        if size == 0:
+            return
+        with open(file_path, "rb") as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                if decoder is not None:
+                    decoder.start_file(buffer[:ENCODING_SAMPLE_BYTES])
+                for start, end in iter_event_spans(buffer, event_start_pattern, continuation_pattern):
+                    yield start, buffer[start:end]
+        return
+
+    with open_binary_stream(file_path) as stream:
+        if decoder is not None:
+            sample = stream.peek(ENCODING_SAMPLE_BYTES) if hasattr(stream, "peek") else b""
+            decoder.start_file(sample[:ENCODING_SAMPLE_BYTES])
+        yield from _iter_stream_events(stream, event_start_pattern, continuation_pattern)
+
+
+def read_log_sample(file_path, size=ENCODING_SAMPLE_BYTES):
+    """ログファイル先頭のバイト列を読む（圧縮ファイルは展開後の先頭、形式の自動判定用）"""
+    with open_binary_stream(file_path) as stream:
+        return stream.read(size)
+
+
+def iter_decoded_lines(file_path, decoder=None, use_mmap=True):
+    """ログファイルを1行ずつデコードして返す"""
+    decoder = decoder or LogDecoder()
+    if detect_compression(file_path) is None and use_mmap:
+        if os.path.getsize(file_path) == 0:
+            return
+        with open(file_path, "rb") as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                decoder.start_file(buffer[:ENCODING_SAMPLE_BYTES])
+                for start, end in iter_line_spans(buffer):
+                    yield decoder.decode(buffer[start : _strip_line_end(buffer, start, end)])
+        return
+
+    with open_binary_stream(file_path) as stream:
+        sample = stream.peek(ENCODING_SAMPLE_BYTES) if hasattr(stream, "peek") else b""
+        decoder.start_file(sample[:ENCODING_SAMPLE_BYTES])
+        for line in stream:
+            yield decoder.decode(line.rstrip(b"\r\n"))
+
+
+def _matches_any(path, relative_path, patterns):
+    return any(fnmatch.fnmatch(path.name, pattern) or fnmatch.fnmatch(relative_path, pattern) for pattern in patterns)
+
+
+def iter_log_files(directory_path, include_patterns=("*.log",), exclude_patterns=()):
+    """ディレクトリ配下のログファイルを複数の包含・除外パターンで列挙"""
+    if isinstance(include_patterns, str):
+        include_patterns = [include_patterns]
+    if isinstance(exclude_patterns, str):
+        exclude_patterns = [exclude_patterns]
+
+    root = Path(directory_path)
+    for path in sorted(root.rglob("*")):
+        if not path.is_file():
+            continue
+        relative_path = path.relative_to(root).as_posix()
+        if not _matches_any(path, relative_path, include_patterns):
+            continue
+        if exclude_patterns and _matches_any(path, relative_path, exclude_patterns):
+            continue
+        yield path
@@ -0,0 +1,287 @@
+"""
+ローカル分析サービス
+
+LogSummarizer（LLM・RAG・ナレッジベース）を常駐させ、HTTPで取り込み・検索・要約・集計を提供します。
+取り込みはバックグラウンドで行い、その間も検索・集計に応答します。生成は LogSummarizer の
+生成スケジューラーに優先度クラス（"interactive" / "batch"）付きで投入し、同じプロンプトの同時リクエストは
+1回の生成を共有します。
+
+使用例:
+    python -m src.utils.log_service --port 8080 --ingest ./logs
+    curl -X POST localhost:8080/ingest -d '{"path": "./logs"}'
+    curl -X POST localhost:8080/query -d '{"text": "データベース接続エラー", "k": 5}'
+    curl -X POST localhost:8080/remove -d '{"path": "./logs/app.log"}'
+    curl -N -X POST localhost:8080/summarize -d '{"request": "エラーを要約してください"}'
+    curl -X POST localhost:8080/summarize -d '{"request": "日次レポート", "priority": "batch", "stream": false}'
+"""
+
+import argparse
+import itertools
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from ..core.llm_scheduler import QueueFullError
+from .log_summarizer import LogSummarizer
+from .metrics import metrics
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+from config import settings
+
+
+def _json_default(value):
+    """numpyの数値型をJSONに変換"""
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.floating):
+        return float(value)
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+
+class LogAnalysisService:
+    """常駐するLogSummarizerへの操作（取り込み・検索・要約・集計）をまとめたサービス本体"""
+
+    def __init__(self, summarizer):
+        self.summarizer = summarizer
+        self.scheduler = summarizer.scheduler
+        self.started_at = time.time()
+        self.ingest_jobs = {}
+        self._job_ids = itertools.count(1)
+        self._ingest_queue = queue.Queue()
+        threading.Thread(target=self._ingest_worker, daemon=True).start()
+
+    # --- 取り込み ---
+
+    def submit_ingest(self, path):
+        """取り込みをバックグラウンドで実行するジョブとして登録"""
+        job_id = next(self._job_ids)
+        self.ingest_jobs[job_id] = {"id": job_id, "path": path, "status": "queued", "submitted_at": time.time()}
+        self._ingest_queue.put(job_id)
+        return self.ingest_jobs[job_id]
+
+    def _ingest_worker(self):
+        # 取り込みは1件ずつ（各取り込みの内部はパイプラインで並列化される）
+        while True:
+            job = self.ingest_jobs[self._ingest_queue.get()]
+            job["status"] = "running"
+            start = time.perf_counter()
+            try:
+                if os.path.isdir(job["path"]):
+                    ok = self.summarizer.load_log_directory(job["path"])
+                else:
+                    ok = self.summarizer.load_log_file(job["path"])
+                job["status"] = "done" if ok else "failed"
+            except Exception as e:
+                job["status"] = "failed"
+                job["error"] = str(e)
+            job["seconds"] = time.perf_counter() - start
+            job["chunks"] = len(self.summarizer.rag)
+            job["report"] = self.summarizer.last_ingest_report
+
+    def remove(self, path=None, before=None):
+        """ログファイル単位または時刻指定でチャンクを削除し、削除件数を返す"""
+        removed = 0
+        if path:
+            removed += self.summarizer.remove_log_file(path)
+        if before is not None:
+            removed += self.summarizer.remove_logs_before(int(before))
+        return {"removed": removed, "chunks": len(self.summarizer.rag)}
+
+    @property
+    def ingesting(self):
+        return any(job["status"] in ("queued", "running") for job in self.ingest_jobs.values())
+
+    # --- 検索・集計 ---
+
+    def query(self, text, k=5, time_ranges=None):
+        # RAGは内部の読み書きロックで取り込みと排他されるため、集計用のロックは取らない
+        return self.summarizer.rag.query(text, k=k, time_ranges=time_ranges)
+
+    def stats(self, top_n=10, period_seconds=3600):
+        # 集計の読み取りロックは LogSummarizer 側で取得される
+        return self.summarizer.stats(top_n=top_n, period_seconds=period_seconds)
+
+    def health(self):
+        return {
+            "status": "ok",
+            "uptime_seconds": time.time() - self.started_at,
+            "chunks": len(self.summarizer.rag),
+            "ingesting": self.ingesting,
+            "generation_queue": len(self.scheduler),
+            "generation": self.scheduler.stats(),
+        }
+
+    # --- 要約 ---
+
+    def summarize_stream(self, user_request, anomaly_windows=None, priority="interactive"):
+        """要約をテキスト片ごとに返す（集計の参照は LogSummarizer 内で読み取りロック下、生成はスケジューラー経由）"""
+        prompt, direct_answer = self.summarizer._prepare_summary(user_request, anomaly_windows)
+        if prompt is None:
+            yield direct_answer
+            return
+        job = self.scheduler.submit(prompt, priority)
+        try:
+            yield from job.stream()
+        except Exception as e:
+            yield f"\n[生成エラー: {e}]"
+
+
+class ServiceRequestHandler(BaseHTTPRequestHandler):
+    """HTTPリクエストをLogAnalysisServiceへ振り分けるハンドラ"""
+
+    protocol_version = "HTTP/1.1"
+    service = None  # サーバー起動時に設定
+
+    def log_message(self, format, *args):
+        if settings.SERVICE_ACCESS_LOG:
+            super().log_message(format, *args)
+
+    def _send_json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False, default=_json_default).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_text(self, text, content_type="text/plain; charset=utf-8", status=200):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        return json.loads(self.rfile.read(length).decode("utf-8"))
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        start = time.perf_counter()
+        try:
+            if url.path == "/health":
+                self._send_json(self.service.health())
+            elif url.path == "/metrics":
+                self._send_text(metrics.prometheus_text(), "text/plain; version=0.0.4; charset=utf-8")
+            elif url.path == "/stats":
+                self._send_json(
+                    self.service.stats(int(params.get("top_n", 10)), int(params.get("period_seconds", 3600)))
+                )
+            elif url.path.startswith("/ingest/"):
+                job = self.service.ingest_jobs.get(int(url.path.rsplit("/", 1)[-1]))
+                if job is None:
+                    self._send_json({"error": "ジョブが見つかりません"}, 404)
+                else:
+                    self._send_json(job)
+            else:
+                self._send_json({"error": "見つかりません"}, 404)
+        except Exception as e:
+            self._send_json({"error": str(e)}, 500)
+        metrics.observe(f"service.request.{url.path.strip('/').split('/')[0]}", time.perf_counter() - start)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        start = time.perf_counter()
+        try:
+            body = self._read_json()
+            if url.path == "/ingest":
+                if not body.get("path"):
+                    self._send_json({"error": "pathを指定してください"}, 400)
+                else:
+                    self._send_json(self.service.submit_ingest(body["path"]), 202)
+            elif url.path == "/remove":
+                if not body.get("path") and body.get("before") is None:
+                    self._send_json({"error": "pathまたはbeforeを指定してください"}, 400)
+                else:
+                    self._send_json(self.service.remove(body.get("path"), body.get("before")))
+            elif url.path == "/query":
+                if not body.get("text"):
+                    self._send_json({"error": "textを指定してください"}, 400)
+                else:
+                    results = self.service.query(body["text"], int(body.get("k", 5)), body.get("time_ranges"))
+                    self._send_json({"results": results})
+            elif url.path == "/summarize":
+                self._summarize(body)
+            else:
+                self._send_json({"error": "見つかりません"}, 404)
+        except QueueFullError as e:
+            self._send_json({"error": str(e)}, 429)
+        except (ValueError, KeyError) as e:
+            self._send_json({"error": f"不正なリクエストです: {e}"}, 400)
+        except Exception as e:
+            self._send_json({"error": str(e)}, 500)
+        metrics.observe(f"service.request.{url.path.strip('/').split('/')[0]}", time.perf_counter() - start)
+
+    def _summarize(self, body):
+        user_request = body.get("request") or "ログの内容を要約してください"
+        pieces = self.service.summarize_stream(
+            user_request, body.get("anomaly_windows"), body.get("priority", "interactive")
+        )
+        first = next(pieces, "")  # キュー投入の失敗（429）や不正な優先度（400）はヘッダー送信前に検出する
+        if not body.get("stream", True):
+            self._send_json({"summary": first + "".join(pieces)})
+            return
+
+        # チャンク転送で生成結果を逐次返す
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for piece in itertools.chain([first], pieces):
+            if not piece:
+                continue
+            data = piece.encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def create_server(service, host="127.0.0.1", port=8080):
+    """サービスを処理するHTTPサーバーを生成（port=0で空きポートを使用）"""
+    handler = type("Handler", (ServiceRequestHandler,), {"service": service})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ログ分析サービス（HTTP）")
+    parser.add_argument("--host", default=settings.SERVICE_HOST)
+    parser.add_argument("--port", type=int, default=settings.SERVICE_PORT)
+    parser.add_argument("--knowledge-base", default="data/knowledge_base.csv")
+    parser.add_argument("--load-snapshot", action="store_true", help="起動時に最新のスナップショットを読み込む")
+    parser.add_argument("--ingest", default=None, help="起動時に取り込むログファイルまたはディレクトリ")
+    args = parser.parse_args()
+
+    summarizer = LogSummarizer(knowledge_base_path=args.knowledge_base)
+    if args.load_snapshot:
+        summarizer.load_latest_snapshot()
+    service = LogAnalysisService(summarizer)
+    if args.ingest:
+        # 起動直後から応答できるよう、初回の取り込みもバックグラウンドで行う
+        service.submit_ingest(args.ingest)
+
+    server = create_server(service, args.host, args.port)
+    print(f"ログ分析サービスを起動しました: http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("サービスを停止します")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
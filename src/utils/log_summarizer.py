@@ -1,8 +1,20 @@
 import os
 import re
-from pathlib import Path
+import threading
 from ..core.rag import RAG
+from ..core.sharded_rag import ShardedRAG
+from ..core.embedder import create_embedder
+from ..core.text_store import make_file_ref
 from ..core.knowledge_base import KnowledgeBase
+from ..core.llm_scheduler import GenerationScheduler
+from ..core.anomaly import AnomalyDetector
+from ..core.log_stats import LogStatistics
+from ..core.signature_matcher import SignatureMatcher, load_signature_file
+from .ingest_pipeline import IngestPipeline
+from .log_parsers import detect_parser, get_parser
+from .log_reader import LogDecoder, detect_compression, iter_log_events, iter_log_files, read_log_sample
+from .metrics import metrics
+from .rwlock import ReadWriteLock
 import sys
 
 sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
@@ -10,18 +22,40 @@ from config import settings
 
 
 class LogSummarizer:
-    def __init__(self, model_name=None, knowledge_base_path="data/knowledge_base.csv"):
-        """ログ要約システムの初期化"""
-        if settings.LLM_BACKEND == "transformers":
+    def __init__(self, model_name=None, knowledge_base_path="data/knowledge_base.csv", llm=None, load_llm=True):
+        """ログ要約システムの初期化（llmを渡すとバックエンドの生成を省略）
+
+        load_llm: Falseの場合はLLMを読み込まない（分散取り込みのワーカーなど、取り込みだけを行う場合）
+        """
+        if llm is not None or not load_llm:
+            self.llm = llm
+        elif settings.LLM_BACKEND == "transformers":
             from ..core.llm import LLM
 
             self.llm = LLM(model_name or settings.MODEL)
+        elif settings.LLM_BACKEND == "stub":
+            from ..core.llm_stub import StubLLM
+
+            self.llm = StubLLM(model_name)
         else:
             from ..core.llm_ollama import OllamaLLM
 
             self.llm = OllamaLLM(model_name or settings.MODEL)
-
-        self.rag = RAG()
+        # 生成は優先度クラス付きのスケジューラー経由で行う（同じプロンプトの同時生成は1回にまとめる）
+        self.scheduler = GenerationScheduler(self.llm) if self.llm is not None else None
+
+        self.embedder = create_embedder()
+        if settings.RAG_SHARDING:
+            self.rag = ShardedRAG(
+                settings.RAG_SHARD_PATH,
+                partition=settings.RAG_SHARDING,
+                max_workers=settings.RAG_QUERY_THREADS,
+                compact_every=settings.RAG_SNAPSHOT_COMPACT_EVERY,
+                embedder=self.embedder,
+                keep_raw_vectors=settings.RAG_RERANK_FACTOR > 0,
+            )
+        else:
+            self.rag = RAG(embedder=self.embedder, raw_vector_path=settings.RAG_RAW_VECTOR_PATH)
         self.knowledge_base = KnowledgeBase(knowledge_base_path)
         self.log_patterns = {
             "error": r"(?i)(error|エラー|exception|失敗|異常)",
@@ -29,138 +63,348 @@ class LogSummarizer:
             "info": r"(?i)(info|information|情報|確認)",
             "timestamp": r"\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}|\d{4}/\d{2}/\d{2} \d{2}:\d{2}:\d{2}",
         }
+        self.log_stats = LogStatistics(
+            self.log_patterns, self.log_patterns["timestamp"], bucket_seconds=settings.STATS_BUCKET_SECONDS
+        )
+        self.anomaly_detector = AnomalyDetector(
+            self.log_stats,
+            method=settings.ANOMALY_METHOD,
+            alpha=settings.ANOMALY_EWMA_ALPHA,
+            window=settings.ANOMALY_ZSCORE_WINDOW,
+            max_templates=settings.ANOMALY_MAX_TEMPLATES,
+            max_gap_buckets=settings.ANOMALY_MAX_GAP_BUCKETS,
+        )
+        # 件数・頻度を尋ねる表現（英語は単語境界で区切り、"account" や "counter" などに一致させない）
+        self.stats_question_pattern = re.compile(
+            r"(?i)(何件|件数|いくつ(?!か)|何回|回数|頻度|毎時|時間ごと|時間あたり|統計"
+            r"|\bhow (?:many|often)\b|\bnumber of\b|\bcounts?\b|\bper (?:hour|minute)\b|\bstatistics\b)"
+        )
+        self.signature_matcher = self._build_signature_matcher()
+        self.request_matcher = SignatureMatcher(
+            ["エラー", "error", "パフォーマンス", "performance", "セキュリティ", "security"]
+        )
+        self.last_ingest_report = None  # 直近のパイプライン取り込みのステージ別計測結果
+        self.log_formats = {}  # ファイルごとに判定したログ形式
+        # 集計（log_stats・異常検知）の取り込み（書き込み）と参照（読み取り）の排他
+        # 再入できないため、参照は集計を直接読む箇所でだけ取得する（RAGは内部のロックで排他される）
+        self.lock = ReadWriteLock()
+        self._compaction_thread = None
+        self._compaction_lock = threading.Lock()
+
+    def _build_signature_matcher(self):
+        """設定のシグネチャとナレッジベースの問題名からマッチャーを構築"""
+        signatures = list(settings.LOG_SIGNATURES)
+        if settings.LOG_SIGNATURE_FILE:
+            signatures.extend(load_signature_file(settings.LOG_SIGNATURE_FILE))
+        signatures.extend(self.knowledge_base.get_problem_names())
+        return SignatureMatcher(signatures)
+
+    def rebuild_signature_matcher(self):
+        """ナレッジベース更新後にシグネチャマッチャーを再構築"""
+        self.signature_matcher = self._build_signature_matcher()
+        return len(self.signature_matcher)
 
     def load_log_file(self, file_path):
-        """単一ログファイルを読み込んでRAGに追加"""
+        """単一ログファイルを読み込んでRAGに追加（圧縮ファイルはストリーミング展開）"""
+        if settings.INGEST_PIPELINE:
+            return self._load_with_pipeline([file_path]) > 0
         try:
-            with open(file_path, "r", encoding="utf-8") as file:
-                content = file.read()
-
-            # ログをチャンクに分割（行ごと、または時間戳で区切る）
-            chunks = self._split_log_content(content)
-
-            for chunk in chunks:
-                if chunk.strip():  # 空でないチャンクのみ追加
-                    self.rag.add_text(chunk)
-
-            print(f"ログファイル '{file_path}' を読み込みました。{len(chunks)}個のチャンクを追加。")
+            chunk_count = 0
+            decoder = LogDecoder(settings.LOG_ENCODING, settings.LOG_FALLBACK_ENCODINGS)
+            parser = self.parser_for(file_path)
+            # イベント境界は形式ごとのパターンでバイト列上で検出し、追加するイベントだけをデコード
+            events = iter_log_events(
+                file_path,
+                decoder,
+                event_start_pattern=parser.start_pattern,
+                use_mmap=settings.LOG_USE_MMAP,
+                continuation_pattern=parser.continuation_pattern,
+            )
+            use_refs = self._uses_file_refs(file_path)
+            # 埋め込みをバッチで計算するため、一定数たまるごとにまとめて追加
+            batch_texts, batch_events, batch_refs = [], [], []
+            for offset, raw_event in metrics.timed_iter("read", events):
+                if not raw_event.strip():
+                    chunk_count += 1
+                    continue
+                with metrics.span("chunk"):
+                    text = decoder.decode(raw_event)
+                    chunks, fields = self._split_event(text, parser)
+                added = 0
+                for chunk in chunks:
+                    if chunk.strip():  # 空でないチャンクのみ追加
+                        batch_texts.append(chunk)
+                        batch_refs.append(
+                            make_file_ref(file_path, offset, raw_event, chunk, decoder.detected_encoding)
+                            if use_refs and len(chunks) == 1
+                            else None
+                        )
+                        added += 1
+                    chunk_count += 1
+                if added:
+                    batch_events.append((text if len(chunks) > 1 else None, fields, added))
+                if len(batch_texts) >= settings.EMBEDDING_BATCH_SIZE:
+                    self._add_batch(file_path, batch_texts, batch_events, batch_refs)
+                    batch_texts, batch_events, batch_refs = [], [], []
+            self._add_batch(file_path, batch_texts, batch_events, batch_refs)
+            metrics.increment("ingest.files")
+            metrics.increment("ingest.chunks", chunk_count)
+
+            print(
+                f"ログファイル '{file_path}' を読み込みました（形式: {parser.name}）。{chunk_count}個のチャンクを追加。"
+            )
             return True
 
         except Exception as e:
             print(f"ファイル読み込みエラー: {e}")
             return False
 
-    def load_log_directory(self, directory_path, file_pattern="*.log"):
-        """ディレクトリ内のログファイルを一括読み込み"""
+    def _uses_file_refs(self, file_path):
+        """チャンクを元ログへの参照で保持できるか（"file" ストアで、mmapで読む非圧縮ファイルの場合）"""
+        return settings.RAG_TEXT_STORE == "file" and settings.LOG_USE_MMAP and detect_compression(file_path) is None
+
+    def parser_for(self, file_path):
+        """ファイルのログ形式のパーサーを返す（LOG_FORMAT="auto" では先頭のサンプルから判定）"""
+        if settings.LOG_FORMAT == "auto":
+            parser = detect_parser(read_log_sample(file_path, settings.LOG_FORMAT_SAMPLE_BYTES))
+        else:
+            parser = get_parser(settings.LOG_FORMAT)
+        self.log_formats[str(file_path)] = parser.name
+        return parser
+
+    def _split_event(self, text, parser):
+        """1イベントを長さ制限に合わせて分割し、(チャンクのリスト, 形式から取り出した時刻・レベル) を返す"""
+        fields = parser.parse(text)
+        return parser.split(text, settings.LOG_MAX_CHUNK_CHARS, settings.LOG_CHUNK_TARGET_CHARS), fields
+
+    def _tag_events(self, file_path, chunks, signatures, events):
+        """イベントごとに1回集計し、各チャンクにRAGに保存するメタデータを付ける（書き込みロック下で呼ぶ）
+
+        events: (イベント全文（チャンクが1つの場合はNone）, パーサーが取り出した時刻・レベル, チャンク数) のリスト。
+        集計はイベント全文とそのシグネチャで行い、分割されたチャンクにはイベントの時刻・レベルを引き継ぐ。
+        """
+        metadata_list = []
+        source = os.path.abspath(str(file_path))  # remove_log_fileで集計から差し引くキー
+        position = 0
+        for text, fields, count in events:
+            chunk_signatures = signatures[position : position + count]
+            event = self.log_stats.add_event(
+                chunks[position] if text is None else text,
+                sorted(set().union(*chunk_signatures)),
+                timestamp=fields.get("timestamp"),
+                level=fields.get("level"),
+                source=source,
+            )
+            for signature_list in chunk_signatures:
+                metadata_list.append(
+                    {
+                        "source": str(file_path),
+                        "signatures": signature_list,
+                        "level": event["level"],
+                        "timestamp": event["timestamp"],
+                    }
+                )
+            position += count
+        return metadata_list
+
+    def _add_batch(self, file_path, texts, events, refs):
+        """チャンクのバッチを埋め込み・タグ付けし、集計（書き込みロック下）とRAGへの追加を行う
+
+        埋め込みとシグネチャの検出はロックの外で行い、RAGへの追加はRAG内部の書き込みロックでバッチごとに公開される。
+        """
+        if not texts:
+            return
+        with metrics.span("embed"):
+            vectors = self.rag.embed(texts)
+        with metrics.span("tag"):
+            signatures = [sorted(self.signature_matcher.find_all(text)) for text in texts]
+            with self.lock.write():
+                metadata_list = self._tag_events(file_path, texts, signatures, events)
+        self.rag.add_embedded(texts, vectors, metadata_list, refs)
+
+    def load_log_directory(self, directory_path, file_pattern=None, exclude_patterns=None):
+        """ディレクトリ内のログファイルを一括読み込み
+
+        file_pattern: 包含パターン（文字列またはリスト、省略時はsettings.LOG_INCLUDE_PATTERNS）
+        exclude_patterns: 除外パターン（省略時はsettings.LOG_EXCLUDE_PATTERNS）
+        """
+        include_patterns = file_pattern or settings.LOG_INCLUDE_PATTERNS
+        if exclude_patterns is None:
+            exclude_patterns = settings.LOG_EXCLUDE_PATTERNS
+
         loaded_count = 0
-        for file_path in Path(directory_path).rglob(file_pattern):
-            if self.load_log_file(file_path):
-                loaded_count += 1
+        if settings.INGEST_PIPELINE:
+            # ファイル間でも読み込みと埋め込みを重ねるため、まとめてパイプラインに流す
+            loaded_count = self._load_with_pipeline(iter_log_files(directory_path, include_patterns, exclude_patterns))
+        else:
+            for file_path in iter_log_files(directory_path, include_patterns, exclude_patterns):
+                if self.load_log_file(file_path):
+                    loaded_count += 1
 
         print(f"合計 {loaded_count} 個のログファイルを読み込みました。")
         return loaded_count > 0
 
-    def _split_log_content(self, content):
-        """ログ内容を適切なチャンクに分割"""
-        # タイムスタンプで分割を試行
-        timestamp_pattern = self.log_patterns["timestamp"]
-        lines = content.split("\n")
-        chunks = []
-        current_chunk = []
-
-        for line in lines:
-            if re.search(timestamp_pattern, line) and current_chunk:
-                # 新しいタイムスタンプが見つかったら、前のチャンクを完成
-                chunks.append("\n".join(current_chunk))
-                current_chunk = [line]
-            else:
-                current_chunk.append(line)
-
-        # 最後のチャンクを追加
-        if current_chunk:
-            chunks.append("\n".join(current_chunk))
-
-        # チャンクが長すぎる場合は行数で分割
-        final_chunks = []
-        for chunk in chunks:
-            if len(chunk) > 1000:  # 1000文字を超える場合
-                sub_chunks = [chunk[i : i + 800] for i in range(0, len(chunk), 800)]
-                final_chunks.extend(sub_chunks)
-            else:
-                final_chunks.append(chunk)
+    def _load_with_pipeline(self, files):
+        """段階的な取り込みパイプラインでファイル群を読み込み、成功したファイル数を返す"""
+        pipeline = IngestPipeline(
+            self,
+            reader_threads=settings.INGEST_READER_THREADS,
+            chunker_threads=settings.INGEST_CHUNKER_THREADS,
+            embedder_threads=settings.INGEST_EMBEDDER_THREADS,
+            queue_size=settings.INGEST_QUEUE_SIZE,
+            batch_size=settings.INGEST_BATCH_EVENTS,
+        )
+        file_chunks = pipeline.run(files)
+        self.last_ingest_report = pipeline.report()
 
-        return final_chunks
+        loaded_count = 0
+        for file_path, chunk_count in file_chunks.items():
+            if str(file_path) in pipeline.errors:
+                continue  # エラー内容はパイプライン側で表示済み
+            log_format = self.log_formats.get(str(file_path))
+            print(f"ログファイル '{file_path}' を読み込みました（形式: {log_format}）。{chunk_count}個のチャンクを追加。")
+            metrics.increment("ingest.files")
+            metrics.increment("ingest.chunks", chunk_count)
+            loaded_count += 1
+        if metrics.enabled:
+            print(pipeline.format_report())
+        return loaded_count
+
+    def stats(self, top_n=10, period_seconds=3600):
+        """取り込み済みログの集計結果を返す（LLM不要）"""
+        with self.lock.read():
+            return self.log_stats.stats(top_n=top_n, period_seconds=period_seconds)
+
+    def answer_from_stats(self, user_request):
+        """件数・頻度に関する質問であれば集計結果だけで回答する"""
+        if not self.stats_question_pattern.search(user_request):
+            return None
+        period_seconds = 60 if re.search(r"(?i)(\bper minute\b|毎分|分ごと)", user_request) else 3600
+        with self.lock.read():
+            if self.log_stats.total_events == 0:
+                return None
+            table = self.log_stats.format_table(top_n=10, period_seconds=period_seconds, max_periods=48)
+        return f"【ログ統計（全件集計）】\n{table}"
+
+    def rank_anomalous_windows(self, top_n=3):
+        """異常スコアの高い時間帯を上位から返す"""
+        with self.lock.read():
+            return self.anomaly_detector.rank_windows(top_n=top_n)
+
+    def summarize_logs(self, user_request="ログの内容を要約してください", anomaly_windows=None, priority="interactive"):
+        """ユーザーの要求に基づいてログを要約（ナレッジベース統合）
+
+        anomaly_windows: 0より大きい場合、検索と文脈を異常スコア上位N個の時間帯に限定する
+        priority: 生成スケジューラーの優先度クラス（"interactive" または "batch"）
+        """
+        summary_prompt, direct_answer = self._prepare_summary(user_request, anomaly_windows)
+        if summary_prompt is None:
+            return direct_answer
+
+        # LLMで要約生成
+        summary = self.scheduler.generate(summary_prompt, priority)
+
+        return summary
 
-    def summarize_logs(self, user_request="ログの内容を要約してください"):
-        """ユーザーの要求に基づいてログを要約（ナレッジベース統合）"""
-        # RAGで関連するログエントリを検索
-        relevant_logs = self.rag.query(user_request, k=10)
+    def summarize_logs_stream(
+        self, user_request="ログの内容を要約してください", anomaly_windows=None, priority="interactive"
+    ):
+        """summarize_logsのストリーミング版（生成結果をテキスト片ごとに返す）"""
+        summary_prompt, direct_answer = self._prepare_summary(user_request, anomaly_windows)
+        if summary_prompt is None:
+            yield direct_answer
+            return
+
+        yield from self.scheduler.stream(summary_prompt, priority)
+
+    def summarize_logs_batch(self, user_requests, anomaly_windows=None, priority="batch"):
+        """複数の要求をまとめて要約（関連ログの検索は1回のバッチ検索で行い、生成はまとめて投入する）"""
+        windows = self._anomaly_windows(anomaly_windows)
+        time_ranges = [(window["start"], window["end"]) for window in windows] or None
+
+        answers = [self._stats_answer(user_request) for user_request in user_requests]
+        pending = [i for i, answer in enumerate(answers) if answer is None]
+        searched = self.rag.query_many([user_requests[i] for i in pending], k=10, time_ranges=time_ranges)
+
+        jobs = {}
+        for i, relevant_logs in zip(pending, searched):
+            summary_prompt, direct_answer = self._prepare_summary(
+                user_requests[i], windows=windows, relevant_logs=relevant_logs
+            )
+            if summary_prompt is None:
+                answers[i] = direct_answer
+                continue
+            jobs[i] = self.scheduler.submit(summary_prompt, priority, block=True)
+        for i, job in jobs.items():
+            answers[i] = job.result()
+        return answers
+
+    def _stats_answer(self, user_request):
+        """集計だけで答えられる質問であれば回答を返す（それ以外はNone）"""
+        if settings.STATS_ANSWER_WITHOUT_LLM:
+            return self.answer_from_stats(user_request)
+        return None
+
+    def _anomaly_windows(self, anomaly_windows=None):
+        if anomaly_windows is None:
+            anomaly_windows = settings.ANOMALY_TOP_WINDOWS
+        return self.rank_anomalous_windows(anomaly_windows) if anomaly_windows else []
+
+    def _prepare_summary(self, user_request, anomaly_windows=None, windows=None, relevant_logs=None):
+        """要約プロンプトを構築し (プロンプト, LLM不要の回答) を返す
+
+        windows / relevant_logs: 事前に求めた異常時間帯・検索結果（バッチ処理用）
+        """
+        if relevant_logs is None:
+            # 集計だけで答えられる質問は生成を行わない
+            stats_answer = self._stats_answer(user_request)
+            if stats_answer:
+                return None, stats_answer
+
+            windows = self._anomaly_windows(anomaly_windows)
+            time_ranges = [(window["start"], window["end"]) for window in windows] or None
+
+            # RAGで関連するログエントリを検索
+            relevant_logs = self.rag.query(user_request, k=10, time_ranges=time_ranges)
 
         if not relevant_logs:
-            return "関連するログエントリが見つかりませんでした。"
+            return None, "関連するログエントリが見つかりませんでした。"
 
         # 関連ログを文脈として組み合わせ
-        context = self._build_context(relevant_logs)
+        with metrics.span("prompt_build"):
+            context = self._build_context(relevant_logs)
+            if windows:
+                context = f"【異常検知された時間帯】:\n{self.anomaly_detector.format_windows(windows)}\n\n{context}"
 
         # ログから問題キーワードを抽出してナレッジベース検索
         knowledge_solutions = self._search_knowledge_for_logs(relevant_logs, user_request)
 
         # ナレッジベースの情報を含むプロンプトを構築
-        summary_prompt = self._build_enhanced_summary_prompt(user_request, context, knowledge_solutions)
-
-        # LLMで要約生成
-        summary = self.llm.input_text(summary_prompt)
-
-        return summary
+        with metrics.span("prompt_build"):
+            summary_prompt = self._build_enhanced_summary_prompt(user_request, context, knowledge_solutions)
+        metrics.increment("prompt.chars", len(summary_prompt))
+        return summary_prompt, None
 
     def _search_knowledge_for_logs(self, relevant_logs, user_request):
         """ログエントリからナレッジベースで関連する解決策を検索"""
         all_solutions = []
 
-        # ログエントリからキーワードを抽出
+        # ログエントリからキーワードを抽出（取り込み時のタグがあれば再走査しない）
         keywords = set()
         for log_entry in relevant_logs:
-            log_text = log_entry["text"].lower()
-
-            # 一般的な問題キーワードを抽出
-            problem_keywords = [
-                "データベース",
-                "database",
-                "メモリ",
-                "memory",
-                "ネットワーク",
-                "network",
-                "エラー",
-                "error",
-                "接続",
-                "connection",
-                "タイムアウト",
-                "timeout",
-                "ログイン",
-                "login",
-                "ssl",
-                "api",
-                "バックアップ",
-                "backup",
-                "ディスク",
-                "disk",
-                "プロセス",
-                "process",
-            ]
-
-            for keyword in problem_keywords:
-                if keyword in log_text:
-                    keywords.add(keyword)
+            signatures = log_entry.get("metadata", {}).get("signatures")
+            if signatures is not None:
+                keywords.update(signatures)
+            else:
+                keywords.update(self.signature_matcher.find_all(log_entry["text"]))
 
         # ユーザーリクエストからもキーワード抽出
-        request_text = user_request.lower()
-        for keyword in ["エラー", "error", "パフォーマンス", "performance", "セキュリティ", "security"]:
-            if keyword in request_text:
-                keywords.add(keyword)
+        keywords.update(self.request_matcher.find_all(user_request))
 
         # ナレッジベースで検索
         if keywords:
-            solutions = self.knowledge_base.search_solutions(list(keywords))
+            with metrics.span("kb_search"):
+                solutions = self.knowledge_base.search_solutions(list(keywords))
             all_solutions.extend(solutions[:3])  # 上位3件を使用
 
         return all_solutions
@@ -173,14 +417,21 @@ class LogSummarizer:
             for i, solution in enumerate(knowledge_solutions, 1):
                 knowledge_text += f"{i}. {self.knowledge_base.format_solution(solution)}\n"
 
+        stats_text = ""
+        if settings.STATS_IN_PROMPT:
+            with self.lock.read():
+                if self.log_stats.total_events:
+                    stats_text = f"\n\n【ログ統計（全件集計）】:\n{self.log_stats.format_table()}"
+
         return f"""以下のログエントリとナレッジベースに基づいて、ユーザーの要求に答えてください。
 
 ユーザーの要求: {user_request}
 
 関連するログエントリ:
-{context}{knowledge_text}
+{context}{stats_text}{knowledge_text}
 
 上記の情報を分析して、ユーザーの要求に適した要約を提供してください。
+件数や頻度はログ統計の数値を正として扱ってください。
 エラーや問題がある場合は重要度を示し、時系列や原因分析、具体的な対策を含めてください。
 ナレッジベースの対策情報がある場合は、それを参考にして実用的な解決案を提示してください。"""
 
@@ -188,7 +439,10 @@ class LogSummarizer:
         """関連ログから文脈を構築"""
         context_parts = []
         for i, log_entry in enumerate(relevant_logs[:5]):  # 上位5件を使用
-            context_parts.append(f"ログエントリ {i+1} (類似度: {log_entry['distance']:.2f}):\n{log_entry['text']}")
+            header = f"ログエントリ {i+1} (類似度: {log_entry['distance']:.2f}"
+            if log_entry.get("duplicates"):
+                header += f", ほぼ同じログ他{log_entry['duplicates']}件"
+            context_parts.append(f"{header}):\n{log_entry['text']}")
 
         return "\n\n".join(context_parts)
 
@@ -204,9 +458,11 @@ class LogSummarizer:
 上記のログエントリを分析して、ユーザーの要求に適した要約を提供してください。
 エラーや問題がある場合は重要度を示し、時系列や原因分析も含めてください。"""
 
-    def analyze_errors(self):
+    def analyze_errors(self, anomaly_windows=None):
         """エラーログの分析"""
-        return self.summarize_logs("エラーや例外について分析してください。原因と対策を含めて要約してください。")
+        return self.summarize_logs(
+            "エラーや例外について分析してください。原因と対策を含めて要約してください。", anomaly_windows=anomaly_windows
+        )
 
     def analyze_performance(self):
         """パフォーマンス関連の分析"""
@@ -216,6 +472,92 @@ class LogSummarizer:
         """時系列での要約"""
         return self.summarize_logs("時系列順でログの流れを要約してください。重要なイベントを時間順に整理してください。")
 
+    def save_snapshot(self, overwrite=False):
+        """前回保存以降の差分だけをスナップショットとして保存
+
+        overwrite: 読み込んでいない既存のスナップショットを置き換える（Falseでは保存しない）
+        """
+        if isinstance(self.rag, ShardedRAG):
+            return self.rag.save()
+        return self.rag.save_snapshot(settings.RAG_SNAPSHOT_PATH, settings.RAG_SNAPSHOT_COMPACT_EVERY, overwrite)
+
+    def load_latest_snapshot(self):
+        """最新のスナップショットを復元"""
+        if isinstance(self.rag, ShardedRAG):
+            return self.rag.load() > 0
+        rag = RAG.load_latest(
+            settings.RAG_SNAPSHOT_PATH, embedder=self.embedder, raw_vector_path=settings.RAG_RAW_VECTOR_PATH
+        )
+        if rag is None:
+            return False
+        self.rag = rag
+        return True
+
+    def apply_retention(self, retention_days=None):
+        """保持期間より古いシャードを削除（時間分割シャード使用時のみ）"""
+        retention_days = retention_days or settings.RAG_RETENTION_DAYS
+        if not retention_days or not isinstance(self.rag, ShardedRAG):
+            return []
+        return self.rag.apply_retention(retention_days)
+
+    def remove_log_file(self, file_path):
+        """指定したログファイル由来のチャンクを検索対象から削除し、ログ統計からもそのファイルのイベントを差し引く"""
+        removed = self.rag.remove_by_file(file_path)  # RAG内部の書き込みロックで排他される
+        with self.lock.write():
+            self.log_stats.remove_source(os.path.abspath(str(file_path)))
+        if removed:
+            print(f"ログファイル '{file_path}' のチャンクを{removed}件削除しました。")
+            self.schedule_compaction()
+        return removed
+
+    def remove_logs_before(self, timestamp):
+        """指定したUNIX時刻より前のチャンクを削除（ログ統計は変更しない）"""
+        removed = self.rag.remove_before(timestamp)
+        if removed:
+            print(f"{removed}件の古いチャンクを削除しました。")
+            self.schedule_compaction()
+        return removed
+
+    def reload_log_file(self, file_path):
+        """修正されたログファイルを再取り込み（以前取り込んだチャンクを削除してから読み込む）"""
+        self.remove_log_file(file_path)
+        return self.load_log_file(file_path)
+
+    def schedule_compaction(self):
+        """削除済みの多いインデックスを詰め直す（RAG_BACKGROUND_COMPACTIONが有効ならバックグラウンドで実行）"""
+        if not settings.RAG_BACKGROUND_COMPACTION:
+            self._compact()
+            return None
+        with self._compaction_lock:
+            if self._compaction_thread is None or not self._compaction_thread.is_alive():
+                self._compaction_thread = threading.Thread(target=self._compact, daemon=True)
+                self._compaction_thread.start()
+            return self._compaction_thread
+
+    def _compact(self):
+        rags = self.rag.compaction_candidates() if isinstance(self.rag, ShardedRAG) else [self.rag]
+        for rag in rags:
+            if not rag.needs_compaction():
+                continue
+            try:
+                # 作り直しは書き込みだけを止めて行われ、検索を止めるのは置き換えの瞬間だけになる
+                state = rag.build_compaction()
+                installed = rag.install_compaction(state)
+                if not installed:
+                    print("コンパクション中に更新があったため、次回に持ち越します")
+            except Exception as e:
+                print(f"コンパクションエラー: {e}")
+
+    def metrics_report(self):
+        """ステージごとの計測結果を返す（settings.METRICS_ENABLED が有効な場合）"""
+        return metrics.report()
+
+    def export_metrics(self, json_path=None, prometheus_path=None):
+        """計測結果をJSONレポートとPrometheusテキスト形式で書き出し"""
+        return metrics.export(
+            json_path or settings.METRICS_JSON_PATH, prometheus_path or settings.METRICS_PROMETHEUS_PATH
+        )
+
     def search_problem_solutions(self, problem_keywords):
         """特定の問題に対する解決策を直接検索"""
         solutions = self.knowledge_base.search_solutions(problem_keywords)
@@ -234,6 +576,7 @@ class LogSummarizer:
             problem_name, category, solution, details, prevention, reference
         )
         if success:
+            self.rebuild_signature_matcher()
             return f"新しい解決策を追加しました: {problem_name}"
         else:
             return "解決策の追加に失敗しました。"
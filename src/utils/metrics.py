@@ -0,0 +1,293 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", ".."))
+from config import settings
+
+
+# Prometheusヒストグラムのバケット境界（秒）
+HISTOGRAM_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0, float("inf"))
+
+
+def peak_rss_bytes():
+    """プロセスのピークRSS（取得できない環境ではNone）"""
+    try:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linuxはキロバイト、macOSはバイト単位
+        return peak if sys.platform == "darwin" else peak * 1024
+    except ImportError:
+        try:
+            import psutil
+
+            return psutil.Process().memory_info().peak_wset
+        except Exception:
+            return None
+
+
+def current_rss_bytes():
+    """現在のRSS（取得できない環境ではNone）"""
+    try:
+        with open("/proc/self/statm", "r") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        try:
+            import psutil
+
+            return psutil.Process().memory_info().rss
+        except Exception:
+            return None
+
+
+class _NullSpan:
+    """計測無効時に使う何もしないスパン"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _TimerStats:
+    __slots__ = ("count", "total", "min", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.buckets = [0] * len(HISTOGRAM_BUCKETS)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(HISTOGRAM_BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "total_seconds": self.total,
+            "mean_ms": self.total / self.count * 1000.0 if self.count else 0.0,
+            "min_ms": self.min * 1000.0 if self.count else 0.0,
+            "max_ms": self.max * 1000.0,
+        }
+
+
+class Metrics:
+    """処理ステージごとの時間計測・カウンタ・ゲージを記録する軽量な計測レイヤー
+
+    無効時は span() が共有の空スパンを返すだけなので、計測コードを残したままでも負荷はほぼない。
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """記録をすべて破棄"""
+        with self._lock:
+            self.timers = {}
+            self.counters = {}
+            self.gauges = {}
+            self.started_at = time.time()
+
+    def span(self, name):
+        """with文で使うステージ計測スパン"""
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def timed(self, name):
+        """関数全体を計測するデコレータ"""
+
+        def decorator(func):
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+
+            wrapper.__name__ = func.__name__
+            wrapper.__doc__ = func.__doc__
+            return wrapper
+
+        return decorator
+
+    def timed_iter(self, name, iterable):
+        """イテレータの各要素の取得時間を計測（読み込みステージ用）"""
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.observe(name, time.perf_counter() - start)
+                return
+            self.observe(name, time.perf_counter() - start)
+            yield item
+
+    def observe(self, name, seconds):
+        """経過時間を記録"""
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self.timers.get(name)
+            if stats is None:
+                stats = self.timers[name] = _TimerStats()
+            stats.add(seconds)
+
+    def increment(self, name, value=1):
+        """カウンタを加算"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        """ゲージを設定"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.gauges[name] = value
+
+    def max_gauge(self, name, value):
+        """ゲージを最大値で更新"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.gauges[name] = max(self.gauges.get(name, value), value)
+
+    def _memory_gauges(self):
+        gauges = {"memory.peak_rss_bytes": peak_rss_bytes(), "memory.rss_bytes": current_rss_bytes()}
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            gauges["memory.cuda_max_allocated_bytes"] = torch.cuda.max_memory_allocated()
+        return {name: value for name, value in gauges.items() if value is not None}
+
+    def report(self):
+        """計測結果を辞書で返す（キャッシュヒット率・トークン/秒などの派生値を含む）"""
+        with self._lock:
+            timers = {name: stats.as_dict() for name, stats in sorted(self.timers.items())}
+            counters = dict(sorted(self.counters.items()))
+            gauges = dict(sorted(self.gauges.items()))
+        gauges.update(self._memory_gauges())
+
+        # "<name>.hit" / "<name>.miss" のカウンタ組からヒット率を算出
+        hit_rates = {}
+        for name, hits in counters.items():
+            if name.endswith(".hit"):
+                base = name[: -len(".hit")]
+                total = hits + counters.get(base + ".miss", 0)
+                hit_rates[base] = hits / total if total else 0.0
+
+        derived = {"cache_hit_rates": hit_rates}
+        decode = timers.get("llm.decode")
+        if decode and decode["total_seconds"] > 0:
+            derived["decode_tokens_per_sec"] = counters.get("llm.generated_tokens", 0) / decode["total_seconds"]
+        prefill = timers.get("llm.prefill")
+        if prefill and prefill["total_seconds"] > 0:
+            derived["prefill_tokens_per_sec"] = counters.get("llm.prompt_tokens", 0) / prefill["total_seconds"]
+
+        return {
+            "enabled": self.enabled,
+            "started_at": self.started_at,
+            "elapsed_seconds": time.time() - self.started_at,
+            "timers": timers,
+            "counters": counters,
+            "gauges": gauges,
+            "derived": derived,
+        }
+
+    def prometheus_text(self, prefix="log_analyzer"):
+        """Prometheusのテキスト形式で出力"""
+
+        def metric_name(name):
+            return f"{prefix}_" + "".join(c if c.isalnum() else "_" for c in name)
+
+        lines = []
+        with self._lock:
+            timers = list(self.timers.items())
+            counters = list(self.counters.items())
+            gauges = dict(self.gauges)
+        gauges.update(self._memory_gauges())
+
+        for name, stats in sorted(timers):
+            metric = metric_name(name) + "_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, count in zip(HISTOGRAM_BUCKETS, stats.buckets):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{metric}_bucket{{le="{le}"}} {cumulative}')
+            lines.append(f"{metric}_sum {stats.total}")
+            lines.append(f"{metric}_count {stats.count}")
+        for name, value in sorted(counters):
+            metric = metric_name(name) + "_total"
+            lines.append(f"# TYPE {metric} counter")
+            lines.append(f"{metric} {value}")
+        for name, value in sorted(gauges.items()):
+            metric = metric_name(name)
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value}")
+        return "\n".join(lines) + "\n"
+
+    def export(self, json_path=None, prometheus_path=None):
+        """JSONレポートとPrometheusテキストをファイルに書き出し"""
+        try:
+            if json_path:
+                os.makedirs(os.path.dirname(os.path.abspath(json_path)), exist_ok=True)
+                with open(json_path, "w", encoding="utf-8") as file:
+                    json.dump(self.report(), file, ensure_ascii=False, indent=2)
+            if prometheus_path:
+                os.makedirs(os.path.dirname(os.path.abspath(prometheus_path)), exist_ok=True)
+                with open(prometheus_path, "w", encoding="utf-8") as file:
+                    file.write(self.prometheus_text())
+            return True
+        except Exception as e:
+            print(f"メトリクス出力エラー: {e}")
+            return False
+
+
+# プロセス共通の計測インスタンス
+metrics = Metrics(enabled=settings.METRICS_ENABLED)
+
+
+@contextmanager
+def enabled_metrics():
+    """一時的に計測を有効化するコンテキスト（ベンチマーク用）"""
+    previous = metrics.enabled
+    metrics.enabled = True
+    try:
+        yield metrics
+    finally:
+        metrics.enabled = previous
@@ -0,0 +1,70 @@
+import threading
+from contextlib import contextmanager
+
+
+class ReadWriteLock:
+    """複数の読み取りと単一の書き込みを排他する読み書きロック（書き込み優先）
+
+    書き込み待ちがある間は新しい読み取りを待たせるため、検索が続いても取り込みが止まらない。
+    保存などの長い読み取りは stable() で書き込みだけを止める（その間も読み取りは待たされない）。
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+        self._write_gate = threading.Lock()  # 書き込みと stable() の排他（書き込みはこれを取ってから待つ）
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._waiting_writers:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        self._write_gate.acquire()
+        with self._cond:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+        self._write_gate.release()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+    @contextmanager
+    def stable(self):
+        """書き込みだけを止めて状態を固定する（読み取りロックを長く持たずに済ませる保存・作り直し用）
+
+        書き込み待ちは stable() の終了までゲートで止まり、書き込み待ちとして登録されないため、
+        その間も新しい読み取りは待たされない。stable() の中で write() を取ってはならない。
+        """
+        with self._write_gate:
+            yield